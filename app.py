@@ -1,105 +1,1581 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, g, has_request_context, Response, stream_with_context
+from flask import before_render_template, template_rendered
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import extract, func
-from collections import Counter
+from flask_sqlalchemy.session import Session as FlaskSession
+from sqlalchemy import func, select, or_, and_, not_, cast, event, inspect, text, case, exists, bindparam, delete, create_engine
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, joinedload, contains_eager, declared_attr, with_loader_criteria
+from sqlalchemy.dialects import postgresql, sqlite
+import click
+from array import array
+from bisect import bisect_left
+from collections import Counter, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import closing, contextmanager
+from contextvars import ContextVar
 from datetime import datetime, time, date, timedelta
+from difflib import SequenceMatcher
+from itertools import chain, islice
+import base64
+import csv
+import gzip
+import importlib
+import io
+import json
 import os
+import queue
+import sqlite3
+import threading
+import time as clock
+
+import sa_time
+
+def database_url():
+    """DATABASE_URL, accepting the postgres:// scheme Render and Heroku hand out"""
+    url = os.environ.get('DATABASE_URL', 'sqlite:///fitness.db')
+    if url.startswith('postgres://'):
+        # SQLAlchemy only knows postgresql://, which uses the psycopg2 driver
+        url = 'postgresql://' + url[len('postgres://'):]
+    return url
+
+def engine_options(url):
+    """Pool settings per backend; every gunicorn worker gets its own pool"""
+    if url.startswith('sqlite'):
+        # The sqlite3 timeout is the busy wait for the first lock; PRAGMAs are set on connect
+        return {'connect_args': {'timeout': app.config['SQLITE_BUSY_TIMEOUT'] / 1000}}
+    return {'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+            'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+            'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+            'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+            'pool_pre_ping': True}
 
 app = Flask(__name__)
 app.secret_key = "secret123"         
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///fitness.db'
+# SQLite: WAL lets readers run alongside the single writer, and writers wait
+# up to SQLITE_BUSY_TIMEOUT ms for the lock instead of failing with 'database is locked'
+app.config['SQLITE_JOURNAL_MODE'] = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+app.config['SQLITE_SYNCHRONOUS'] = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+app.config['SQLITE_BUSY_TIMEOUT'] = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))
+# SQLite only enforces foreign keys (and ON DELETE CASCADE) when asked to, per connection
+app.config['SQLITE_FOREIGN_KEYS'] = os.environ.get('SQLITE_FOREIGN_KEYS', '1') == '1'
+app.config['SQLALCHEMY_DATABASE_URI'] = database_url()
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db = SQLAlchemy(app)
+# 'memory' keeps dashboard metrics per process, 'shared' shares them between gunicorn workers.
+# Invalidation on write only reaches the writing process's memory cache, so several workers share by default
+app.config['CACHE_BACKEND'] = os.environ.get(
+    'CACHE_BACKEND', 'shared' if int(os.environ.get('WEB_CONCURRENCY') or 1) > 1 else 'memory')
+app.config['CACHE_PATH'] = os.environ.get('CACHE_PATH', os.path.join(app.instance_path, 'metrics_cache.db'))
+app.config['PAGE_SIZE'] = int(os.environ.get('PAGE_SIZE', 50))
+app.config['IMPORT_BATCH_SIZE'] = int(os.environ.get('IMPORT_BATCH_SIZE', 1000))
+# 'console' prints messages, 'fake' records them in memory, or 'package.module:GatewayClass'
+app.config['SMS_GATEWAY'] = os.environ.get('SMS_GATEWAY', 'console')
+app.config['SMS_WORKERS'] = int(os.environ.get('SMS_WORKERS', 4))
+app.config['SMS_RATE_PER_SECOND'] = float(os.environ.get('SMS_RATE_PER_SECOND', 50))
+app.config['SMS_MAX_RETRIES'] = int(os.environ.get('SMS_MAX_RETRIES', 3))
+# Daily reminder scan: enable with REMINDER_SCHEDULER=1 (checks every SCHEDULER_INTERVAL seconds)
+app.config['REMINDER_SCHEDULER'] = os.environ.get('REMINDER_SCHEDULER', '') == '1'
+app.config['SCHEDULER_INTERVAL'] = int(os.environ.get('SCHEDULER_INTERVAL', 300))
+# A run still 'running' after this many seconds is taken to have died with its worker and is retaken
+app.config['SCHEDULED_RUN_TIMEOUT'] = int(os.environ.get('SCHEDULED_RUN_TIMEOUT', 3600))
+# Expired members keep getting (at most daily) reminders for this many days
+app.config['EXPIRED_REMINDER_DAYS'] = int(os.environ.get('EXPIRED_REMINDER_DAYS', 7))
+# Requests issuing more queries than this are logged (or fail when QUERY_COUNT_STRICT is set)
+app.config['QUERY_COUNT_LIMIT'] = int(os.environ.get('QUERY_COUNT_LIMIT', 25))
+app.config['QUERY_COUNT_STRICT'] = os.environ.get('QUERY_COUNT_STRICT', '') == '1'
+# Log every SQL statement slower than this many milliseconds (0 disables the slow-query log)
+app.config['SLOW_QUERY_MS'] = float(os.environ.get('SLOW_QUERY_MS', 0))
+# The classes page shows this many days at a time; the dashboard counts upcoming classes this far ahead
+app.config['CLASS_WINDOW_DAYS'] = int(os.environ.get('CLASS_WINDOW_DAYS', 28))
+app.config['UPCOMING_CLASS_DAYS'] = int(os.environ.get('UPCOMING_CLASS_DAYS', 7))
+# Recurring classes are created and browsed at most this many days ahead
+app.config['CLASS_HORIZON_DAYS'] = int(os.environ.get('CLASS_HORIZON_DAYS', 365))
+# Kiosk check-ins arriving within this window share one commit; turnstiles may
+# authenticate with an X-Kiosk-Token header instead of a staff login
+app.config['CHECKIN_COMMIT_WINDOW_MS'] = float(os.environ.get('CHECKIN_COMMIT_WINDOW_MS', 5))
+app.config['ACTIVE_MEMBER_CACHE_TTL'] = int(os.environ.get('ACTIVE_MEMBER_CACHE_TTL', 60))
+app.config['KIOSK_TOKEN'] = os.environ.get('KIOSK_TOKEN')
+# Seconds before the in-process membership index reloads to see other workers' edits
+app.config['MEMBERSHIP_INDEX_TTL'] = int(os.environ.get('MEMBERSHIP_INDEX_TTL', 300))
+# Live dashboard updates: how often each worker polls the event log, how often
+# idle streams send a keep-alive, how long events are kept for reconnects, and
+# how long one stream stays open before the browser is told to reconnect
+app.config['LIVE_POLL_INTERVAL'] = float(os.environ.get('LIVE_POLL_INTERVAL', 1.0))
+app.config['LIVE_HEARTBEAT'] = int(os.environ.get('LIVE_HEARTBEAT', 15))
+app.config['LIVE_EVENT_RETENTION'] = int(os.environ.get('LIVE_EVENT_RETENTION', 3600))
+app.config['LIVE_STREAM_LIFETIME'] = int(os.environ.get('LIVE_STREAM_LIFETIME', 300))
+# Orphan cleanup deletes this many rows per transaction so the write lock is never held for long
+app.config['ORPHAN_BATCH_SIZE'] = int(os.environ.get('ORPHAN_BATCH_SIZE', 5000))
+# Check-ins and reminders older than ARCHIVE_AFTER_DAYS move to monthly gzipped CSV files in ARCHIVE_DIR
+app.config['ARCHIVE_DIR'] = os.environ.get('ARCHIVE_DIR', os.path.join(app.instance_path, 'archive'))
+app.config['ARCHIVE_AFTER_DAYS'] = int(os.environ.get('ARCHIVE_AFTER_DAYS', 365))
+app.config['ARCHIVE_BATCH_SIZE'] = int(os.environ.get('ARCHIVE_BATCH_SIZE', 5000))
+# Optional database per branch, e.g. sqlite:///branch-{branch}.db (the first branch stays in DATABASE_URL)
+app.config['BRANCH_DATABASE_URL'] = os.environ.get('BRANCH_DATABASE_URL', '')
+
+# Branches - every club location's members and activity carry a branch_id,
+# and ORM queries only see the rows of the logged-in user's branch. With
+# BRANCH_DATABASE_URL each branch but the first keeps its rows in a database
+# of its own; users and the branch list always live in the main database
+DEFAULT_BRANCH_ID = 1
+DIRECTORY_TABLES = {'user', 'branch'}
+
+class BranchRoutingSession(FlaskSession):
+    """db.session that sends branch data to the current branch's database when BRANCH_DATABASE_URL is set"""
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and app.config['BRANCH_DATABASE_URL']:
+            branch_id = current_branch_id()
+            table = inspect(mapper).local_table if mapper is not None else getattr(clause, 'table', None)
+            if branch_id not in (None, DEFAULT_BRANCH_ID) and getattr(table, 'name', None) not in DIRECTORY_TABLES:
+                return branch_engine(branch_id)
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+db = SQLAlchemy(app, session_options={'class_': BranchRoutingSession})
+
+def apply_sqlite_pragmas(dbapi_connection):
+    """Configure a raw SQLite connection (sqlite3, or aiosqlite's adapter in asgi.py)"""
+    with closing(dbapi_connection.cursor()) as cursor:
+        cursor.execute(f"PRAGMA journal_mode={app.config['SQLITE_JOURNAL_MODE']}")
+        cursor.execute(f"PRAGMA synchronous={app.config['SQLITE_SYNCHRONOUS']}")
+        cursor.execute(f"PRAGMA busy_timeout={int(app.config['SQLITE_BUSY_TIMEOUT'])}")
+        cursor.execute(f"PRAGMA foreign_keys={'ON' if app.config['SQLITE_FOREIGN_KEYS'] else 'OFF'}")
+
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Applied to every new SQLite connection in the pool"""
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        apply_sqlite_pragmas(dbapi_connection)
+
+# (branch_id, filtered) set by branch_scope(); requests otherwise use the logged-in user's branch
+_branch_scope = ContextVar('branch_scope', default=None)
+
+@contextmanager
+def branch_scope(branch_id, filtered=True):
+    """Run the block as ``branch_id``; with filtered=False queries see every branch in its database"""
+    token = _branch_scope.set((branch_id, filtered))
+    try:
+        yield
+    finally:
+        _branch_scope.reset(token)
+
+def all_branches():
+    """Scope for maintenance that must see every branch sharing the current database"""
+    return branch_scope(current_branch_id(), filtered=False)
+
+def current_branch_id():
+    """Branch of the enclosing branch_scope, else the logged-in user's, else None"""
+    scope = _branch_scope.get()
+    if scope is not None:
+        return scope[0]
+    if has_request_context() and 'user' in session:
+        return session.get('branch_id', DEFAULT_BRANCH_ID)
+    return None
+
+def branch_filter_id():
+    """Branch ORM SELECTs are restricted to, or None"""
+    scope = _branch_scope.get()
+    if scope is not None and not scope[1]:
+        return None
+    return current_branch_id()
+
+def default_branch_id():
+    """Branch new rows belong to when none is given"""
+    return current_branch_id() or DEFAULT_BRANCH_ID
+
+class Branch(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), unique=True, nullable=False)
+
+class BranchScoped:
+    """Mixin for rows that belong to one branch"""
+    @declared_attr
+    def branch_id(cls):
+        return db.Column(db.Integer, db.ForeignKey('branch.id'), nullable=False,
+                         default=default_branch_id, server_default=str(DEFAULT_BRANCH_ID))
+
+@event.listens_for(Session, 'do_orm_execute')
+def filter_to_branch(state):
+    """Restrict every ORM SELECT, bulk UPDATE and bulk DELETE (joins and subqueries included) to the current branch"""
+    branch_id = branch_filter_id()
+    if branch_id is None or state.is_column_load or state.is_relationship_load:
+        return
+    if state.is_select or (state.is_orm_statement and (state.is_update or state.is_delete)):
+        state.statement = state.statement.options(
+            with_loader_criteria(BranchScoped, lambda cls: cls.branch_id == branch_id, include_aliases=True))
+
+_branch_engines = {}
+_branch_engines_lock = threading.Lock()
+
+def branch_engine(branch_id):
+    """Engine for a branch's own database, whose schema is created on first use"""
+    engine = _branch_engines.get(branch_id)
+    if engine is not None:
+        return engine
+    with _branch_engines_lock:
+        if branch_id not in _branch_engines:
+            with db.engine.connect() as conn:
+                branch = conn.execute(select(Branch.id, Branch.name).where(Branch.id == branch_id)).first()
+            if branch is None:
+                raise LookupError(f"Unknown branch {branch_id}")
+            url = app.config['BRANCH_DATABASE_URL'].format(branch=branch_id)
+            engine = create_engine(url, **engine_options(url))
+            db.metadata.create_all(engine)
+            # Rows reference their branch, so each database keeps a copy of its own branch row
+            with engine.begin() as conn:
+                if conn.execute(select(Branch.id).where(Branch.id == branch_id)).first() is None:
+                    conn.execute(Branch.__table__.insert().values(id=branch.id, name=branch.name))
+            upgrade_schema(engine)
+            _branch_engines[branch_id] = engine
+    return _branch_engines[branch_id]
+
+def branch_databases():
+    """Loop once per database for jobs and commands, scoped to all the branches stored in it"""
+    if not app.config['BRANCH_DATABASE_URL']:
+        with branch_scope(None):
+            yield None
+        return
+    for branch_id in db.session.scalars(select(Branch.id).order_by(Branch.id)).all():
+        with branch_scope(branch_id, filtered=False):
+            yield branch_id
+        # Ids repeat across databases, so never carry objects from one into the next
+        db.session.remove()
+
+class BranchRegistry(dict):
+    """One ``factory(branch_id)`` per branch, created on first use"""
+    def __init__(self, factory):
+        super().__init__()
+        self.factory = factory
+        self._lock = threading.Lock()
+
+    def __missing__(self, branch_id):
+        with self._lock:
+            if branch_id not in self:
+                self[branch_id] = self.factory(branch_id)
+            return self[branch_id]
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(100), unique=True, nullable=False)
     password = db.Column(db.String(100), nullable=False)
     role = db.Column(db.String(50), default="member")
+    branch_id = db.Column(db.Integer, db.ForeignKey('branch.id'))  # None: the first branch
 
-class Trainer(db.Model):
+class Trainer(BranchScoped, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(150))
     specialty = db.Column(db.String(100))
     contact = db.Column(db.String(50))
 
-class GymClass(db.Model):
+    __table_args__ = (
+        db.Index('ix_trainer_branch_name', 'branch_id', 'name'),
+    )
+
+class GymClass(BranchScoped, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     trainer = db.Column(db.String(100))
     date = db.Column(db.Date, nullable=False)
     time = db.Column(db.String(50))
     capacity = db.Column(db.Integer)
+    # UTC start derived from date + time, so upcoming/today lookups are indexed ranges
+    starts_at = db.Column(db.DateTime)
+    booked = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Occurrences of a recurring series; cancelled ones are kept so they are not re-created
+    series_id = db.Column(db.Integer, db.ForeignKey('class_series.id', ondelete='CASCADE'))
+    cancelled = db.Column(db.Boolean, nullable=False, default=False, server_default='0')
+
+    __table_args__ = (
+        db.Index('ix_gym_class_series_date', 'series_id', 'date', unique=True),
+        db.Index('ix_gym_class_branch_date', 'branch_id', 'date'),
+        db.Index('ix_gym_class_branch_starts_at', 'branch_id', 'starts_at'),
+    )
     
     def is_upcoming(self):
-        today = datetime.today().date()
+        today = sa_time.sa_today()
         return self.date >= today
 
-class Member(db.Model):
+    def spots_left(self):
+        return None if self.capacity is None else max(self.capacity - (self.booked or 0), 0)
+
+class ClassSeries(BranchScoped, db.Model):
+    """A weekly class pattern; its GymClass occurrences are only created for windows someone looks at"""
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    trainer = db.Column(db.String(100))
+    time = db.Column(db.String(50))
+    capacity = db.Column(db.Integer)
+    weekdays = db.Column(db.String(30), nullable=False)  # RRULE BYDAY codes, e.g. 'MO,WE,FR'
+    interval = db.Column(db.Integer, nullable=False, default=1)  # every N weeks
+    starts_on = db.Column(db.Date, nullable=False)
+    ends_on = db.Column(db.Date)  # None repeats forever
+    # Last day whose occurrences already exist as GymClass rows
+    expanded_through = db.Column(db.Date)
+    occurrences = db.relationship('GymClass', backref='series', cascade='all, delete-orphan')
+
+    __table_args__ = (
+        db.Index('ix_class_series_branch', 'branch_id'),
+    )
+
+class Member(BranchScoped, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(150), nullable=False)
     membership_type = db.Column(db.String(100), nullable=False)
-    phone = db.Column(db.String(20)) 
+    phone = db.Column(db.String(20), index=True)
     expiry_date = db.Column(db.Date, nullable=False)
 
+    __table_args__ = (
+        db.Index('ix_member_branch_name', 'branch_id', 'name'),
+        db.Index('ix_member_branch_expiry', 'branch_id', 'expiry_date'),
+    )
+
     def is_active(self):
-        today = datetime.today().date()
+        today = sa_time.sa_today()
         return self.expiry_date >= today
 
     def get_price(self):
         prices = {'Monthly': 300, 'Quarterly': 800, 'Yearly': 3000}
         return prices.get(self.membership_type, 0)
 
-class PaymentReminder(db.Model):
+class PaymentReminder(BranchScoped, db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    member_id = db.Column(db.Integer, db.ForeignKey('member.id'), nullable=False)
+    member_id = db.Column(db.Integer, db.ForeignKey('member.id', ondelete='CASCADE'), nullable=False)
     reminder_type = db.Column(db.String(50))  # 'expiry_3_days', 'expiry_today', 'expired'
     sent_date = db.Column(db.DateTime, default=datetime.utcnow)
     status = db.Column(db.String(50), default='sent')
-    member = db.relationship('Member', backref='reminders')
+    member = db.relationship('Member', backref=db.backref('reminders', cascade='all, delete-orphan'))
 
-class Payment(db.Model):
+    # Looked up by (member, type, day) to avoid texting a member twice a day;
+    # dashboards, archiving and history reports select a branch's days
+    __table_args__ = (
+        db.Index('ix_payment_reminder_member_type_sent', 'member_id', 'reminder_type', 'sent_date'),
+        db.Index('ix_payment_reminder_branch_sent', 'branch_id', 'sent_date'),
+    )
+
+class Payment(BranchScoped, db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    member_id = db.Column(db.Integer, db.ForeignKey('member.id'), nullable=False)
+    # Payments outlive their member so revenue history stays intact; NULL once the member is deleted
+    member_id = db.Column(db.Integer, db.ForeignKey('member.id', ondelete='SET NULL'), index=True)
     amount = db.Column(db.Float, nullable=False)
     date = db.Column(db.Date, nullable=False)
     method = db.Column(db.String(50))
     member = db.relationship('Member', backref='payments')
 
-class Checkin(db.Model):
+    __table_args__ = (
+        db.Index('ix_payment_branch_date', 'branch_id', 'date'),
+    )
+
+class Checkin(BranchScoped, db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    member_id = db.Column(db.Integer, db.ForeignKey('member.id'))
+    member_id = db.Column(db.Integer, db.ForeignKey('member.id', ondelete='CASCADE'))
     checkin_time = db.Column(db.DateTime, default=datetime.utcnow)
-    member = db.relationship('Member', backref='checkins')
+    # SA-local day of checkin_time, stored so lookups by day can use an index
+    checkin_date = db.Column(db.Date)
+    member = db.relationship('Member', backref=db.backref('checkins', cascade='all, delete-orphan'))
+
+    __table_args__ = (
+        # One check-in per member per SA-local day
+        db.Index('ix_checkin_member_day', 'member_id', 'checkin_date', unique=True),
+        db.Index('ix_checkin_branch_day_time', 'branch_id', 'checkin_date', 'checkin_time'),
+    )
 
-def send_sms_reminder(member, reminder_type):
-    phone = member.phone
-    if not phone:
-        return False, "No phone number available"
-    
-    today = datetime.today().date()
+@event.listens_for(Session, 'before_flush')
+def assign_branch(session, flush_context, instances):
+    """New rows belong to their member's branch, or else to the current one"""
+    for obj in session.new:
+        if isinstance(obj, BranchScoped) and obj.branch_id is None:
+            member = obj.__dict__.get('member')
+            if member is None and getattr(obj, 'member_id', None):
+                with session.no_autoflush:
+                    member = session.get(Member, obj.member_id)
+            obj.branch_id = member.branch_id if member is not None else default_branch_id()
+
+@event.listens_for(Checkin, 'before_insert')
+def set_checkin_date(mapper, connection, checkin):
+    if checkin.checkin_time is None:
+        checkin.checkin_time = datetime.utcnow()
+    checkin.checkin_date = sa_time.sa_day(checkin.checkin_time)
+
+class ClassBooking(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    class_id = db.Column(db.Integer, db.ForeignKey('gym_class.id', ondelete='CASCADE'), nullable=False)
+    member_id = db.Column(db.Integer, db.ForeignKey('member.id', ondelete='CASCADE'), nullable=False, index=True)
+    booked_at = db.Column(db.DateTime, default=datetime.utcnow)
+    gym_class = db.relationship('GymClass', backref=db.backref('bookings', cascade='all, delete-orphan'))
+    member = db.relationship('Member', backref=db.backref('bookings', cascade='all, delete-orphan'))
+
+    __table_args__ = (
+        # A member holds at most one spot per class
+        db.Index('ix_class_booking_class_member', 'class_id', 'member_id', unique=True),
+    )
+
+def class_starts_at(day, time_text):
+    """UTC start of a class from its SA-local date and 'HH:MM' time (start of day if no valid time)"""
+    try:
+        start = datetime.strptime((time_text or '').strip(), '%H:%M').time()
+    except ValueError:
+        start = time.min
+    return sa_time.to_utc(datetime.combine(day, start))
+
+@event.listens_for(GymClass, 'before_insert')
+@event.listens_for(GymClass, 'before_update')
+def set_class_starts_at(mapper, connection, gym_class):
+    gym_class.starts_at = class_starts_at(gym_class.date, gym_class.time)
+
+@app.template_filter('sa_local')
+def sa_local(utc_naive, fmt='%H:%M:%S'):
+    """Render a stored UTC timestamp as SA-local time"""
+    return sa_time.to_sa(utc_naive).strftime(fmt) if utc_naive else ''
+
+# Query counting - catches N+1 regressions where a page fires one SELECT per row
+class TooManyQueriesError(RuntimeError):
+    pass
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def count_request_queries(conn, cursor, statement, parameters, context, executemany):
+    # Kept on the statement's own context: a statement that raises never reaches after_cursor_execute
+    context.query_started = clock.perf_counter()
+    if has_request_context():
+        g.query_count = g.get('query_count', 0) + 1
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def time_request_queries(conn, cursor, statement, parameters, context, executemany):
+    elapsed = clock.perf_counter() - context.query_started
+    if has_request_context():
+        g.sql_time = g.get('sql_time', 0.0) + elapsed
+    slow_ms = app.config['SLOW_QUERY_MS']
+    if slow_ms and elapsed * 1000 >= slow_ms:
+        where = f"{request.method} {request.path}" if has_request_context() else "background"
+        app.logger.warning("Slow query (%.1f ms) during %s: %s", elapsed * 1000, where, statement)
+
+@app.after_request
+def check_query_count(response):
+    count = g.get('query_count', 0)
+    response.headers['X-Query-Count'] = str(count)
+    # Batch endpoints opt out by setting g.query_count_limit = None
+    limit = g.get('query_count_limit', app.config['QUERY_COUNT_LIMIT'])
+    if limit is not None and count > limit:
+        message = f"{request.method} {request.path} issued {count} queries (limit {limit})"
+        if app.config['QUERY_COUNT_STRICT'] or app.testing:
+            raise TooManyQueriesError(message)
+        app.logger.warning(message)
+    return response
+
+# Request profiling - per-endpoint histograms of wall time, query count, SQL
+# time and template render time, exposed at /metrics in Prometheus format.
+# Each gunicorn worker keeps its own histograms
+class Histogram:
+    """Prometheus-style cumulative histogram keyed by a tuple of label values"""
+    def __init__(self, name, help_text, label_names, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['buckets'][i] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, series in sorted(self._series.items()):
+                base = ','.join(f'{name}="{value}"' for name, value in zip(self.label_names, labels))
+                for bound, count in zip(self.buckets, series['buckets']):
+                    lines.append(f'{self.name}_bucket{{{base},le="{bound}"}} {count}')
+                lines.append(f'{self.name}_bucket{{{base},le="+Inf"}} {series["count"]}')
+                lines.append(f'{self.name}_sum{{{base}}} {series["sum"]:.6f}')
+                lines.append(f'{self.name}_count{{{base}}} {series["count"]}')
+        return '\n'.join(lines)
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250)
+REQUEST_HISTOGRAMS = {
+    'duration': Histogram('fitness_request_duration_seconds', 'Wall time per request',
+                          ('endpoint', 'method'), SECONDS_BUCKETS),
+    'queries': Histogram('fitness_request_queries', 'SQL statements per request',
+                         ('endpoint', 'method'), QUERY_BUCKETS),
+    'sql': Histogram('fitness_request_sql_seconds', 'Time spent in SQL per request',
+                     ('endpoint', 'method'), SECONDS_BUCKETS),
+    'template': Histogram('fitness_request_template_seconds', 'Template render time per request',
+                          ('endpoint', 'method'), SECONDS_BUCKETS),
+}
+
+@app.before_request
+def start_request_timer():
+    g.request_started = clock.perf_counter()
+
+@before_render_template.connect_via(app)
+def start_template_timer(sender, template, context, **extra):
+    g.setdefault('template_started', []).append(clock.perf_counter())
+
+@template_rendered.connect_via(app)
+def stop_template_timer(sender, template, context, **extra):
+    started = g.get('template_started')
+    if started:
+        g.template_time = g.get('template_time', 0.0) + clock.perf_counter() - started.pop()
+
+@app.teardown_request
+def record_request_metrics(exc=None):
+    # Teardown also runs for requests that end in an unhandled exception (a 500)
+    if 'request_started' in g:
+        labels = (request.endpoint or 'unknown', request.method)
+        REQUEST_HISTOGRAMS['duration'].observe(labels, clock.perf_counter() - g.request_started)
+        REQUEST_HISTOGRAMS['queries'].observe(labels, g.get('query_count', 0))
+        REQUEST_HISTOGRAMS['sql'].observe(labels, g.get('sql_time', 0.0))
+        REQUEST_HISTOGRAMS['template'].observe(labels, g.get('template_time', 0.0))
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus scrape endpoint for this worker's request histograms"""
+    body = '\n'.join(h.render() for h in REQUEST_HISTOGRAMS.values())
+    return Response(body + '\n', mimetype='text/plain; version=0.0.4')
+
+# Daily rollups keyed by branch and SA-local day so historical views read O(days) rows
+class DailyCheckinRollup(BranchScoped, db.Model):
+    branch_id = db.Column(db.Integer, db.ForeignKey('branch.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    membership_type = db.Column(db.String(100), primary_key=True)
+    checkins = db.Column(db.Integer, nullable=False, default=0)
+
+class DailyRevenueRollup(BranchScoped, db.Model):
+    branch_id = db.Column(db.Integer, db.ForeignKey('branch.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    method = db.Column(db.String(50), primary_key=True)
+    payments = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Float, nullable=False, default=0.0)
+
+class DailyClassRollup(BranchScoped, db.Model):
+    branch_id = db.Column(db.Integer, db.ForeignKey('branch.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    classes = db.Column(db.Integer, nullable=False, default=0)
+
+def sa_date_expr(column):
+    """SQL expression for the SA-local date of a UTC timestamp column"""
+    hours = sa_time.utc_offset_hours()
+    if db.engine.dialect.name == 'sqlite':
+        return func.date(column, f'{hours:+d} hours', type_=db.Date)
+    return cast(column + timedelta(hours=hours), db.Date)
+
+def bump_rollup(connection, model, keys, increments):
+    """Atomically add ``increments`` to the rollup row identified by ``keys``"""
+    table = model.__table__
+    values = dict(keys, **increments)
+    dialect = connection.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        insert = (sqlite if dialect == 'sqlite' else postgresql).insert(table).values(**values)
+        stmt = insert.on_conflict_do_update(
+            index_elements=list(keys),
+            set_={col: table.c[col] + insert.excluded[col] for col in increments}
+        )
+        connection.execute(stmt)
+        return
+    result = connection.execute(
+        table.update()
+        .where(*[table.c[k] == v for k, v in keys.items()])
+        .values({col: table.c[col] + delta for col, delta in increments.items()})
+    )
+    if result.rowcount == 0:
+        connection.execute(table.insert().values(**values))
+
+def apply_rollup_deltas(connection, checkins=None, revenue=None, classes=None):
+    """Write accumulated rollup deltas, skipping anything that nets to zero.
+
+    Keys are (branch, day, membership type), (branch, day, method) and (branch, day).
+    """
+    for (branch_id, day, membership_type), n in (checkins or {}).items():
+        if n:
+            bump_rollup(connection, DailyCheckinRollup,
+                        {'branch_id': branch_id, 'day': day, 'membership_type': membership_type}, {'checkins': n})
+    for (branch_id, day, method), (n, amount) in (revenue or {}).items():
+        if n or amount:
+            bump_rollup(connection, DailyRevenueRollup,
+                        {'branch_id': branch_id, 'day': day, 'method': method}, {'payments': n, 'total': amount})
+    for (branch_id, day), n in (classes or {}).items():
+        if n:
+            bump_rollup(connection, DailyClassRollup, {'branch_id': branch_id, 'day': day}, {'classes': n})
+    # Every rollup change is also a live counter change for open dashboards
+    publish_rollup_deltas(connection, checkins, revenue, classes)
+
+def rollup_inserted(connection, model, rows):
+    """Roll up Checkin, Payment or GymClass rows written with a Core INSERT.
+
+    Bulk paths insert through the table rather than the ORM, so update_rollups never
+    sees them. ``rows`` are the inserted column dicts; check-ins also carry their
+    member's 'membership_type'.
+    """
+    if model is Checkin:
+        apply_rollup_deltas(connection, checkins=Counter(
+            (row['branch_id'], row['checkin_date'], row['membership_type']) for row in rows))
+    elif model is Payment:
+        revenue = {}
+        for row in rows:
+            key = (row['branch_id'], row['date'], row['method'] or '')
+            count, total = revenue.get(key, (0, 0.0))
+            revenue[key] = (count + 1, total + row['amount'])
+        apply_rollup_deltas(connection, revenue=revenue)
+    elif model is GymClass:
+        apply_rollup_deltas(connection, classes=Counter(
+            (row['branch_id'], row['date']) for row in rows if not row.get('cancelled')))
+
+def _previous(obj, attr):
+    """Value of ``attr`` before the current flush"""
+    history = inspect(obj).attrs[attr].history
+    return history.deleted[0] if history.deleted else getattr(obj, attr)
+
+def _member_type(session, member_id):
+    member = session.identity_map.get(session.identity_key(Member, member_id)) if member_id else None
+    if member is not None:
+        return member.membership_type
+    if member_id is None:
+        return 'Unknown'
+    membership_type = session.connection().execute(
+        select(Member.membership_type).where(Member.id == member_id)
+    ).scalar()
+    return membership_type or 'Unknown'
+
+@event.listens_for(Session, 'after_flush')
+def update_rollups(session, flush_context):
+    """Keep the daily rollups in step with Checkin, Payment and GymClass writes"""
+    checkins, revenue, classes = Counter(), {}, Counter()
+
+    def add_revenue(branch_id, day, method, n, amount):
+        count, total = revenue.get((branch_id, day, method or ''), (0, 0.0))
+        revenue[(branch_id, day, method or '')] = (count + n, total + amount)
+
+    for obj in session.new:
+        if isinstance(obj, Checkin):
+            checkins[(obj.branch_id, obj.checkin_date, _member_type(session, obj.member_id))] += 1
+        elif isinstance(obj, Payment):
+            add_revenue(obj.branch_id, obj.date, obj.method, 1, obj.amount)
+        elif isinstance(obj, GymClass) and not obj.cancelled:
+            classes[(obj.branch_id, obj.date)] += 1
+
+    for obj in session.deleted:
+        if isinstance(obj, Checkin):
+            checkins[(obj.branch_id, obj.checkin_date, _member_type(session, obj.member_id))] -= 1
+        elif isinstance(obj, Payment):
+            add_revenue(obj.branch_id, obj.date, obj.method, -1, -obj.amount)
+        elif isinstance(obj, GymClass) and not _previous(obj, 'cancelled'):
+            classes[(obj.branch_id, obj.date)] -= 1
+
+    for obj in session.dirty:
+        if isinstance(obj, Payment) and session.is_modified(obj):
+            add_revenue(_previous(obj, 'branch_id'), _previous(obj, 'date'), _previous(obj, 'method'),
+                        -1, -_previous(obj, 'amount'))
+            add_revenue(obj.branch_id, obj.date, obj.method, 1, obj.amount)
+        elif isinstance(obj, GymClass) and session.is_modified(obj):
+            # Cancelled classes are not counted
+            if not _previous(obj, 'cancelled'):
+                classes[(obj.branch_id, _previous(obj, 'date'))] -= 1
+            if not obj.cancelled:
+                classes[(obj.branch_id, obj.date)] += 1
+
+    if checkins or revenue or classes:
+        apply_rollup_deltas(session.connection(), checkins, revenue, classes)
+
+def rebuild_rollups(start=None, end=None):
+    """Recompute the rollups of every branch in the current database from raw rows for days in [start, end]"""
+    checkin_day = Checkin.checkin_date
+    member_type = func.coalesce(Member.membership_type, 'Unknown')
+    method = func.coalesce(Payment.method, '')
+    sources = [
+        (DailyCheckinRollup, Checkin.branch_id, checkin_day,
+         select(Checkin.branch_id, checkin_day, member_type, func.count(Checkin.id))
+         .select_from(Checkin).outerjoin(Member, Checkin.member_id == Member.id)
+         .group_by(Checkin.branch_id, checkin_day, member_type)),
+        (DailyRevenueRollup, Payment.branch_id, Payment.date,
+         select(Payment.branch_id, Payment.date, method, func.count(Payment.id), func.sum(Payment.amount))
+         .group_by(Payment.branch_id, Payment.date, method)),
+        (DailyClassRollup, GymClass.branch_id, GymClass.date,
+         select(GymClass.branch_id, GymClass.date, func.count(GymClass.id))
+         .where(GymClass.cancelled.is_(False))
+         .group_by(GymClass.branch_id, GymClass.date)),
+    ]
+    with all_branches():
+        # Archived check-ins are gone from the hot table; their rollup rows are the only record left
+        archived = archived_through(Checkin)
+        for model, source_branch, source_day, source in sources:
+            table = model.__table__
+            stale = table.delete()
+            if model is DailyCheckinRollup:
+                for branch_id, through in archived.items():
+                    stale = stale.where(not_(and_(table.c.branch_id == branch_id, table.c.day <= through)))
+                    source = source.where(not_(and_(source_branch == branch_id, source_day <= through)))
+            if start:
+                stale = stale.where(table.c.day >= start)
+                source = source.where(source_day >= start)
+            if end:
+                stale = stale.where(table.c.day <= end)
+                source = source.where(source_day <= end)
+            db.session.execute(stale)
+            db.session.execute(table.insert().from_select([c.name for c in table.c], source))
+        db.session.commit()
+
+@app.cli.command('rebuild-rollups')
+@click.option('--start', type=click.DateTime(formats=['%Y-%m-%d']), help='First day to rebuild')
+@click.option('--end', type=click.DateTime(formats=['%Y-%m-%d']), help='Last day to rebuild')
+def rebuild_rollups_command(start, end):
+    """Backfill the daily check-in, revenue and class rollups"""
+    for _ in branch_databases():
+        rebuild_rollups(start.date() if start else None, end.date() if end else None)
+    click.echo("Daily rollups rebuilt")
+
+# SMS reminders - messages go through a pluggable gateway. Bulk sends run as a
+# background job that batches provider calls over a small worker pool, rate
+# limits and retries them, and records every PaymentReminder in one insert
+class ReminderJob(BranchScoped, db.Model):
+    # The branch that queued it; a scheduled scan of a shared database files its job under the default branch
+    id = db.Column(db.Integer, primary_key=True)
+    source = db.Column(db.String(50), default='manual')
+    state = db.Column(db.String(20), default='queued')  # 'queued', 'running', 'done', 'failed'
+    total = db.Column(db.Integer, default=0)
+    sent = db.Column(db.Integer, default=0)
+    failed = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'source': self.source,
+            'state': self.state,
+            'total': self.total,
+            'sent': self.sent,
+            'failed': self.failed,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+class SmsGateway:
+    """SMS provider interface; send_batch returns one success flag per message"""
+    max_batch = 50
+    # PaymentReminder.status recorded for messages this gateway accepted
+    sent_status = 'sent'
+
+    def send_batch(self, messages):
+        raise NotImplementedError
+
+class ConsoleSmsGateway(SmsGateway):
+    sent_status = 'simulated'
+
+    def send_batch(self, messages):
+        for phone, message in messages:
+            print(f"📱 SMS TO {phone}: {message}")
+        return [True] * len(messages)
+
+class FakeSmsGateway(SmsGateway):
+    """Keeps messages in memory; phones in ``failing`` are always rejected"""
+    sent_status = 'simulated'
+
+    def __init__(self, failing=()):
+        self.sent = []
+        self.calls = 0
+        self.failing = set(failing)
+
+    def send_batch(self, messages):
+        self.calls += 1
+        results = []
+        for phone, message in messages:
+            ok = phone not in self.failing
+            if ok:
+                self.sent.append((phone, message))
+            results.append(ok)
+        return results
+
+def load_sms_gateway(spec):
+    if spec == 'console':
+        return ConsoleSmsGateway()
+    if spec == 'fake':
+        return FakeSmsGateway()
+    module_name, _, class_name = spec.partition(':')
+    return getattr(importlib.import_module(module_name), class_name)()
+
+sms_gateway = load_sms_gateway(app.config['SMS_GATEWAY'])
+
+class RateLimiter:
+    """Token bucket allowing ``rate`` messages per second across every thread that shares it"""
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = clock.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, n=1):
+        while True:
+            with self._lock:
+                now = clock.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                # A batch bigger than the bucket waits for a full bucket and leaves it in debt,
+                # so every message is still paid for
+                needed = min(n, self.rate)
+                if self.tokens >= needed:
+                    self.tokens -= n
+                    return
+                wait = (needed - self.tokens) / self.rate
+            clock.sleep(wait)
+
+class ReminderDispatcher:
+    """Sends reminder messages in batches over a bounded thread pool"""
+    def __init__(self, gateway, workers=4, rate_per_second=50, max_retries=3, backoff=0.5, limiter=None):
+        self.gateway = gateway
+        self.workers = workers
+        self.limiter = limiter or RateLimiter(rate_per_second)
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+    def _send(self, batch):
+        messages = [(item['phone'], item['message']) for item in batch]
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire(len(messages))
+            try:
+                return self.gateway.send_batch(messages)
+            except Exception as e:
+                if attempt == self.max_retries:
+                    app.logger.error("SMS batch of %d failed: %s", len(messages), e)
+                    return [False] * len(messages)
+                clock.sleep(self.backoff * 2 ** attempt)
+
+    def dispatch(self, items):
+        """Send ``items`` (dicts with member_id, branch_id, phone, message, reminder_type).
+
+        Returns PaymentReminder rows ready for a bulk insert.
+        """
+        # No batch is bigger than one second's allowance, so none bursts past the rate
+        size = max(1, min(self.gateway.max_batch, int(self.limiter.rate)))
+        batches = [items[i:i + size] for i in range(0, len(items), size)]
+        rows = []
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for batch, results in zip(batches, pool.map(self._send, batches)):
+                for item, ok in zip(batch, results):
+                    rows.append({
+                        'member_id': item['member_id'],
+                        'branch_id': item['branch_id'],
+                        'reminder_type': item['reminder_type'],
+                        'sent_date': datetime.utcnow(),
+                        'status': self.gateway.sent_status if ok else 'failed',
+                    })
+        return rows
+
+# One bucket per gateway, so concurrent jobs and single reminders share the rate
+sms_rate_limiter = RateLimiter(app.config['SMS_RATE_PER_SECOND'])
+
+def make_dispatcher():
+    return ReminderDispatcher(sms_gateway,
+                              workers=app.config['SMS_WORKERS'],
+                              max_retries=app.config['SMS_MAX_RETRIES'],
+                              limiter=sms_rate_limiter)
+
+def reminder_type_for(days_until_expiry):
+    if days_until_expiry == 0:
+        return 'expiry_today'
+    elif 1 <= days_until_expiry <= 3:
+        return 'expiry_3_days'
+    elif days_until_expiry < 0:
+        return 'expired'
+    return 'general'
+
+def build_reminder_message(member, reminder_type, today):
     days_until_expiry = (member.expiry_date - today).days
-    
     if reminder_type == 'expiry_3_days':
-        message = f"Hi {member.name}, your {member.membership_type} membership at Fitness Club expires in {days_until_expiry} days on {member.expiry_date}. Please renew to avoid interruption. Reply STOP to unsubscribe."
+        return f"Hi {member.name}, your {member.membership_type} membership at Fitness Club expires in {days_until_expiry} days on {member.expiry_date}. Please renew to avoid interruption. Reply STOP to unsubscribe."
     elif reminder_type == 'expiry_today':
-        message = f"Hi {member.name}, your {member.membership_type} membership expires TODAY. Please visit us to renew. Reply STOP to unsubscribe."
+        return f"Hi {member.name}, your {member.membership_type} membership expires TODAY. Please visit us to renew. Reply STOP to unsubscribe."
     elif reminder_type == 'expired':
-        message = f"Hi {member.name}, your {member.membership_type} membership expired on {member.expiry_date}. Renew now to restore access. Reply STOP to unsubscribe."
-    else:
-        message = f"Hi {member.name}, friendly reminder from Fitness Club about your membership. Reply STOP to unsubscribe."
-    
-    print(f"📱 SMS TO {phone}: {message}")
-    
-    reminder = PaymentReminder(
-        member_id=member.id,
-        reminder_type=reminder_type,
-        status='simulated'
+        return f"Hi {member.name}, your {member.membership_type} membership expired on {member.expiry_date}. Renew now to restore access. Reply STOP to unsubscribe."
+    return f"Hi {member.name}, friendly reminder from Fitness Club about your membership. Reply STOP to unsubscribe."
+
+def reminder_sent_today_query(member_id, reminder_type, today_sa):
+    day_start = sa_time.day_start(today_sa)
+    return select(exists().where(
+        PaymentReminder.member_id == member_id,
+        PaymentReminder.reminder_type == reminder_type,
+        PaymentReminder.sent_date >= day_start,
+        PaymentReminder.sent_date < day_start + timedelta(days=1),
+        PaymentReminder.status != 'failed'
+    ))
+
+def reminder_sent_today(member_id, reminder_type, today_sa):
+    return db.session.execute(reminder_sent_today_query(member_id, reminder_type, today_sa)).scalar()
+
+def reminder_item(member, reminder_type, today):
+    """Dispatcher item for one member's reminder"""
+    return {'member_id': member.id, 'branch_id': member.branch_id, 'phone': member.phone,
+            'reminder_type': reminder_type, 'message': build_reminder_message(member, reminder_type, today)}
+
+def reminder_outcome(member, row):
+    """(success, message) for a dispatched PaymentReminder row"""
+    if row['status'] == 'failed':
+        return False, f"SMS reminder to {member.name} failed"
+    return True, f"SMS reminder sent to {member.name}"
+
+def send_sms_reminder(member, reminder_type):
+    if not member.phone:
+        return False, "No phone number available"
+
+    row, = make_dispatcher().dispatch([reminder_item(member, reminder_type, sa_time.sa_today())])
+    db.session.add(PaymentReminder(**row))
+    db.session.commit()
+    return reminder_outcome(member, row)
+
+def members_needing_reminders_query(today_sa):
+    """Members with phones expiring in next 3 days or expired"""
+    return select(Member).where(
+        Member.phone.isnot(None),
+        Member.phone != '',
+        Member.expiry_date <= today_sa + timedelta(days=3)
     )
-    db.session.add(reminder)
+
+def members_with_phones_query(limit=5):
+    return select(Member).where(Member.phone.isnot(None), Member.phone != '').limit(limit)
+
+def run_reminder_job(job_id, items):
+    """Send ``items`` for ReminderJob ``job_id`` and record the outcome"""
+    job = db.session.get(ReminderJob, job_id)
+    job.state = 'running'
     db.session.commit()
-    
-    return True, f"SMS reminder sent to {member.name}"
+    try:
+        rows = make_dispatcher().dispatch(items)
+        if rows:
+            db.session.execute(PaymentReminder.__table__.insert(), rows)
+        sent = Counter(row['branch_id'] for row in rows if row['status'] != 'failed')
+        job.sent = sum(sent.values())
+        record_live_events(db.session.connection(),
+                           [{'kind': 'reminder', 'branch_id': branch_id, 'day': sa_time.sa_today(), 'count': n,
+                             'amount': 0.0} for branch_id, n in sent.items()])
+        job.failed = len(rows) - job.sent
+        job.state = 'done'
+    except Exception:
+        db.session.rollback()
+        app.logger.exception("Reminder job %s failed", job_id)
+        job = db.session.get(ReminderJob, job_id)
+        job.state = 'failed'
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+    return job
+
+def start_reminder_job(items, source='manual', background=True):
+    """Queue a ReminderJob for ``items``; runs on a background thread by default"""
+    job = ReminderJob(source=source, total=len(items))
+    db.session.add(job)
+    db.session.commit()
+    job_id = job.id
+    if not background:
+        return run_reminder_job(job_id, items)
+
+    branch_id = current_branch_id()
+
+    def worker():
+        with app.app_context(), branch_scope(branch_id):
+            run_reminder_job(job_id, items)
+    threading.Thread(target=worker, name=f'reminder-job-{job_id}', daemon=True).start()
+    return job
+
+# Scheduled reminder scan - once per SA-local day, whichever worker claims the
+# day's ScheduledRun row sends reminders to members not yet reminded today
+class ScheduledRun(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    job_name = db.Column(db.String(50), nullable=False)
+    run_day = db.Column(db.Date, nullable=False)
+    state = db.Column(db.String(20), default='running')  # 'running', 'done', 'failed'
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+    batch_size = db.Column(db.Integer)
+    reminder_job_id = db.Column(db.Integer, db.ForeignKey('reminder_job.id'))
+
+    # The unique row doubles as the lock: only one worker can insert it
+    __table_args__ = (db.UniqueConstraint('job_name', 'run_day'),)
+
+def pending_reminders_query(today_sa):
+    """Members due a reminder today with the type they are due, minus those already sent it"""
+    reminder_type = case(
+        (Member.expiry_date == today_sa, 'expiry_today'),
+        (Member.expiry_date < today_sa, 'expired'),
+        else_='expiry_3_days'
+    )
+    day_start = sa_time.day_start(today_sa)
+    already_sent = exists().where(
+        PaymentReminder.member_id == Member.id,
+        PaymentReminder.reminder_type == reminder_type,
+        PaymentReminder.sent_date >= day_start,
+        PaymentReminder.sent_date < day_start + timedelta(days=1),
+        PaymentReminder.status != 'failed'
+    )
+    return db.session.query(Member, reminder_type).filter(
+        Member.phone.isnot(None),
+        Member.phone != '',
+        Member.expiry_date >= today_sa - timedelta(days=app.config['EXPIRED_REMINDER_DAYS']),
+        Member.expiry_date <= today_sa + timedelta(days=3),
+        ~already_sent
+    )
+
+def pending_reminder_items(today_sa):
+    return [reminder_item(member, reminder_type, today_sa)
+            for member, reminder_type in pending_reminders_query(today_sa)]
+
+def claim_scheduled_run(job_name, run_day):
+    """Insert (or retake a failed or stale) run row for the day; None if another worker has it
+
+    A run is stale when it has been 'running' for SCHEDULED_RUN_TIMEOUT seconds, e.g. because its
+    worker was killed mid-scan. Members it already reminded are skipped by the retaken run.
+    """
+    run = ScheduledRun(job_name=job_name, run_day=run_day)
+    db.session.add(run)
+    try:
+        db.session.commit()
+        return run
+    except IntegrityError:
+        db.session.rollback()
+    now = datetime.utcnow()
+    stale = now - timedelta(seconds=app.config['SCHEDULED_RUN_TIMEOUT'])
+    retaken = db.session.execute(
+        ScheduledRun.__table__.update()
+        .where(ScheduledRun.job_name == job_name, ScheduledRun.run_day == run_day,
+               or_(ScheduledRun.state == 'failed',
+                   and_(ScheduledRun.state == 'running', ScheduledRun.started_at < stale)))
+        .values(state='running', started_at=now, finished_at=None)
+    ).rowcount
+    db.session.commit()
+    if not retaken:
+        return None
+    return ScheduledRun.query.filter_by(job_name=job_name, run_day=run_day).one()
+
+def scan_reminders(today_sa=None):
+    """Run today's reminder scan unless some worker already has; returns the run or None"""
+    today_sa = today_sa or sa_time.sa_today()
+    run = claim_scheduled_run('reminder_scan', today_sa)
+    if run is None:
+        return None
+    try:
+        items = pending_reminder_items(today_sa)
+        run.batch_size = len(items)
+        if items:
+            job = start_reminder_job(items, source='scheduled', background=False)
+            run.reminder_job_id = job.id
+        run.state = 'done'
+    except Exception:
+        db.session.rollback()
+        app.logger.exception("Reminder scan for %s failed", today_sa)
+        run = db.session.get(ScheduledRun, run.id)
+        run.state = 'failed'
+    run.finished_at = datetime.utcnow()
+    db.session.commit()
+    return run
+
+def start_reminder_scheduler():
+    """Background thread that runs the daily scan; safe to start in every worker"""
+    stop = threading.Event()
+
+    def loop():
+        while not stop.is_set():
+            with app.app_context():
+                try:
+                    for _ in branch_databases():
+                        run = scan_reminders()
+                        if run is not None:
+                            app.logger.info("Reminder scan %s: %s members in %.1fs", run.run_day,
+                                            run.batch_size, (run.finished_at - run.started_at).total_seconds())
+                except Exception:
+                    app.logger.exception("Reminder scheduler tick failed")
+                finally:
+                    db.session.remove()
+            stop.wait(app.config['SCHEDULER_INTERVAL'])
+
+    threading.Thread(target=loop, name='reminder-scheduler', daemon=True).start()
+    return stop
+
+@app.cli.command('scan-reminders')
+def scan_reminders_command():
+    """Run today's reminder scan now (no-op if it already ran today)"""
+    for branch_id in branch_databases():
+        where = f" for branch {branch_id}" if branch_id else ""
+        run = scan_reminders()
+        if run is None:
+            click.echo(f"Today's reminder scan{where} has already run")
+        else:
+            click.echo(f"Reminder scan{where} {run.state}: {run.batch_size} reminders queued")
+
+# Metric cache - dashboard KPIs are cached per metric with their own TTL and
+# dropped as soon as a commit writes to a table they are computed from
+class LRUCacheBackend:
+    """In-process LRU store of key -> (expires_at, value)"""
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            if item[0] < clock.time():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return item[1]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._items[key] = (clock.time() + ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._items.pop(key, None)
+
+    def delete_prefix(self, *prefixes):
+        with self._lock:
+            for key in [key for key in self._items if key.startswith(prefixes)]:
+                del self._items[key]
+
+class SQLiteCacheBackend:
+    """Cache stored in a local SQLite file so every gunicorn worker sees it"""
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS cache "
+                         "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5)
+
+    def get(self, key):
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT value FROM cache WHERE key = ? AND expires_at >= ?",
+                               (key, clock.time())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, value, ttl):
+        with closing(self._connect()) as conn, conn:
+            conn.execute("INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                         (key, json.dumps(value), clock.time() + ttl))
+
+    def delete(self, *keys):
+        with closing(self._connect()) as conn, conn:
+            conn.executemany("DELETE FROM cache WHERE key = ?", [(key,) for key in keys])
+
+    def delete_prefix(self, *prefixes):
+        with closing(self._connect()) as conn, conn:
+            conn.executemany("DELETE FROM cache WHERE substr(key, 1, ?) = ?",
+                             [(len(prefix), prefix) for prefix in prefixes])
+
+class MetricCache:
+    """Per-metric, per-branch cache with TTLs, table-based invalidation and hit/miss counters"""
+    def __init__(self, backend, metrics):
+        self.backend = backend
+        self.metrics = metrics  # name -> (ttl seconds, tables it is computed from)
+        self.hits = Counter()
+        self.misses = Counter()
+
+    def get(self, name, tag, branch_id=DEFAULT_BRANCH_ID):
+        """Cached value of ``name`` for a branch if it was computed for ``tag``, else None"""
+        entry = self.backend.get(f'metric:{name}:{branch_id}')
+        if entry is not None and entry[0] == tag:
+            self.hits[name] += 1
+            return entry
+        self.misses[name] += 1
+        return None
+
+    def set(self, name, tag, value, branch_id=DEFAULT_BRANCH_ID):
+        ttl = self.metrics[name][0]
+        self.backend.set(f'metric:{name}:{branch_id}', [tag, value], ttl)
+
+    def invalidate_tables(self, tables):
+        """Drop the metrics computed from ``tables``, for every branch"""
+        stale = [name for name, (_, deps) in self.metrics.items() if deps & tables]
+        if stale:
+            self.backend.delete_prefix(*[f'metric:{name}:' for name in stale])
+        return stale
+
+    def clear(self):
+        self.backend.delete_prefix(*[f'metric:{name}:' for name in self.metrics])
+
+    def stats(self):
+        return {
+            'backend': type(self.backend).__name__,
+            'hits': sum(self.hits.values()),
+            'misses': sum(self.misses.values()),
+            'metrics': {name: {'ttl': ttl, 'hits': self.hits[name], 'misses': self.misses[name]}
+                        for name, (ttl, _) in self.metrics.items()},
+        }
+
+# name: (ttl seconds, tables whose writes invalidate it)
+DASHBOARD_METRICS = {
+    'trainers_count': (3600, {'trainer'}),
+    'classes_today': (600, {'gym_class'}),
+    'upcoming_classes': (60, {'gym_class'}),
+    'popular_class': (3600, {'gym_class'}),
+    'busy_trainer': (3600, {'gym_class'}),
+    'total_payments': (600, {'payment', 'daily_revenue_rollup'}),
+    'revenue_six_months': (3600, {'payment', 'daily_revenue_rollup'}),
+    'today_checkins_count': (30, {'checkin', 'daily_checkin_rollup'}),
+    'members_with_phones': (600, {'member'}),
+    'members_needing_reminders': (300, {'member'}),
+    'recent_reminders': (300, {'payment_reminder'}),
+}
+
+def make_cache_backend(kind):
+    if kind == 'shared':
+        return SQLiteCacheBackend(app.config['CACHE_PATH'])
+    if kind == 'memory':
+        return LRUCacheBackend()
+    raise ValueError(f"Unknown CACHE_BACKEND {kind!r}")
+
+metric_cache = MetricCache(make_cache_backend(app.config['CACHE_BACKEND']), DASHBOARD_METRICS)
+
+def _written_tables(session):
+    return session.info.setdefault('written_tables', set())
+
+@event.listens_for(Session, 'after_flush')
+def track_flushed_tables(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        _written_tables(session).add(obj.__table__.name)
+
+@event.listens_for(Session, 'do_orm_execute')
+def track_bulk_writes(orm_execute_state):
+    # Bulk inserts/updates/deletes bypass the flush, so record their table here
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        table = getattr(orm_execute_state.statement, 'table', None)
+        if table is not None:
+            _written_tables(orm_execute_state.session).add(table.name)
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_metric_cache(session):
+    tables = session.info.pop('written_tables', None)
+    if tables:
+        metric_cache.invalidate_tables(tables)
+        if 'member' in tables:
+            for cache in active_member_caches.values():
+                cache.invalidate()
+
+@event.listens_for(Session, 'after_rollback')
+def forget_written_tables(session):
+    session.info.pop('written_tables', None)
+
+# Active-membership index - every member's expiry date in two flat arrays so
+# "is active", "how many active" and "how many expire this week" never touch
+# the database. Commits in this process update it in place; other workers'
+# changes are picked up by a full reload every MEMBERSHIP_INDEX_TTL seconds
+class MembershipIndex:
+    """Member expiries as day ordinals: by id in a dense array, and sorted as (ordinal << 32 | id) keys"""
+    def __init__(self, ttl, branch_id=None):
+        self.ttl = ttl
+        self.branch_id = branch_id  # None indexes every member
+        self._expiry_by_id = array('i')  # 0 = no such member
+        self._keys = array('q')
+        self._loaded_at = None
+        self._lock = threading.RLock()
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def load(self, rows):
+        """Rebuild from (member_id, expiry_date) pairs"""
+        rows = [(member_id, expiry.toordinal()) for member_id, expiry in rows]
+        expiry_by_id = array('i', bytes(4 * (max((member_id for member_id, _ in rows), default=0) + 1)))
+        for member_id, ordinal in rows:
+            expiry_by_id[member_id] = ordinal
+        with self._lock:
+            self._expiry_by_id = expiry_by_id
+            self._keys = array('q', sorted(ordinal << 32 | member_id for member_id, ordinal in rows))
+            self._loaded_at = clock.monotonic()
+
+    def _fresh(self):
+        if self._loaded_at is None or clock.monotonic() - self._loaded_at > self.ttl:
+            stmt = select(Member.id, Member.expiry_date)
+            if self.branch_id is not None:
+                stmt = stmt.where(Member.branch_id == self.branch_id)
+            self.load(db.session.execute(stmt).tuples())
+
+    def set(self, member_id, expiry_date):
+        """Record a new or changed expiry date (None removes the member)"""
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            if member_id < len(self._expiry_by_id) and self._expiry_by_id[member_id]:
+                old = self._expiry_by_id[member_id] << 32 | member_id
+                del self._keys[bisect_left(self._keys, old)]
+                self._expiry_by_id[member_id] = 0
+            if expiry_date is None:
+                return
+            if member_id >= len(self._expiry_by_id):
+                self._expiry_by_id.extend(array('i', bytes(4 * (member_id + 1 - len(self._expiry_by_id)))))
+            ordinal = expiry_date.toordinal()
+            self._expiry_by_id[member_id] = ordinal
+            key = ordinal << 32 | member_id
+            self._keys.insert(bisect_left(self._keys, key), key)
+
+    def is_active(self, member_id, today):
+        with self._lock:
+            self._fresh()
+            return (member_id < len(self._expiry_by_id)
+                    and self._expiry_by_id[member_id] >= today.toordinal())
+
+    def count(self):
+        with self._lock:
+            self._fresh()
+            return len(self._keys)
+
+    def count_active(self, today):
+        with self._lock:
+            self._fresh()
+            return len(self._keys) - bisect_left(self._keys, today.toordinal() << 32)
+
+    def expiring_within(self, days, today):
+        """Members whose membership ends between today and ``days`` days from now"""
+        with self._lock:
+            self._fresh()
+            return (bisect_left(self._keys, (today.toordinal() + days + 1) << 32)
+                    - bisect_left(self._keys, today.toordinal() << 32))
+
+    def nbytes(self):
+        return (self._expiry_by_id.itemsize * len(self._expiry_by_id)
+                + self._keys.itemsize * len(self._keys))
+
+# Each branch's dashboard counts only its own members
+membership_indexes = BranchRegistry(lambda branch_id: MembershipIndex(app.config['MEMBERSHIP_INDEX_TTL'], branch_id))
+
+@event.listens_for(Session, 'after_flush')
+def track_member_expiry_changes(session, flush_context):
+    changes = session.info.setdefault('member_expiry_changes', {})
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Member):
+            changes[(obj.branch_id, obj.id)] = obj.expiry_date
+    for obj in session.deleted:
+        if isinstance(obj, Member):
+            changes[(obj.branch_id, obj.id)] = None
+
+@event.listens_for(Session, 'do_orm_execute')
+def track_member_bulk_writes(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        table = getattr(orm_execute_state.statement, 'table', None)
+        if table is not None and table.name == 'member':
+            orm_execute_state.session.info['member_index_stale'] = True
+
+@event.listens_for(Session, 'after_commit')
+def update_membership_index(session):
+    changes = session.info.pop('member_expiry_changes', None)
+    if session.info.pop('member_index_stale', False):
+        for index in membership_indexes.values():
+            index.invalidate()
+    elif changes:
+        for (branch_id, member_id), expiry_date in changes.items():
+            if branch_id in membership_indexes:
+                membership_indexes[branch_id].set(member_id, expiry_date)
+
+@event.listens_for(Session, 'after_rollback')
+def forget_member_expiry_changes(session):
+    session.info.pop('member_expiry_changes', None)
+    session.info.pop('member_index_stale', None)
+
+# Dashboard metrics - every KPI is a SQL aggregate so the dashboard never
+# loads whole tables into Python
+
+def dashboard_metric_queries(sa_now):
+    """Map of dashboard metric name -> scalar SELECT computing it"""
+    sa_today = sa_now.date()
+    today_start, today_end = sa_time.day_range(sa_today)
+    has_phone = and_(Member.phone.isnot(None), Member.phone != '')
+    scheduled = GymClass.cancelled.is_(False)
+
+    return {
+        'trainers_count': select(func.count(Trainer.id)),
+        'classes_today': select(func.count(GymClass.id)).where(
+            scheduled, GymClass.starts_at >= today_start, GymClass.starts_at < today_end),
+        # Recurring classes have no end, so "upcoming" is the next UPCOMING_CLASS_DAYS days
+        'upcoming_classes': select(func.count(GymClass.id)).where(
+            scheduled, GymClass.starts_at > sa_time.to_utc(sa_now),
+            GymClass.starts_at < sa_time.day_start(sa_today + timedelta(days=app.config['UPCOMING_CLASS_DAYS'] + 1))),
+        'popular_class': select(GymClass.name)
+            .where(scheduled)
+            .group_by(GymClass.name)
+            .order_by(func.count(GymClass.id).desc())
+            .limit(1),
+        'busy_trainer': select(GymClass.trainer)
+            .where(scheduled, GymClass.trainer.isnot(None), GymClass.trainer != '')
+            .group_by(GymClass.trainer)
+            .order_by(func.count(GymClass.id).desc())
+            .limit(1),
+        'total_payments': select(func.coalesce(func.sum(DailyRevenueRollup.total), 0.0)),
+        'today_checkins_count': select(func.coalesce(func.sum(DailyCheckinRollup.checkins), 0))
+            .where(DailyCheckinRollup.day == sa_today),
+        'members_with_phones': select(func.count(Member.id)).where(has_phone),
+        # Members with a phone whose membership expires within 3 days or already has
+        'members_needing_reminders': select(func.count(Member.id)).where(
+            has_phone,
+            Member.expiry_date <= sa_today + timedelta(days=3)
+        ),
+        # Recent reminders sent for the last 7 days
+        'recent_reminders': select(func.count(PaymentReminder.id)).where(
+            PaymentReminder.sent_date >= datetime.utcnow() - timedelta(days=7)
+        ),
+    }
+
+def dashboard_metrics(sa_now):
+    """Dashboard KPIs from the metric cache; misses are computed in one round trip"""
+    sa_today = sa_now.date()
+    branch_id = default_branch_id()
+    tags = {name: sa_today.isoformat() for name in DASHBOARD_METRICS}
+    # Upcoming classes depend on the time of day, not just the date
+    tags['upcoming_classes'] = sa_now.strftime('%Y-%m-%d %H:%M')
+
+    metrics, missing = {}, []
+    for name in DASHBOARD_METRICS:
+        cached = metric_cache.get(name, tags[name], branch_id)
+        if cached is None:
+            missing.append(name)
+        else:
+            metrics[name] = cached[1]
+
+    if missing:
+        expand_class_series(sa_today + timedelta(days=app.config['UPCOMING_CLASS_DAYS']))
+    queries = dashboard_metric_queries(sa_now)
+    scalar_missing = [name for name in missing if name in queries]
+    if scalar_missing:
+        row = db.session.execute(
+            select(*[queries[name].scalar_subquery().label(name) for name in scalar_missing])
+        ).one()
+        for name, value in row._asdict().items():
+            if name == 'total_payments':
+                value = float(value)
+            metrics[name] = value
+            metric_cache.set(name, tags[name], value, branch_id)
+    if 'revenue_six_months' in missing:
+        metrics['revenue_six_months'] = revenue_last_six_months(sa_today)
+        metric_cache.set('revenue_six_months', tags['revenue_six_months'], metrics['revenue_six_months'], branch_id)
+
+    # Membership counts come straight from the branch's in-process index
+    index = membership_indexes[branch_id]
+    metrics['total_members'] = index.count()
+    metrics['active_memberships'] = index.count_active(sa_today)
+    metrics['expiring_soon'] = index.expiring_within(7, sa_today)
+
+    metrics['popular_class'] = metrics['popular_class'] or "No classes"
+    metrics['busy_trainer'] = metrics['busy_trainer'] or "No trainers"
+    return metrics
+
+# Revenue analytics - totals per calendar day, week or month for any range,
+# grouped in SQL. Plain and per-method totals read the daily revenue rollup,
+# so cost depends on the range, not on the payment history
+REVENUE_GRANULARITIES = ('day', 'week', 'month')
+REVENUE_BREAKDOWNS = ('method', 'membership_type')
+MAX_REVENUE_BUCKETS = 400
+
+def period_start_expr(column, granularity):
+    """SQL expression truncating a Date column to the first day of its day/week/month"""
+    if granularity == 'day':
+        return column
+    if db.engine.dialect.name == 'sqlite':
+        # 'weekday 0' moves forward to Sunday, so step back six days to that week's Monday
+        modifiers = ('start of month',) if granularity == 'month' else ('weekday 0', '-6 days')
+        return func.date(column, *modifiers, type_=db.Date)
+    return cast(func.date_trunc(granularity, column), db.Date)
+
+def period_starts(start, end, granularity):
+    """First day of every bucket overlapping start..end"""
+    if granularity == 'month':
+        current, step = sa_time.month_start(start), lambda d: sa_time.add_months(d, 1)
+    elif granularity == 'week':
+        current, step = sa_time.week_start(start), lambda d: d + timedelta(days=7)
+    else:
+        current, step = start, lambda d: d + timedelta(days=1)
+    while current <= end:
+        yield current
+        current = step(current)
+
+def period_label(period, granularity):
+    if granularity == 'month':
+        return period.strftime('%b %Y')
+    if granularity == 'week':
+        return f"Week of {period.strftime('%d %b')}"
+    return period.strftime('%d %b')
+
+def revenue_series(start, end, granularity='month', breakdown=None):
+    """Revenue for SA-local days start..end, one bucket per calendar period"""
+    if granularity not in REVENUE_GRANULARITIES:
+        raise ValueError(f"granularity must be one of {', '.join(REVENUE_GRANULARITIES)}")
+    if breakdown not in (None,) + REVENUE_BREAKDOWNS:
+        raise ValueError(f"breakdown must be one of {', '.join(REVENUE_BREAKDOWNS)}")
+    if end < start:
+        raise ValueError("end must not be before start")
+    periods = list(period_starts(start, end, granularity))
+    if len(periods) > MAX_REVENUE_BUCKETS:
+        raise ValueError(f"range spans more than {MAX_REVENUE_BUCKETS} {granularity}s")
+
+    if breakdown == 'membership_type':
+        # The rollup has no membership type, so group the payments themselves by date range
+        period = period_start_expr(Payment.date, granularity)
+        groups = [period, func.coalesce(Member.membership_type, 'Unknown')]
+        stmt = select(*groups, func.count(Payment.id), func.sum(Payment.amount)) \
+            .outerjoin(Member, Payment.member_id == Member.id) \
+            .where(Payment.date >= start, Payment.date <= end)
+    else:
+        period = period_start_expr(DailyRevenueRollup.day, granularity)
+        groups = [period, DailyRevenueRollup.method] if breakdown else [period]
+        stmt = select(*groups, func.sum(DailyRevenueRollup.payments), func.sum(DailyRevenueRollup.total)) \
+            .where(DailyRevenueRollup.day >= start, DailyRevenueRollup.day <= end)
+
+    buckets = {p: {'period': p.isoformat(), 'label': period_label(p, granularity), 'payments': 0, 'total': 0.0}
+               for p in periods}
+    if breakdown:
+        for bucket in buckets.values():
+            bucket['by_' + breakdown] = {}
+    for row in db.session.execute(stmt.group_by(*groups)):
+        bucket = buckets[row[0]]
+        count, total = row[-2:]
+        bucket['payments'] += int(count or 0)
+        bucket['total'] += float(total or 0)
+        if breakdown:
+            bucket['by_' + breakdown][row[1] or 'Unknown'] = round(float(total or 0), 2)
+    for bucket in buckets.values():
+        bucket['total'] = round(bucket['total'], 2)
+    return list(buckets.values())
+
+def revenue_last_six_months(sa_today):
+    """Monthly payment totals for this and the previous five calendar months as [labels, totals]"""
+    series = revenue_series(sa_time.add_months(sa_today, -5), sa_today, 'month')
+    return [[date.fromisoformat(b['period']).strftime('%b') for b in series], [b['total'] for b in series]]
+
+@app.route('/api/revenue')
+def api_revenue():
+    """Revenue per day/week/month: ?start=&end=&granularity=&breakdown=method|membership_type"""
+    if 'user' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    granularity = request.args.get('granularity', 'month')
+    breakdown = request.args.get('breakdown') or None
+    sa_today = sa_time.sa_today()
+    try:
+        end = date.fromisoformat(request.args['end']) if request.args.get('end') else sa_today
+        if request.args.get('start'):
+            start = date.fromisoformat(request.args['start'])
+        elif granularity == 'month':
+            start = sa_time.add_months(end, -11)
+        elif granularity == 'week':
+            start = sa_time.week_start(end) - timedelta(weeks=11)
+        else:
+            start = end - timedelta(days=29)
+        series = revenue_series(start, end, granularity, breakdown)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'start': start.isoformat(), 'end': end.isoformat(), 'granularity': granularity,
+                    'breakdown': breakdown, 'total': round(sum(b['total'] for b in series), 2),
+                    'buckets': series})
 
 @app.route('/')
 def index():
@@ -117,6 +1593,7 @@ def login():
         if user:
             session['user'] = user.username
             session['role'] = user.role
+            session['branch_id'] = user.branch_id or DEFAULT_BRANCH_ID
             return redirect(url_for('dashboard'))
         else:
             # Store login error in session
@@ -128,163 +1605,230 @@ def login():
 def logout():
     session.pop('user', None)
     session.pop('role', None)
+    session.pop('branch_id', None)
     return redirect(url_for('login'))
 
+# Branch switching - admins can look after any branch; everyone else stays in their own
+@app.route('/switch_branch/<int:branch_id>')
+def switch_branch(branch_id):
+    if 'user' not in session:
+        return redirect(url_for('login'))
+    if session.get('role') != 'admin':
+        flash("Only admins can switch branches.", "error")
+        return redirect(url_for('dashboard'))
+    branch = Branch.query.get_or_404(branch_id)
+    session['branch_id'] = branch.id
+    flash(f"Now viewing {branch.name}.", "success")
+    return redirect(url_for('dashboard'))
+
+@app.context_processor
+def branch_navigation():
+    """The current branch and, for admins, the branches they can switch to"""
+    if 'user' not in session:
+        return {}
+    branches = db.session.scalars(select(Branch).order_by(Branch.id)).all()
+    current = next((branch for branch in branches if branch.id == current_branch_id()), None)
+    others = [branch for branch in branches if branch is not current] if session.get('role') == 'admin' else []
+    return {'current_branch': current, 'other_branches': others}
+
+@app.cli.command('add-branch')
+@click.argument('name')
+def add_branch_command(name):
+    """Open a new branch (its database is created on first use when BRANCH_DATABASE_URL is set)"""
+    branch = Branch(name=name)
+    db.session.add(branch)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        raise click.ClickException(f"A branch named {name} already exists")
+    click.echo(f"Branch {branch.id} added: {name}")
+
+@app.cli.command('set-user-branch')
+@click.argument('username')
+@click.argument('branch_id', type=int)
+def set_user_branch_command(username, branch_id):
+    """Make BRANCH_ID the branch USERNAME works in after their next login"""
+    user = User.query.filter_by(username=username).first()
+    if user is None or db.session.get(Branch, branch_id) is None:
+        raise click.ClickException("Unknown user or branch")
+    user.branch_id = branch_id
+    db.session.commit()
+    click.echo(f"{username} now works in branch {branch_id}")
+
 # Dashboard (counts only active check-ins/members where appropriate)
 @app.route('/dashboard')
 def dashboard():
     if 'user' not in session:
         return redirect(url_for('login'))
 
-    utc_now = datetime.utcnow()
-    sa_offset = timedelta(hours=2)
-    sa_now = utc_now + sa_offset
-    sa_today = sa_now.date()
-    today_sa_str = sa_today.strftime('%Y-%m-%d')
-
-    total_members = Member.query.count()
-    active_memberships = sum(1 for m in Member.query.all() if m.is_active())
-    trainers_count = Trainer.query.count()
-    
-    # Count classes
-    classes_today = GymClass.query.filter(GymClass.date == sa_today).count()
-    
-    # Count UPCOMING classes
-    all_classes_list = GymClass.query.all()
-    upcoming_classes = 0
-    for class_obj in all_classes_list:
-        if class_obj.time:
-            # Combine class date with its time
-            class_time = datetime.strptime(class_obj.time, '%H:%M').time()
-            class_datetime = datetime.combine(class_obj.date, class_time)
-            
-            # Compare with current time
-            if class_datetime > sa_now:
-                upcoming_classes += 1
-        else:
-            # If no time, just compare dates
-            if class_obj.date > sa_today:
-                upcoming_classes += 1
-
-    # Get all class names and find the most common one
-    all_classes = GymClass.query.with_entities(GymClass.name).all()
-    if all_classes:
-        class_names = [c[0] for c in all_classes]
-        class_counts = Counter(class_names)
-        popular_class = class_counts.most_common(1)[0][0]
-    else:
-        popular_class = "No classes"
-        
-    # Calculate Busiest Trainer  
-    all_trainers = GymClass.query.with_entities(GymClass.trainer).all()
-    if all_trainers:
-        trainer_names = [t[0] for t in all_trainers if t[0]]  # Filter out empty names
-        if trainer_names:
-            trainer_counts = Counter(trainer_names)
-            busy_trainer = trainer_counts.most_common(1)[0][0]
-        else:
-            busy_trainer = "No trainers"
-    else:
-        busy_trainer = "No trainers"
-
-    
-    # Get ALL payments
-    all_payments = Payment.query.all()
-    total_payments = sum(p.amount for p in all_payments) if all_payments else 0.0
+    sa_now = sa_time.sa_now()
+    metrics = dashboard_metrics(sa_now)
 
     recent_members = Member.query.order_by(Member.id.desc()).limit(5).all()
-    
-    all_checkins = Checkin.query.all()
-    today_checkins_count = 0
-    
-    for checkin in all_checkins:
-        checkin_sa_time = checkin.checkin_time + timedelta(hours=2)
-        if checkin_sa_time.date() == sa_today:
-            today_checkins_count += 1
-    
-    # Memberships expiring in next 7 days
-    expiring_soon = Member.query.filter(
-        Member.expiry_date <= sa_today + timedelta(days=7),
-        Member.expiry_date >= sa_today
-    ).count()
-    
+
     # Member Satisfaction - based on today's engagement
+    active_memberships = metrics['active_memberships']
     if active_memberships > 0:
-        engagement_rate = today_checkins_count / active_memberships
+        engagement_rate = metrics['today_checkins_count'] / active_memberships
         member_satisfaction = min(round((engagement_rate * 8) + 1, 1), 5.0)
     else:
         member_satisfaction = 0.0
     member_satisfaction = max(1.0, min(5.0, member_satisfaction))
-    
-    payments_due = expiring_soon 
 
-    # SMS Reminders Data
-    members_with_phones = Member.query.filter(
-        Member.phone.isnot(None),
-        Member.phone != ''
-    ).count()
-
-    members_needing_reminders = Member.query.filter(
-        Member.phone.isnot(None),
-        Member.phone != '',
-        Member.expiry_date <= sa_today + timedelta(days=3)
-    ).count()
-
-    # Recent reminders sent for the last 7 days
-    recent_reminders = PaymentReminder.query.filter(
-        PaymentReminder.sent_date >= datetime.utcnow() - timedelta(days=7)
-    ).count()
+    payments_due = metrics['expiring_soon']
 
     #Last 6 months
-    payment_data = []
-    payment_labels = []
-    
-    months_data = []
-    for i in range(5, -1, -1):
-        month_date = sa_today - timedelta(days=30*i)
-        month_key = month_date.strftime('%Y-%m')
-        month_name = month_date.strftime('%b')
-        months_data.append({
-            'key': month_key,
-            'name': month_name,
-            'total': 0.0
-        })
-    
-    # Get all payments and group by month
-    for payment in all_payments:
-        payment_month = payment.date.strftime('%Y-%m')
-        for month_data in months_data:
-            if month_data['key'] == payment_month:
-                month_data['total'] += payment.amount
-                break
-    
-    for month_data in months_data:
-        payment_data.append(month_data['total'])
-        payment_labels.append(month_data['name'])
+    payment_labels, payment_data = metrics.pop('revenue_six_months')
 
     return render_template(
         "dashboard.html",
-        total_members=total_members,
-        active_memberships=active_memberships,
-        trainers_count=trainers_count,
-        upcoming_classes=upcoming_classes,
-        popular_class=popular_class,
-        busy_trainer=busy_trainer,
-        total_payments=total_payments,
         recent_members=recent_members,
-        today_checkins_count=today_checkins_count,
         revenue_data=payment_data,
         revenue_labels=payment_labels,
-        expiring_soon=expiring_soon,
-        classes_today=classes_today,
         member_satisfaction=member_satisfaction,
         payments_due=payments_due,
-        members_with_phones=members_with_phones,
-        members_needing_reminders=members_needing_reminders,
-        recent_reminders=recent_reminders
+        **metrics
     )
    
     
+@app.route('/api/cache_stats')
+def api_cache_stats():
+    """Hit/miss counters for the dashboard metric cache in this worker"""
+    if 'user' not in session:
+        return jsonify({})
+    return jsonify(metric_cache.stats())
+
+@app.route('/api/membership_stats')
+def api_membership_stats():
+    """Member counts of the current branch from the in-process membership index; ?days= sets the expiry window"""
+    if 'user' not in session:
+        return jsonify({})
+    days = request.args.get('days', 7, type=int)
+    sa_today = sa_time.sa_today()
+    index = membership_indexes[default_branch_id()]
+    return jsonify({'total': index.count(),
+                    'active': index.count_active(sa_today),
+                    'expiring_within_days': days,
+                    'expiring': index.expiring_within(days, sa_today)})
+
+# Member search - an SQLite FTS5 trigram index (pg_trgm on PostgreSQL) over
+# name and phone, so substring searches no longer scan the member table
+SEARCH_MIN_SIMILARITY = 0.6
+
+def setup_member_search(conn):
+    """Create the search index for the current database; returns the backend name"""
+    dialect = conn.dialect.name
+    if dialect == 'postgresql':
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        for column in ('name', 'phone'):
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_member_{column}_trgm "
+                              f"ON member USING gin ({column} gin_trgm_ops)"))
+        return 'pg_trgm'
+    if dialect != 'sqlite':
+        return 'like'
+    has_table = conn.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'member_search'"
+    )).first()
+    try:
+        conn.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS member_search USING fts5("
+            "name, phone, content='member', content_rowid='id', tokenize='trigram')"
+        ))
+    except OperationalError:
+        # SQLite built without FTS5 or older than 3.34 (no trigram tokenizer)
+        return 'like'
+    # Keep the index in step with every write to member, including bulk inserts
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS member_search_ai AFTER INSERT ON member BEGIN "
+        "INSERT INTO member_search(rowid, name, phone) VALUES (new.id, new.name, new.phone); END"
+    ))
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS member_search_ad AFTER DELETE ON member BEGIN "
+        "INSERT INTO member_search(member_search, rowid, name, phone) "
+        "VALUES ('delete', old.id, old.name, old.phone); END"
+    ))
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS member_search_au AFTER UPDATE OF name, phone ON member BEGIN "
+        "INSERT INTO member_search(member_search, rowid, name, phone) "
+        "VALUES ('delete', old.id, old.name, old.phone); "
+        "INSERT INTO member_search(rowid, name, phone) VALUES (new.id, new.name, new.phone); END"
+    ))
+    if not has_table:
+        conn.execute(text("INSERT INTO member_search(member_search) VALUES ('rebuild')"))
+    return 'fts5'
+
+def _fts_phrase(term):
+    return '"' + term.replace('"', '""') + '"'
+
+def _similarity(query, member):
+    """Best match of the query against any word of the name, or the phone"""
+    words = member.name.lower().split() + [member.name.lower(), member.phone or '']
+    return max(SequenceMatcher(None, query, word).ratio() for word in words)
+
+# Raw SQL skips the ORM branch criteria, so both restrict to :branch themselves (NULL for every branch)
+FTS_BRANCH = ("SELECT s.rowid FROM member_search s JOIN member m ON m.id = s.rowid "
+              "WHERE s.member_search MATCH :q AND (:branch IS NULL OR m.branch_id = :branch)")
+FTS_MATCH = text(FTS_BRANCH + " LIMIT :limit")
+FTS_RANKED = text(FTS_BRANCH + " ORDER BY s.rank LIMIT :limit")
+
+def _fts_fuzzy(query):
+    """FTS query matching anything sharing a trigram with ``query``"""
+    grams = {query[i:i + 3] for i in range(len(query) - 2)}
+    return ' OR '.join(_fts_phrase(gram) for gram in sorted(grams))
+
+def _fuzzy_matches(query, candidates, limit):
+    scored = [(score, m) for m in candidates if (score := _similarity(query, m)) >= SEARCH_MIN_SIMILARITY]
+    scored.sort(key=lambda item: -item[0])
+    return [m for _, m in scored[:limit]]
+
+def _search_members_fts(query, limit):
+    # Substring matches first, closest whole-word matches on top. Any substring
+    # match will do, so skip bm25 ranking and stop after the first few
+    branch_id = branch_filter_id()
+    ids = [row[0] for row in db.session.execute(FTS_MATCH, {'q': _fts_phrase(query), 'branch': branch_id, 'limit': limit})]
+    members = {m.id: m for m in db.session.scalars(select(Member).where(Member.id.in_(ids)))} if ids else {}
+    results = sorted((members[i] for i in ids if i in members), key=lambda m: -_similarity(query, m))
+    if len(results) < limit:
+        # Fuzzy fallback: members sharing any trigram, re-ranked by similarity
+        candidate_ids = [row[0] for row in db.session.execute(
+                             FTS_RANKED, {'q': _fts_fuzzy(query), 'branch': branch_id, 'limit': limit * 5})
+                         if row[0] not in members]
+        if candidate_ids:
+            candidates = db.session.scalars(select(Member).where(Member.id.in_(candidate_ids)))
+            results += _fuzzy_matches(query, candidates, limit - len(results))
+    return results
+
+def member_search_query(query, limit):
+    """Single-statement search for the pg_trgm and plain LIKE backends"""
+    # Trigram indexes need at least 3 characters
+    if len(query) >= 3 and app.config['SEARCH_BACKEND'] == 'pg_trgm':
+        score = func.greatest(func.similarity(Member.name, query),
+                              func.similarity(func.coalesce(Member.phone, ''), query))
+        return select(Member).where(or_(
+            Member.name.ilike(f'%{query}%'),
+            Member.phone.like(f'%{query}%'),
+            Member.name.op('%')(query),
+        )).order_by(score.desc()).limit(limit)
+    return select(Member).where(or_(
+        Member.name.ilike(f'%{query}%'),
+        Member.phone.like(f'{query}%')
+    )).limit(limit)
+
+def search_members(query, limit=10):
+    """Members matching ``query`` on name or phone, best matches first"""
+    if len(query) >= 3 and app.config['SEARCH_BACKEND'] == 'fts5':
+        return _search_members_fts(query, limit)
+    return db.session.scalars(member_search_query(query, limit)).all()
+
+def member_search_dict(member):
+    return {
+        'id': member.id,
+        'name': member.name,
+        'membership_type': member.membership_type,
+        'phone': member.phone,
+        'expiry_date': member.expiry_date.strftime('%Y-%m-%d')
+    }
+
 @app.route('/api/search_members')
 def api_search_members():
     if 'user' not in session:
@@ -294,20 +1838,8 @@ def api_search_members():
     if not query:
         return jsonify([])
     
-    members = Member.query.filter(
-        Member.name.ilike(f'%{query}%')
-    ).limit(10).all()
-    
-    result = []
-    for member in members:
-        result.append({
-            'id': member.id,
-            'name': member.name,
-            'membership_type': member.membership_type,
-            'expiry_date': member.expiry_date.strftime('%Y-%m-%d')
-        })
-    
-    return jsonify(result)
+    members = search_members(query)
+    return jsonify([member_search_dict(member) for member in members])
 
 @app.route('/api/members_needing_reminders')
 def api_members_needing_reminders():
@@ -315,29 +1847,11 @@ def api_members_needing_reminders():
     if 'user' not in session:
         return jsonify([])
     
-    sa_time = datetime.utcnow() + timedelta(hours=2)
-    today_sa = sa_time.date()
+    today_sa = sa_time.sa_today()
     
-    # Members with phones expiring in next 3 days or expired
-    members = Member.query.filter(
-        Member.phone.isnot(None),
-        Member.phone != '',
-        Member.expiry_date <= today_sa + timedelta(days=3)
-    ).all()
-    
-    result = []
-    for member in members:
-        days_until_expiry = (member.expiry_date - today_sa).days
-        result.append({
-            'id': member.id,
-            'name': member.name,
-            'membership_type': member.membership_type,
-            'phone': member.phone,
-            'expiry_date': member.expiry_date.strftime('%Y-%m-%d'),
-            'days_until_expiry': days_until_expiry
-        })
-    
-    return jsonify(result)
+    members = db.session.scalars(members_needing_reminders_query(today_sa)).all()
+    return jsonify([dict(member_search_dict(member), days_until_expiry=(member.expiry_date - today_sa).days)
+                    for member in members])
 
 @app.route('/api/members_with_phones')
 def api_members_with_phones():
@@ -345,20 +1859,8 @@ def api_members_with_phones():
     if 'user' not in session:
         return jsonify([])
     
-    members = Member.query.filter(
-        Member.phone.isnot(None),
-        Member.phone != ''
-    ).limit(5).all()
-    
-    result = []
-    for member in members:
-        result.append({
-            'id': member.id,
-            'name': member.name,
-            'phone': member.phone
-        })
-    
-    return jsonify(result)
+    members = db.session.scalars(members_with_phones_query()).all()
+    return jsonify([{'id': member.id, 'name': member.name, 'phone': member.phone} for member in members])
 
 @app.route('/send_reminder/<int:member_id>')
 def send_reminder(member_id):
@@ -371,20 +1873,14 @@ def send_reminder(member_id):
     if not member.phone:
         return jsonify({'success': False, 'message': 'Member has no phone number'})
     
-    sa_time = datetime.utcnow() + timedelta(hours=2)
-    today_sa = sa_time.date()
+    today_sa = sa_time.sa_today()
     
     # Determine reminder type based on expiry date
     days_until_expiry = (member.expiry_date - today_sa).days
-    
-    if days_until_expiry == 0:
-        reminder_type = 'expiry_today'
-    elif 1 <= days_until_expiry <= 3:
-        reminder_type = 'expiry_3_days'
-    elif days_until_expiry < 0:
-        reminder_type = 'expired'
-    else:
-        reminder_type = 'general'
+    reminder_type = reminder_type_for(days_until_expiry)
+
+    if reminder_sent_today(member.id, reminder_type, today_sa):
+        return jsonify({'success': False, 'message': f'{member.name} was already sent this reminder today'})
     
     success, message = send_sms_reminder(member, reminder_type)
     
@@ -395,13 +1891,34 @@ def send_reminder(member_id):
         'days_until_expiry': days_until_expiry
     })
    
+@app.route('/send_reminders', methods=['POST'])
+def send_reminders():
+    """Send reminders to every member needing one as a single background job"""
+    if 'user' not in session:
+        return jsonify({'success': False, 'message': 'Not logged in'})
+
+    today_sa = sa_time.sa_today()
+    items = pending_reminder_items(today_sa)
+    if not items:
+        return jsonify({'success': False, 'message': 'No members need reminders right now'})
+    job = start_reminder_job(items)
+    return jsonify({'success': True, 'job': job.to_dict()}), 202
+
+@app.route('/reminder_jobs/<int:job_id>')
+def reminder_job_status(job_id):
+    if 'user' not in session:
+        return jsonify({'success': False, 'message': 'Not logged in'})
+    job = db.get_or_404(ReminderJob, job_id)
+    return jsonify({'success': True, 'job': job.to_dict()})
+
 @app.route('/create_sample_payments')
 def create_sample_payments():
     if 'user' not in session:
         return redirect(url_for('login'))
     
-    # Delete existing payments
-    Payment.query.delete()
+    # Delete existing payments one by one so the revenue rollups and metric cache follow
+    for payment in Payment.query.all():
+        db.session.delete(payment)
     
     # Get some members
     members = Member.query.limit(3).all()
@@ -409,7 +1926,7 @@ def create_sample_payments():
         return "No members found to create sample payments for"
     
     # Create sample payments for the last 6 months
-    today = datetime.today().date()
+    today = sa_time.sa_today()
     sample_payments = []
     
     for i in range(6):
@@ -431,12 +1948,179 @@ def create_sample_payments():
     
     return f"Created {len(sample_payments)} sample payments for testing"
 
+# Keyset pagination - list views page on (sort column, id) so every page is an
+# index range scan, however far down the list the user scrolls
+MAX_PAGE_SIZE = 500
+
+def encode_cursor(sort, value, row_id):
+    if isinstance(value, (date, datetime)):
+        value = value.isoformat()
+    raw = json.dumps([sort, value, row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor, sort, column):
+    """(value, id) from a cursor, or None if it is invalid or for another sort"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        cursor_sort, value, row_id = json.loads(raw)
+        if cursor_sort != sort or isinstance(row_id, bool) or not isinstance(row_id, int):
+            return None
+        python_type = column.type.python_type
+        if value is None:
+            pass
+        elif python_type in (date, datetime):
+            value = python_type.fromisoformat(value)
+        elif python_type is float and isinstance(value, int) and not isinstance(value, bool):
+            value = float(value)
+        elif not isinstance(value, python_type) or (isinstance(value, bool) and python_type is not bool):
+            # A tampered cursor must not reach the comparison with the wrong type
+            return None
+        return value, row_id
+    except (ValueError, TypeError):
+        return None
+
+def keyset_page(query, model, sorts, default_sort, descending=False):
+    """Page of ``query`` selected by the request's sort/order/size/after args.
+
+    Returns (rows, next_cursor, args) where ``args`` are the paging arguments
+    to repeat when fetching the next page.
+    """
+    sort = request.args.get('sort', default_sort)
+    if sort not in sorts:
+        sort = default_sort
+    order = request.args.get('order')
+    if order in ('asc', 'desc'):
+        descending = order == 'desc'
+    size = request.args.get('size', app.config['PAGE_SIZE'], type=int)
+    size = min(max(size, 1), MAX_PAGE_SIZE)
+    column = sorts[sort]
+
+    cursor = request.args.get('after')
+    position = decode_cursor(cursor, sort, column) if cursor else None
+    if position:
+        value, row_id = position
+        if descending:
+            query = query.filter(or_(column < value, and_(column == value, model.id < row_id)))
+        else:
+            query = query.filter(or_(column > value, and_(column == value, model.id > row_id)))
+
+    if descending:
+        query = query.order_by(column.desc(), model.id.desc())
+    else:
+        query = query.order_by(column, model.id)
+    rows = query.limit(size + 1).all()
+
+    next_cursor = None
+    if len(rows) > size:
+        rows = rows[:size]
+        last = rows[-1]
+        next_cursor = encode_cursor(sort, getattr(last, column.key), last.id)
+    args = {'sort': sort, 'order': 'desc' if descending else 'asc', 'size': size}
+    return rows, next_cursor, args
+
+def page_json(template, name, rows, next_cursor, serialize):
+    """JSON page with both the raw items and the rendered table rows"""
+    return jsonify({
+        'items': [serialize(row) for row in rows],
+        'next_cursor': next_cursor,
+        'html': render_template(template, **{name: rows}),
+    })
+
+MEMBER_SORTS = {'name': Member.name, 'expiry_date': Member.expiry_date}
+PAYMENT_SORTS = {'date': Payment.date}
+CLASS_SORTS = {'date': GymClass.date, 'starts_at': GymClass.starts_at}
+CHECKIN_SORTS = {'checkin_time': Checkin.checkin_time}
+
+def member_to_dict(member):
+    return {
+        'id': member.id,
+        'name': member.name,
+        'membership_type': member.membership_type,
+        'phone': member.phone,
+        'expiry_date': member.expiry_date.strftime('%Y-%m-%d'),
+    }
+
+def payment_to_dict(payment):
+    return {
+        'id': payment.id,
+        'member_id': payment.member_id,
+        'member_name': payment.member.name if payment.member else None,
+        'amount': payment.amount,
+        'date': payment.date.strftime('%Y-%m-%d'),
+        'method': payment.method,
+    }
+
+def class_to_dict(gym_class):
+    return {
+        'id': gym_class.id,
+        'name': gym_class.name,
+        'trainer': gym_class.trainer,
+        'date': gym_class.date.strftime('%Y-%m-%d'),
+        'time': gym_class.time,
+        'starts_at': gym_class.starts_at.isoformat() if gym_class.starts_at else None,
+        'series_id': gym_class.series_id,
+        'cancelled': gym_class.cancelled,
+        'capacity': gym_class.capacity,
+        'booked': gym_class.booked,
+    }
+
+def checkin_to_dict(checkin):
+    return {
+        'id': checkin.id,
+        'member_id': checkin.member_id,
+        'member_name': checkin.member.name if checkin.member else None,
+        'checkin_time': checkin.checkin_time.isoformat(),
+        'checkin_date': checkin.checkin_date.strftime('%Y-%m-%d'),
+    }
+
 @app.route('/members')
 def members():
     if 'user' not in session:
         return redirect(url_for('login'))
-    all_members = Member.query.order_by(Member.name).all()
-    return render_template("members.html", members=all_members)
+    page, next_cursor, args = keyset_page(Member.query, Member, MEMBER_SORTS, 'name')
+    return render_template("members.html", members=page, next_cursor=next_cursor,
+                           endpoint=url_for('api_members', **args))
+
+@app.route('/api/members')
+def api_members():
+    if 'user' not in session:
+        return jsonify({'items': [], 'next_cursor': None, 'html': ''})
+    page, next_cursor, _ = keyset_page(Member.query, Member, MEMBER_SORTS, 'name')
+    return page_json("_member_rows.html", 'members', page, next_cursor, member_to_dict)
+
+def validate_member_fields(name, membership_type, phone, expiry_raw, today):
+    """Validated Member column values; raises ValueError with a user-facing message"""
+    if not name or not membership_type:
+        raise ValueError("Name and membership type are required.")
+
+    # Validate phone format if provided
+    if phone and (len(phone) != 10 or not phone.startswith('0')):
+        raise ValueError("Phone number must be 10 digits starting with 0 (e.g., 0123456789)")
+
+    # Choose expiry based on membership_type
+    mt_lower = membership_type.lower()
+    if mt_lower == "monthly":
+        expiry = today + timedelta(days=30)
+    elif mt_lower == "quarterly":
+        expiry = today + timedelta(days=90)
+    elif mt_lower == "yearly":
+        expiry = today + timedelta(days=365)
+    elif mt_lower == "custom" and not expiry_raw:
+        raise ValueError("Expiry date required for Custom membership.")
+    elif expiry_raw:
+        try:
+            expiry = datetime.strptime(expiry_raw, "%Y-%m-%d").date()
+        except ValueError:
+            raise ValueError("Invalid expiry date format.")
+    else:
+        expiry = today + timedelta(days=30)
+
+    return {
+        'name': name,
+        'membership_type': membership_type,
+        'expiry_date': expiry,
+        'phone': phone if phone else None,  # Store phone if provided
+    }
 
 # Provide both a form route and POST handler at the same endpoint for ease
 @app.route('/add_member', methods=['GET', 'POST'])
@@ -449,48 +2133,15 @@ def add_member():
         membership_type = request.form.get("membership_type", "").strip()
         phone = request.form.get("phone", "").strip()  # Get phone number
 
-        if not name or not membership_type:
-            flash("Name and membership type are required.", "error")
-            return redirect(url_for('add_member'))
-
-        # Validate phone format if provided
-        if phone and (len(phone) != 10 or not phone.startswith('0')):
-            flash("Phone number must be 10 digits starting with 0 (e.g., 0123456789)", "error")
-            return redirect(url_for('add_member'))
-
-        today = datetime.today().date()
-        # Choose expiry based on membership_type
-        mt_lower = membership_type.lower()
         try:
-            if mt_lower == "monthly":
-                expiry = today + timedelta(days=30)
-            elif mt_lower == "quarterly":
-                expiry = today + timedelta(days=90)
-            elif mt_lower == "yearly":
-                expiry = today + timedelta(days=365)
-            elif mt_lower == "custom":
-                expiry_raw = request.form.get("expiry")
-                if not expiry_raw:
-                    flash("Expiry date required for Custom membership.", "error")
-                    return redirect(url_for('add_member'))
-                expiry = datetime.strptime(expiry_raw, "%Y-%m-%d").date()
-            else:
-                expiry_raw = request.form.get("expiry")
-                if expiry_raw:
-                    expiry = datetime.strptime(expiry_raw, "%Y-%m-%d").date()
-                else:
-                    expiry = today + timedelta(days=30)
-        except ValueError:
-            flash("Invalid expiry date format.", "error")
+            fields = validate_member_fields(name, membership_type, phone,
+                                            request.form.get("expiry"), sa_time.sa_today())
+        except ValueError as e:
+            flash(str(e), "error")
             return redirect(url_for('add_member'))
 
         # member with phone number
-        new_member = Member(
-            name=name, 
-            membership_type=membership_type, 
-            expiry_date=expiry,
-            phone=phone if phone else None  # Store phone if provided
-        )
+        new_member = Member(**fields)
         db.session.add(new_member)
         db.session.commit()
         
@@ -501,7 +2152,7 @@ def add_member():
             
         return redirect(url_for('members'))
 
-    today_str = datetime.today().strftime('%Y-%m-%d')
+    today_str = sa_time.sa_today().strftime('%Y-%m-%d')
     return render_template("add_member.html", today=today_str)
 
 @app.route('/members/edit/<int:id>', methods=['GET', 'POST'])
@@ -530,7 +2181,7 @@ def edit_member(id):
                 return redirect(url_for('edit_member', id=id))
         else:
             # If no date provided, calculate based on membership type
-            today = datetime.today().date()
+            today = sa_time.sa_today()
             mt_lower = membership_type.lower()
             if mt_lower == "monthly":
                 expiry = today + timedelta(days=30)
@@ -563,12 +2214,259 @@ def delete_member(id):
     flash(f'Member {member.name} deleted.', 'success')
     return redirect(url_for('members'))
 
+def class_window():
+    """First and last SA day of the classes being viewed (?from=YYYY-MM-DD, CLASS_WINDOW_DAYS long,
+    starting at most CLASS_HORIZON_DAYS ahead)"""
+    today = sa_time.sa_today()
+    days = app.config['CLASS_WINDOW_DAYS']
+    try:
+        first = date.fromisoformat(request.args.get('from', ''))
+        # The previous-window link has to be a valid date too
+        first - timedelta(days=days)
+    except (ValueError, OverflowError):
+        first = today
+    first = min(first, today + timedelta(days=app.config['CLASS_HORIZON_DAYS']))
+    return first, first + timedelta(days=days - 1)
+
+def classes_in_window(first, last):
+    """Classes between two SA days, creating any recurring occurrences not yet stored"""
+    expand_class_series(last)
+    return GymClass.query.filter(GymClass.date >= first, GymClass.date <= last)
+
 @app.route('/classes')
 def classes():
     if 'user' not in session:
         return redirect(url_for('login'))
-    all_classes = GymClass.query.all()
-    return render_template("classes.html", classes=all_classes)
+    first, last = class_window()
+    page, next_cursor, args = keyset_page(classes_in_window(first, last), GymClass, CLASS_SORTS, 'starts_at')
+    days = app.config['CLASS_WINDOW_DAYS']
+    return render_template("classes.html", classes=page, next_cursor=next_cursor,
+                           endpoint=url_for('api_classes', **{'from': first.isoformat()}, **args),
+                           window_start=first, window_end=last,
+                           previous_window=(first - timedelta(days=days)).isoformat(),
+                           next_window=(last + timedelta(days=1)).isoformat(),
+                           series=ClassSeries.query.filter(or_(ClassSeries.ends_on.is_(None),
+                                                               ClassSeries.ends_on >= first)).all())
+
+@app.route('/api/classes')
+def api_classes():
+    if 'user' not in session:
+        return jsonify({'items': [], 'next_cursor': None, 'html': ''})
+    first, last = class_window()
+    page, next_cursor, _ = keyset_page(classes_in_window(first, last), GymClass, CLASS_SORTS, 'starts_at')
+    return page_json("_class_rows.html", 'classes', page, next_cursor, class_to_dict)
+
+def class_form_fields(form):
+    """GymClass fields from the add/edit class form; raises ValueError with a message to flash"""
+    try:
+        class_date = datetime.strptime(form.get('date', ''), "%Y-%m-%d").date()
+    except ValueError:
+        raise ValueError("Invalid date format. Please use YYYY-MM-DD.")
+    capacity = (form.get('capacity') or '').strip()
+    if capacity and (not capacity.isdigit() or int(capacity) < 1):
+        raise ValueError("Capacity must be a whole number of at least 1.")
+    return {'name': form['name'], 'trainer': form.get('trainer', ''), 'date': class_date,
+            'time': form.get('time', ''), 'capacity': int(capacity) if capacity else None}
+
+# Class bookings - a spot is claimed with one conditional UPDATE on the class
+# row, so concurrent bookings can never push a class over capacity
+BOOKING_STATUS_CODES = {'booked': 201, 'already_booked': 409, 'full': 409, 'class_started': 409,
+                        'class_cancelled': 409,
+                        'membership_expired': 403, 'member_not_found': 404, 'class_not_found': 404}
+
+def book_class(class_id, member_id):
+    """Book ``member_id`` into a class and return a status from BOOKING_STATUS_CODES"""
+    member = db.session.get(Member, member_id)
+    if member is None:
+        return 'member_not_found'
+    if not member.is_active():
+        return 'membership_expired'
+    gym_class = db.session.execute(select(GymClass.starts_at, GymClass.cancelled)
+                                   .where(GymClass.id == class_id)).first()
+    if gym_class is None or gym_class.starts_at is None:
+        return 'class_not_found'
+    starts_at = gym_class.starts_at
+    if gym_class.cancelled:
+        return 'class_cancelled'
+    if starts_at <= sa_time.utc_now():
+        return 'class_started'
+    if db.session.execute(select(ClassBooking.id).where(ClassBooking.class_id == class_id,
+                                                         ClassBooking.member_id == member_id)).first():
+        return 'already_booked'
+    claimed = db.session.execute(
+        GymClass.__table__.update()
+        .where(GymClass.id == class_id,
+               or_(GymClass.capacity.is_(None), GymClass.booked < GymClass.capacity))
+        .values(booked=GymClass.booked + 1)
+    ).rowcount
+    if not claimed:
+        db.session.rollback()
+        return 'full'
+    db.session.add(ClassBooking(class_id=class_id, member_id=member_id))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Already booked: the rollback also returns the spot claimed above
+        db.session.rollback()
+        return 'already_booked'
+    return 'booked'
+
+def cancel_booking(class_id, member_id):
+    """Cancel a booking and free its spot; False if there was none"""
+    # The Core statements below are not branch-filtered, so the class must be visible first
+    if db.session.execute(select(GymClass.id).where(GymClass.id == class_id)).first() is None:
+        return False
+    deleted = db.session.execute(
+        ClassBooking.__table__.delete()
+        .where(ClassBooking.class_id == class_id, ClassBooking.member_id == member_id)
+    ).rowcount
+    if deleted:
+        db.session.execute(
+            GymClass.__table__.update()
+            .where(GymClass.id == class_id, GymClass.booked > 0)
+            .values(booked=GymClass.booked - 1)
+        )
+    db.session.commit()
+    return bool(deleted)
+
+@event.listens_for(Session, 'after_flush')
+def release_booked_spots(session, flush_context):
+    """Bookings removed by a cascade (e.g. deleting a member) free their spot in classes that remain"""
+    deleted_classes = {obj.id for obj in session.deleted if isinstance(obj, GymClass)}
+    freed = Counter(obj.class_id for obj in session.deleted
+                    if isinstance(obj, ClassBooking) and obj.class_id not in deleted_classes)
+    for class_id, n in freed.items():
+        session.connection().execute(
+            GymClass.__table__.update()
+            .where(GymClass.id == class_id)
+            .values(booked=case((GymClass.booked > n, GymClass.booked - n), else_=0))
+        )
+
+@app.route('/api/classes/<int:class_id>/bookings', methods=['POST'])
+def api_book_class(class_id):
+    """Book a member into a class: {"member_id": 12}"""
+    if 'user' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    payload = request.get_json(silent=True) or request.form
+    member_id = payload.get('member_id') if isinstance(payload, dict) else None
+    # Form fields arrive as strings, but a JSON true or 1.5 is not a member id
+    if isinstance(member_id, (bool, float)):
+        member_id = None
+    try:
+        member_id = int(member_id)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'member_id must be an integer'}), 400
+    status = book_class(class_id, member_id)
+    return jsonify({'class_id': class_id, 'member_id': member_id, 'status': status}), BOOKING_STATUS_CODES[status]
+
+@app.route('/api/classes/<int:class_id>/bookings/<int:member_id>', methods=['DELETE'])
+def api_cancel_booking(class_id, member_id):
+    if 'user' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    if not cancel_booking(class_id, member_id):
+        return jsonify({'error': 'No such booking'}), 404
+    return jsonify({'class_id': class_id, 'member_id': member_id, 'status': 'cancelled'})
+
+# Recurring classes - a ClassSeries stores the weekly pattern once; GymClass
+# rows for its occurrences are created lazily for the window being viewed, so
+# editing or cancelling one occurrence is just editing that row
+WEEKDAY_CODES = ('MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU')
+
+def series_occurrences(series, first, last):
+    """Dates in first..last on which ``series`` meets"""
+    weekdays = {WEEKDAY_CODES.index(code) for code in series.weekdays.split(',')}
+    first = max(first, series.starts_on)
+    if series.ends_on:
+        last = min(last, series.ends_on)
+    anchor = sa_time.week_start(series.starts_on)
+    day = first
+    while day <= last:
+        weeks = (sa_time.week_start(day) - anchor).days // 7
+        if day.weekday() in weekdays and weeks % (series.interval or 1) == 0:
+            yield day
+        day += timedelta(days=1)
+
+def expand_class_series(through):
+    """Create the GymClass rows of every series up to ``through`` (at most CLASS_HORIZON_DAYS ahead);
+    returns how many were added"""
+    through = min(through, sa_time.sa_today() + timedelta(days=app.config['CLASS_HORIZON_DAYS']))
+    pending = ClassSeries.query.filter(
+        or_(ClassSeries.expanded_through.is_(None), ClassSeries.expanded_through < through),
+        or_(ClassSeries.ends_on.is_(None), ClassSeries.expanded_through.is_(None),
+            ClassSeries.ends_on > ClassSeries.expanded_through)
+    ).all()
+    if not pending:
+        return 0
+    rows = []
+    for series in pending:
+        first = series.expanded_through + timedelta(days=1) if series.expanded_through else series.starts_on
+        rows.extend({'series_id': series.id, 'branch_id': series.branch_id, 'name': series.name,
+                     'trainer': series.trainer, 'date': day,
+                     'time': series.time, 'capacity': series.capacity, 'booked': 0, 'cancelled': False,
+                     'starts_at': class_starts_at(day, series.time)}
+                    for day in series_occurrences(series, first, through))
+        series.expanded_through = through
+    added = []
+    if rows:
+        connection = db.session.connection()
+        dialect = connection.dialect.name
+        if dialect in ('sqlite', 'postgresql'):
+            # Another worker may be expanding the same window; the unique (series_id, date) index keeps one copy
+            stmt = ((sqlite if dialect == 'sqlite' else postgresql).insert(GymClass.__table__)
+                    .on_conflict_do_nothing(index_elements=['series_id', 'date'])
+                    .returning(GymClass.branch_id, GymClass.date))
+            added = db.session.execute(stmt, rows).mappings().all()
+        else:
+            db.session.execute(GymClass.__table__.insert(), rows)
+            added = rows
+        rollup_inserted(connection, GymClass, added)
+    db.session.commit()
+    return len(added)
+
+def series_form_fields(form, fields):
+    """ClassSeries fields from the add class form's repeat options, or None for a one-off class"""
+    weekdays = [code for code in WEEKDAY_CODES if code in form.getlist('repeat_days')]
+    if not weekdays:
+        return None
+    interval = (form.get('repeat_every') or '1').strip()
+    if not interval.isdigit() or int(interval) < 1:
+        raise ValueError("Repeat every must be a whole number of weeks.")
+    ends_on = None
+    if form.get('repeat_until'):
+        try:
+            ends_on = datetime.strptime(form['repeat_until'], "%Y-%m-%d").date()
+        except ValueError:
+            raise ValueError("Invalid repeat-until date. Please use YYYY-MM-DD.")
+        if ends_on < fields['date']:
+            raise ValueError("Repeat-until date must be on or after the first class.")
+    return {'name': fields['name'], 'trainer': fields['trainer'], 'time': fields['time'],
+            'capacity': fields['capacity'], 'weekdays': ','.join(weekdays), 'interval': int(interval),
+            'starts_on': fields['date'], 'ends_on': ends_on}
+
+@app.route('/end_class_series/<int:series_id>')
+def end_class_series(series_id):
+    """Stop a series after today; occurrences already created for later days are removed"""
+    if 'user' not in session:
+        return redirect(url_for('login'))
+    series = ClassSeries.query.get_or_404(series_id)
+    today = sa_time.sa_today()
+    last_day = min(series.ends_on or today, today)
+    later = db.session.execute(select(GymClass.id, GymClass.date, GymClass.cancelled)
+                               .where(GymClass.series_id == series.id, GymClass.date > last_day)).all()
+    if later:
+        ids = [row.id for row in later]
+        db.session.execute(delete(ClassBooking).where(ClassBooking.class_id.in_(ids)))
+        db.session.execute(delete(GymClass).where(GymClass.id.in_(ids)))
+        apply_rollup_deltas(db.session.connection(),
+                            classes=Counter({(series.branch_id, row.date): -1 for row in later if not row.cancelled}))
+    if series.starts_on > today:
+        db.session.delete(series)
+        flash(f"{series.name} removed before its first class.", "success")
+    else:
+        series.ends_on = last_day
+        flash(f"{series.name} will not repeat after {last_day}.", "success")
+    db.session.commit()
+    return redirect(url_for('classes'))
 
 @app.route('/add_class_form')
 def add_class_form():
@@ -583,22 +2481,18 @@ def add_class():
         return redirect(url_for('login'))
     
     try:
-        # Convert date string to date object
-        date_str = request.form.get('date','')
-        date_obj = datetime.strptime(date_str, "%Y-%m-%d").date()
-        
-        new_class = GymClass(
-            name=request.form['name'],
-            trainer=request.form.get('trainer',''),
-            date=date_obj,
-            time=request.form.get('time',''),
-            capacity=request.form.get('capacity', None)
-        )
-        db.session.add(new_class)
-        db.session.commit()
-        flash("Class added successfully!", "success")
-    except ValueError:
-        flash("Invalid date format. Please use YYYY-MM-DD.", "error")
+        fields = class_form_fields(request.form)
+        series_fields = series_form_fields(request.form, fields)
+        if series_fields:
+            db.session.add(ClassSeries(**series_fields))
+            db.session.commit()
+            flash(f"Recurring class added ({series_fields['weekdays']}).", "success")
+        else:
+            db.session.add(GymClass(**fields))
+            db.session.commit()
+            flash("Class added successfully!", "success")
+    except ValueError as e:
+        flash(str(e), "error")
     except Exception as e:
         flash(f"Error adding class: {e}", "error")
     
@@ -611,20 +2505,12 @@ def edit_class(class_id):
     
     if request.method == 'POST':
         try:
-            # Convert date string to date object
-            date_str = request.form.get('date','')
-            date_obj = datetime.strptime(date_str, "%Y-%m-%d").date()
-            
-            gym_class.name = request.form['name']
-            gym_class.trainer = request.form.get('trainer','')
-            gym_class.date = date_obj
-            gym_class.time = request.form.get('time','')
-            gym_class.capacity = request.form.get('capacity', None)
-            
+            for field, value in class_form_fields(request.form).items():
+                setattr(gym_class, field, value)
             db.session.commit()
             flash("Class updated successfully!", "success")
-        except ValueError:
-            flash("Invalid date format. Please use YYYY-MM-DD.", "error")
+        except ValueError as e:
+            flash(str(e), "error")
         except Exception as e:
             flash(f"Error updating class: {e}", "error")
         
@@ -635,6 +2521,18 @@ def edit_class(class_id):
 @app.route('/delete_class/<int:id>')
 def delete_class(id):
     gym_class = GymClass.query.get(id)
+    if gym_class and gym_class.series_id:
+        # Deleting the row would let the series re-create it, so cancel this occurrence instead
+        gym_class.cancelled = True
+        # Nobody stays booked into a cancelled class
+        released = db.session.execute(
+            ClassBooking.__table__.delete().where(ClassBooking.class_id == gym_class.id)
+        ).rowcount
+        gym_class.booked = 0
+        db.session.commit()
+        flash(f"{gym_class.name} on {gym_class.date} cancelled"
+              + (f"; {released} booking(s) released." if released else "."), "success")
+        return redirect(url_for('classes', **{'from': gym_class.date.isoformat()}))
     if gym_class:
         db.session.delete(gym_class)
         db.session.commit()
@@ -690,9 +2588,20 @@ def delete_trainer(id):
 def payments():
     if 'user' not in session:
         return redirect(url_for('login'))
-    all_payments = Payment.query.all()
-    members = Member.query.all()
-    return render_template("payments.html", payments=all_payments, members=members)
+    page, next_cursor, args = keyset_page(payments_query(), Payment, PAYMENT_SORTS, 'date', descending=True)
+    return render_template("payments.html", payments=page, next_cursor=next_cursor,
+                           endpoint=url_for('api_payments', **args))
+
+def payments_query():
+    # Rows show the member's name, so load members in the same SELECT
+    return Payment.query.options(joinedload(Payment.member))
+
+@app.route('/api/payments')
+def api_payments():
+    if 'user' not in session:
+        return jsonify({'items': [], 'next_cursor': None, 'html': ''})
+    page, next_cursor, _ = keyset_page(payments_query(), Payment, PAYMENT_SORTS, 'date', descending=True)
+    return page_json("_payment_rows.html", 'payments', page, next_cursor, payment_to_dict)
 
 @app.route('/add_payment', methods=['POST'])
 def add_payment():
@@ -702,9 +2611,14 @@ def add_payment():
     try:
         date_str = request.form['date']
         date_obj = datetime.strptime(date_str, "%Y-%m-%d").date()
+        # Only members of the user's branch are found, so a payment cannot land in another branch
+        member = db.session.get(Member, int(request.form['member_id']))
+        if member is None:
+            flash("Member not found.", "error")
+            return redirect(url_for('payments'))
         
         new_payment = Payment(
-            member_id=int(request.form['member_id']),
+            member=member,
             amount=float(request.form['amount']),
             date=date_obj,
             method=request.form.get('method','')
@@ -738,8 +2652,12 @@ def edit_payment(id):
         try:
             date_str = request.form['date']
             date_obj = datetime.strptime(date_str, "%Y-%m-%d").date()
+            member = db.session.get(Member, int(request.form['member_id']))
+            if member is None:
+                flash("Member not found.", "error")
+                return redirect(url_for('payments'))
             
-            payment.member_id = int(request.form['member_id'])
+            payment.member = member
             payment.amount = float(request.form['amount'])
             payment.date = date_obj
             payment.method = request.form.get('method', '')
@@ -766,6 +2684,233 @@ def delete_payment(id):
     flash("Payment deleted successfully!", "success")
     return redirect(url_for('payments'))
 
+# Bulk import - members and payments are read a row at a time from CSV or
+# JSON Lines, validated with the same rules as the forms and inserted in
+# batches with one executemany and one commit per batch
+IMPORT_MAX_ERRORS = 1000
+
+def read_import_rows(stream, fmt):
+    """Yield (line number, row dict) from a binary stream without loading it all"""
+    text_stream = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if fmt == 'csv':
+        reader = csv.DictReader(text_stream)
+        for row in reader:
+            yield reader.line_num, row
+    elif fmt == 'jsonl':
+        for line_num, line in enumerate(text_stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield line_num, row if isinstance(row, dict) else None
+    else:
+        raise ValueError(f"Unsupported import format {fmt!r} (use csv or jsonl)")
+
+def import_format(filename, default='csv'):
+    ext = os.path.splitext(filename or '')[1].lower()
+    return {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl', '.json': 'jsonl'}.get(ext, default)
+
+def _field(row, name):
+    value = row.get(name)
+    return '' if value is None else str(value).strip()
+
+def member_import_row(row, today):
+    return validate_member_fields(_field(row, 'name'), _field(row, 'membership_type'),
+                                  _field(row, 'phone'), _field(row, 'expiry') or _field(row, 'expiry_date'),
+                                  today)
+
+def payment_import_row(row, today):
+    try:
+        member_id = int(_field(row, 'member_id'))
+    except ValueError:
+        raise ValueError("member_id must be a whole number")
+    try:
+        amount = float(_field(row, 'amount'))
+    except ValueError:
+        raise ValueError("amount must be a number")
+    try:
+        payment_date = datetime.strptime(_field(row, 'date'), "%Y-%m-%d").date()
+    except ValueError:
+        raise ValueError("date must be YYYY-MM-DD")
+    return {'member_id': member_id, 'amount': amount, 'date': payment_date,
+            'method': _field(row, 'method')}
+
+def _insert_member_batch(batch):
+    db.session.execute(Member.__table__.insert(), [values for _, values in batch])
+    return []
+
+def _insert_payment_batch(batch):
+    member_ids = {values['member_id'] for _, values in batch}
+    # Payments belong to their member's branch
+    known = dict(db.session.execute(select(Member.id, Member.branch_id).where(Member.id.in_(member_ids))).all())
+    errors = [(line_num, f"member {values['member_id']} does not exist")
+              for line_num, values in batch if values['member_id'] not in known]
+    rows = [dict(values, branch_id=known[values['member_id']]) for _, values in batch if values['member_id'] in known]
+    if rows:
+        db.session.execute(Payment.__table__.insert(), rows)
+        rollup_inserted(db.session.connection(), Payment, rows)
+    return errors
+
+IMPORTERS = {
+    'members': (member_import_row, _insert_member_batch),
+    'payments': (payment_import_row, _insert_payment_batch),
+}
+
+def bulk_import(kind, rows, batch_size=None):
+    """Import ``rows`` of (line number, dict) and return a summary with per-row errors"""
+    parse, insert_batch = IMPORTERS[kind]
+    batch_size = batch_size or app.config['IMPORT_BATCH_SIZE']
+    today = sa_time.sa_today()
+    started = clock.perf_counter()
+    inserted, error_count, errors, batch = 0, 0, [], []
+
+    def record(line_num, message):
+        nonlocal error_count
+        error_count += 1
+        if len(errors) < IMPORT_MAX_ERRORS:
+            errors.append({'line': line_num, 'error': message})
+
+    def flush_batch():
+        nonlocal inserted
+        rejected = insert_batch(batch)
+        for line_num, message in rejected:
+            record(line_num, message)
+        db.session.commit()
+        inserted += len(batch) - len(rejected)
+        batch.clear()
+
+    for line_num, row in rows:
+        if row is None:
+            record(line_num, "Row is not a JSON object")
+            continue
+        try:
+            batch.append((line_num, parse(row, today)))
+        except ValueError as e:
+            record(line_num, str(e))
+            continue
+        if len(batch) >= batch_size:
+            flush_batch()
+    if batch:
+        flush_batch()
+
+    return {
+        'kind': kind,
+        'inserted': inserted,
+        'error_count': error_count,
+        'errors': errors,
+        'seconds': round(clock.perf_counter() - started, 3),
+    }
+
+@app.route('/import/<kind>', methods=['POST'])
+def import_data(kind):
+    """Bulk import members or payments from an uploaded CSV or JSON Lines file"""
+    if 'user' not in session:
+        return jsonify({'success': False, 'message': 'Not logged in'}), 401
+    if kind not in IMPORTERS:
+        return jsonify({'success': False, 'message': f'Unknown import type {kind}'}), 404
+
+    # One query per batch is expected here, however large the file
+    g.query_count_limit = None
+    upload = request.files.get('file')
+    if upload:
+        stream, fmt = upload.stream, import_format(upload.filename)
+    else:
+        # Raw request body, e.g. curl --data-binary @members.csv
+        stream, fmt = request.stream, 'csv'
+    fmt = request.args.get('format', fmt)
+    batch_size = request.args.get('batch_size', type=int)
+    try:
+        result = bulk_import(kind, read_import_rows(stream, fmt), batch_size)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    return jsonify(dict(result, success=True))
+
+@app.cli.command('import')
+@click.argument('kind', type=click.Choice(sorted(IMPORTERS)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-size', type=int, help='Rows per insert batch')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='Defaults to the file extension')
+def import_command(kind, path, batch_size, fmt):
+    """Bulk import members or payments from a CSV or JSON Lines file"""
+    with open(path, 'rb') as stream:
+        result = bulk_import(kind, read_import_rows(stream, fmt or import_format(path)), batch_size)
+    click.echo(f"Imported {result['inserted']} {kind} in {result['seconds']}s, "
+               f"{result['error_count']} rows rejected")
+    for error in result['errors']:
+        click.echo(f"  line {error['line']}: {error['error']}")
+
+# Streaming export - rows go straight from a server-side cursor into a chunked
+# response, so memory use stays flat however long the history is
+EXPORT_CHUNK_ROWS = 1000
+
+def export_statement(kind, start, end, member_id):
+    """SELECT for an export, filtered by an optional date range and member"""
+    if kind == 'payments':
+        stmt = select(Payment.id, Payment.member_id, Member.name.label('member_name'),
+                      Payment.amount, Payment.date, Payment.method) \
+            .outerjoin(Member, Payment.member_id == Member.id).order_by(Payment.date, Payment.id)
+        day_column, member_column = Payment.date, Payment.member_id
+    elif kind == 'checkins':
+        stmt = select(Checkin.id, Checkin.member_id, Member.name.label('member_name'),
+                      Checkin.checkin_date, Checkin.checkin_time) \
+            .outerjoin(Member, Checkin.member_id == Member.id).order_by(Checkin.checkin_date, Checkin.id)
+        day_column, member_column = Checkin.checkin_date, Checkin.member_id
+    elif kind == 'members':
+        stmt = select(Member.id, Member.name, Member.membership_type, Member.phone, Member.expiry_date) \
+            .order_by(Member.id)
+        day_column, member_column = Member.expiry_date, Member.id
+    else:
+        raise ValueError(f"Unknown export type {kind!r}")
+    if start:
+        stmt = stmt.where(day_column >= start)
+    if end:
+        stmt = stmt.where(day_column <= end)
+    if member_id:
+        stmt = stmt.where(member_column == member_id)
+    return stmt
+
+def stream_csv(stmt, bom=False, archived=()):
+    """Yield CSV text in chunks of EXPORT_CHUNK_ROWS rows, ``archived`` row chunks first"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if bom:
+        # Lets Excel detect UTF-8 when the file is opened directly
+        buffer.write('\ufeff')
+    result = db.session.execute(stmt.execution_options(yield_per=EXPORT_CHUNK_ROWS))
+    writer.writerow(result.keys())
+    for partition in chain(archived, result.partitions()):
+        writer.writerows(partition)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+@app.route('/export/<kind>')
+def export_data(kind):
+    """Download payments, check-ins or members as CSV (?format=excel for Excel)"""
+    if 'user' not in session:
+        return redirect(url_for('login'))
+    if kind not in ('payments', 'checkins', 'members'):
+        return jsonify({'success': False, 'message': f'Unknown export type {kind}'}), 404
+    try:
+        start = datetime.strptime(request.args['start'], '%Y-%m-%d').date() if request.args.get('start') else None
+        end = datetime.strptime(request.args['end'], '%Y-%m-%d').date() if request.args.get('end') else None
+        stmt = export_statement(kind, start, end, request.args.get('member_id', type=int))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+    excel = request.args.get('format') == 'excel'
+    filename = f"{kind}-{(start or 'all')}-{(end or sa_time.sa_today())}.csv"
+    archived = archived_checkin_export(start, end, request.args.get('member_id', type=int)) if kind == 'checkins' else ()
+    return Response(
+        stream_with_context(stream_csv(stmt, bom=excel, archived=archived)),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
 # Checkins
 @app.route('/checkin/<int:member_id>')
 def checkin_member(member_id):
@@ -779,20 +2924,21 @@ def checkin_member(member_id):
         flash(f'{member.name} cannot check in - membership expired on {member.expiry_date}!', 'error')
         return redirect(url_for('members'))
     
-    today_str = datetime.today().strftime('%Y-%m-%d')
-    already = Checkin.query.filter(db.func.date(Checkin.checkin_time) == today_str,
-                                   Checkin.member_id == member_id).first()
-    if already:
-        sa_time = already.checkin_time + timedelta(hours=2)
-        flash(f'{member.name} already checked in today at {sa_time.strftime("%H:%M")}', 'warning')
-        return redirect(url_for('members'))
-    
+    # The unique (member_id, checkin_date) index rejects a second check-in today
     new_checkin = Checkin(member_id=member_id)
     db.session.add(new_checkin)
-    db.session.commit()
-    
-    sa_time = new_checkin.checkin_time + timedelta(hours=2)
-    flash(f'{member.name} checked in at {sa_time.strftime("%H:%M:%S")}', 'success')
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        already = Checkin.query.filter_by(member_id=member_id,
+                                          checkin_date=sa_time.sa_today()).first()
+        already_at = sa_time.to_sa(already.checkin_time)
+        flash(f'{member.name} already checked in today at {already_at.strftime("%H:%M")}', 'warning')
+        return redirect(url_for('members'))
+
+    checked_in_at = sa_time.to_sa(new_checkin.checkin_time)
+    flash(f'{member.name} checked in at {checked_in_at.strftime("%H:%M:%S")}', 'success')
     return redirect(url_for('members'))
 
 @app.route('/checkins')
@@ -800,55 +2946,910 @@ def checkins():
     if 'user' not in session:
         return redirect(url_for('login'))
     
-    all_checkins = Checkin.query.order_by(Checkin.checkin_time.desc()).all()
-    
-    sa_time_now = datetime.utcnow() + timedelta(hours=2)
-    today_sa = sa_time_now.date()
-    
-    today_checkins = []
-    for checkin in all_checkins:
-        checkin_sa_time = checkin.checkin_time + timedelta(hours=2)
-        if checkin_sa_time.date() == today_sa:
-            today_checkins.append(checkin)
-    
-    valid_today_checkins = [c for c in today_checkins if c.member and c.member.is_active()]
-    
-    week_ago_sa = sa_time_now - timedelta(days=7)
-    month_ago_sa = sa_time_now - timedelta(days=30)
-    
-    week_checkins = len([c for c in all_checkins if (c.checkin_time + timedelta(hours=2)) >= week_ago_sa])
-    month_checkins = len([c for c in all_checkins if (c.checkin_time + timedelta(hours=2)) >= month_ago_sa])
-    
-    return render_template("checkins.html", 
-                         today_checkins=valid_today_checkins, 
-                         week_checkins=week_checkins, 
-                         month_checkins=month_checkins, 
+    today_sa = sa_time.sa_today()
+
+    today_query = valid_checkins_query(today_sa, today_sa)
+    page, next_cursor, args = keyset_page(today_query, Checkin, CHECKIN_SORTS, 'checkin_time', descending=True)
+
+    # Counted from the rollup like the dashboard, so live deltas keep adding to the same figure
+    today_checkins_count = checkin_total_since(today_sa)
+    week_checkins = checkin_total_since(today_sa - timedelta(days=6))
+    month_checkins = checkin_total_since(today_sa - timedelta(days=29))
+
+    return render_template("checkins.html",
+                         today_checkins=page,
+                         today_checkins_count=today_checkins_count,
+                         next_cursor=next_cursor,
+                         endpoint=url_for('api_checkins', date=today_sa.strftime('%Y-%m-%d'), **args),
+                         week_checkins=week_checkins,
+                         month_checkins=month_checkins,
                          today=today_sa.strftime('%Y-%m-%d'))
 
-@app.route('/cleanup_checkins')
+def valid_checkins_query(day, sa_today):
+    """Check-ins on an SA-local day by members whose membership is active"""
+    return Checkin.query.join(Member, Checkin.member_id == Member.id) \
+        .options(contains_eager(Checkin.member)) \
+        .filter(Checkin.checkin_date == day, Member.expiry_date >= sa_today)
+
+@app.route('/api/checkins')
+def api_checkins():
+    if 'user' not in session:
+        return jsonify({'items': [], 'next_cursor': None, 'html': ''})
+    today_sa = sa_time.sa_today()
+    try:
+        day = datetime.strptime(request.args.get('date', ''), '%Y-%m-%d').date()
+    except ValueError:
+        day = today_sa
+    page, next_cursor, _ = keyset_page(valid_checkins_query(day, today_sa), Checkin,
+                                       CHECKIN_SORTS, 'checkin_time', descending=True)
+    return page_json("_checkin_rows.html", 'checkins', page, next_cursor, checkin_to_dict)
+
+def checkin_total_since(first_day):
+    """Check-ins from first_day (SA-local) up to today, read from the rollup"""
+    return db.session.execute(
+        select(func.coalesce(func.sum(DailyCheckinRollup.checkins), 0))
+        .where(DailyCheckinRollup.day >= first_day)
+    ).scalar()
+
+# Kiosk check-ins - turnstiles post JSON; members are resolved from an
+# in-process cache and a single writer thread per branch group-commits the inserts
+class ActiveMemberCache:
+    """member id -> (name, membership_type, expiry_date) for one branch, reloaded every ``ttl`` seconds"""
+    def __init__(self, ttl, branch_id=DEFAULT_BRANCH_ID):
+        self.ttl = ttl
+        self.branch_id = branch_id
+        self._members = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def _load(self):
+        rows = db.session.execute(
+            select(Member.id, Member.name, Member.membership_type, Member.expiry_date)
+            .where(Member.branch_id == self.branch_id, Member.expiry_date >= sa_time.sa_today())
+        )
+        return {member_id: (name, membership_type, expiry) for member_id, name, membership_type, expiry in rows}
+
+    def lookup(self, member_ids):
+        """Cached entries for ``member_ids``; misses are confirmed against the database"""
+        with self._lock:
+            if self._loaded_at is None or clock.monotonic() - self._loaded_at > self.ttl:
+                self._members = self._load()
+                self._loaded_at = clock.monotonic()
+            found = {member_id: self._members[member_id] for member_id in member_ids if member_id in self._members}
+        missing = [member_id for member_id in member_ids if member_id not in found]
+        if missing:
+            # Members renewed by another worker since the last reload are still let in
+            rows = db.session.execute(
+                select(Member.id, Member.name, Member.membership_type, Member.expiry_date)
+                .where(Member.branch_id == self.branch_id, Member.id.in_(missing))
+            )
+            found.update({member_id: (name, membership_type, expiry)
+                          for member_id, name, membership_type, expiry in rows})
+        return found
+
+active_member_caches = BranchRegistry(
+    lambda branch_id: ActiveMemberCache(app.config['ACTIVE_MEMBER_CACHE_TTL'], branch_id))
+
+def record_checkins(batch, retry=True):
+    """Insert a batch of (member_id, checkin_time) for the current branch in one transaction
+    and return a result per entry"""
+    today = sa_time.sa_today()
+    branch_id = default_branch_id()
+    members = active_member_caches[branch_id].lookup(list({member_id for member_id, _ in batch}))
+    results, rows, membership_types = [], {}, {}
+    for member_id, checkin_time in batch:
+        member = members.get(member_id)
+        if member is None:
+            results.append({'member_id': member_id, 'status': 'not_found'})
+            continue
+        name, membership_type, expiry = member
+        if expiry < today:
+            results.append({'member_id': member_id, 'status': 'expired', 'name': name,
+                            'expiry_date': expiry.isoformat()})
+            continue
+        key = (member_id, sa_time.sa_day(checkin_time))
+        rows.setdefault(key, {'member_id': member_id, 'branch_id': branch_id,
+                              'checkin_time': checkin_time, 'checkin_date': key[1]})
+        membership_types[key] = membership_type
+        results.append({'member_id': member_id, 'status': None, 'name': name, 'key': key})
+
+    inserted = set()
+    if rows:
+        connection = db.session.connection()
+        dialect = connection.dialect.name
+        if dialect in ('sqlite', 'postgresql'):
+            # The unique (member_id, checkin_date) index skips members already in today
+            stmt = ((sqlite if dialect == 'sqlite' else postgresql).insert(Checkin.__table__)
+                    .on_conflict_do_nothing(index_elements=['member_id', 'checkin_date'])
+                    .returning(Checkin.member_id, Checkin.checkin_date))
+            try:
+                inserted = set(db.session.execute(stmt, list(rows.values())).tuples())
+            except IntegrityError:
+                # A member deleted by another worker was still cached; reload and try again
+                db.session.rollback()
+                if not retry:
+                    raise
+                active_member_caches[branch_id].invalidate()
+                return record_checkins(batch, retry=False)
+        else:
+            for key, row in rows.items():
+                try:
+                    with db.session.begin_nested():
+                        db.session.execute(Checkin.__table__.insert(), row)
+                    inserted.add(key)
+                except IntegrityError:
+                    pass
+        rollup_inserted(connection, Checkin, [dict(rows[key], membership_type=membership_types[key])
+                                              for key in inserted])
+        db.session.commit()
+
+    # Everyone else already checked in today; report when
+    duplicates = [key for key in rows if key not in inserted]
+    earlier = {}
+    if duplicates:
+        earlier = {(member_id, day): checkin_time for member_id, day, checkin_time in db.session.execute(
+            select(Checkin.member_id, Checkin.checkin_date, func.min(Checkin.checkin_time))
+            .where(Checkin.member_id.in_({member_id for member_id, _ in duplicates}),
+                   Checkin.checkin_date.in_({day for _, day in duplicates}))
+            .group_by(Checkin.member_id, Checkin.checkin_date)
+        )}
+    claimed = set()
+    for result in results:
+        key = result.pop('key', None)
+        if key is None:
+            continue
+        if key in inserted and key not in claimed:
+            claimed.add(key)
+            result['status'] = 'checked_in'
+            checkin_time = rows[key]['checkin_time']
+        else:
+            result['status'] = 'already_checked_in'
+            checkin_time = earlier.get(key, rows[key]['checkin_time'])
+        result['checkin_time'] = sa_time.to_sa(checkin_time).strftime('%H:%M:%S')
+    return results
+
+class CheckinWriter:
+    """Single writer thread that commits every check-in for a branch queued within ``window`` seconds together"""
+    def __init__(self, window, max_batch=500, branch_id=DEFAULT_BRANCH_ID):
+        self.window = window
+        self.max_batch = max_batch
+        self.branch_id = branch_id
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, member_ids, timeout=10):
+        """Queue check-ins for ``member_ids`` and wait for their results"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=f'checkin-writer-{self.branch_id}', daemon=True)
+                self._thread.start()
+        now = datetime.utcnow()
+        future = Future()
+        self._queue.put(([(member_id, now) for member_id in member_ids], future))
+        return future.result(timeout)
+
+    def _collect(self):
+        pending = [self._queue.get()]
+        size = len(pending[0][0])
+        deadline = clock.monotonic() + self.window
+        while size < self.max_batch:
+            remaining = deadline - clock.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            pending.append(item)
+            size += len(item[0])
+        return pending
+
+    def _run(self):
+        while True:
+            pending = self._collect()
+            with app.app_context(), branch_scope(self.branch_id):
+                try:
+                    results = record_checkins([entry for batch, _ in pending for entry in batch])
+                except Exception as exc:
+                    db.session.rollback()
+                    app.logger.exception("Kiosk check-in batch of %d failed", len(pending))
+                    for _, future in pending:
+                        future.set_exception(exc)
+                    continue
+            for batch, future in pending:
+                future.set_result(results[:len(batch)])
+                results = results[len(batch):]
+
+checkin_writers = BranchRegistry(
+    lambda branch_id: CheckinWriter(app.config['CHECKIN_COMMIT_WINDOW_MS'] / 1000, branch_id=branch_id))
+
+def kiosk_authorized():
+    token = app.config['KIOSK_TOKEN']
+    return 'user' in session or (token and request.headers.get('X-Kiosk-Token') == token)
+
+def kiosk_branch_id():
+    """The logged-in user's branch, else the branch a token kiosk names in X-Kiosk-Branch; None if unknown"""
+    if 'user' in session:
+        return current_branch_id()
+    branch_id = request.headers.get('X-Kiosk-Branch', DEFAULT_BRANCH_ID, type=int)
+    if branch_id not in checkin_writers and db.session.get(Branch, branch_id) is None:
+        return None
+    return branch_id
+
+def kiosk_member_ids(payload, key, max_batch):
+    values = payload.get(key) if isinstance(payload, dict) else None
+    if key == 'member_id':
+        values = [values]
+    if not isinstance(values, list) or not values or len(values) > max_batch:
+        return None
+    # JSON ids must be integers: true would pass int() as member 1, and 12.7 as member 12
+    if any(isinstance(value, bool) or not isinstance(value, int) for value in values):
+        return None
+    return values
+
+KIOSK_STATUS_CODES = {'checked_in': 201, 'already_checked_in': 200, 'expired': 403, 'not_found': 404}
+
+@app.route('/api/kiosk/checkin', methods=['POST'])
+def kiosk_checkin():
+    """Check in one member: {"member_id": 12}"""
+    if not kiosk_authorized():
+        return jsonify({'error': 'unauthorized'}), 401
+    branch_id = kiosk_branch_id()
+    if branch_id is None:
+        return jsonify({'error': 'unknown branch'}), 400
+    writer = checkin_writers[branch_id]
+    member_ids = kiosk_member_ids(request.get_json(silent=True), 'member_id', writer.max_batch)
+    if member_ids is None:
+        return jsonify({'error': 'member_id must be an integer'}), 400
+    try:
+        result, = writer.submit(member_ids)
+    except (OperationalError, TimeoutError):
+        return jsonify({'error': 'database busy, try again'}), 503
+    return jsonify(result), KIOSK_STATUS_CODES[result['status']]
+
+@app.route('/api/kiosk/checkins', methods=['POST'])
+def kiosk_checkin_batch():
+    """Check in several members at once: {"member_ids": [12, 15]}"""
+    if not kiosk_authorized():
+        return jsonify({'error': 'unauthorized'}), 401
+    branch_id = kiosk_branch_id()
+    if branch_id is None:
+        return jsonify({'error': 'unknown branch'}), 400
+    writer = checkin_writers[branch_id]
+    member_ids = kiosk_member_ids(request.get_json(silent=True), 'member_ids', writer.max_batch)
+    if member_ids is None:
+        return jsonify({'error': f'member_ids must be a list of 1-{writer.max_batch} integers'}), 400
+    try:
+        results = writer.submit(member_ids)
+    except (OperationalError, TimeoutError):
+        return jsonify({'error': 'database busy, try again'}), 503
+    return jsonify({'results': results})
+
+# Live updates - writes that change a dashboard counter append a LiveEvent
+# row in the same transaction (so only committed changes are announced). One
+# broker thread per worker polls the log and fans each event out to every
+# connected /events stream of the event's branch, so desks update counters
+# without re-querying
+class LiveEvent(BranchScoped, db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # 'checkin', 'payment', 'reminder', 'class'
+    day = db.Column(db.Date, nullable=False)  # SA-local day the change counts towards
+    count = db.Column(db.Integer, nullable=False, default=0)
+    amount = db.Column(db.Float, nullable=False, default=0.0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+def record_live_events(connection, events):
+    """Append events (dicts of kind, branch_id, day, count, amount), skipping ones that net to zero"""
+    events = [event for event in events if event['count'] or event['amount']]
+    if events:
+        now = datetime.utcnow()
+        connection.execute(LiveEvent.__table__.insert(), [dict(event, created_at=now) for event in events])
+
+def publish_rollup_deltas(connection, checkins=None, revenue=None, classes=None):
+    """Live events for the same deltas the rollups just absorbed, one per kind, branch and day"""
+    checkins_by_day = Counter()
+    for (branch_id, day, _), n in (checkins or {}).items():
+        checkins_by_day[(branch_id, day)] += n
+    revenue_by_day = {}
+    for (branch_id, day, _), (n, amount) in (revenue or {}).items():
+        count, total = revenue_by_day.get((branch_id, day), (0, 0.0))
+        revenue_by_day[(branch_id, day)] = (count + n, total + amount)
+    record_live_events(connection,
+        [{'kind': 'checkin', 'branch_id': branch_id, 'day': day, 'count': n, 'amount': 0.0}
+         for (branch_id, day), n in checkins_by_day.items()]
+        + [{'kind': 'payment', 'branch_id': branch_id, 'day': day, 'count': n, 'amount': amount}
+           for (branch_id, day), (n, amount) in revenue_by_day.items()]
+        + [{'kind': 'class', 'branch_id': branch_id, 'day': day, 'count': n, 'amount': 0.0}
+           for (branch_id, day), n in (classes or {}).items()])
+
+@event.listens_for(Session, 'after_flush')
+def publish_reminder_events(session, flush_context):
+    sent = Counter((obj.branch_id, sa_time.sa_day(obj.sent_date or datetime.utcnow())) for obj in session.new
+                   if isinstance(obj, PaymentReminder) and obj.status != 'failed')
+    if sent:
+        record_live_events(session.connection(),
+                           [{'kind': 'reminder', 'branch_id': branch_id, 'day': day, 'count': n, 'amount': 0.0}
+                            for (branch_id, day), n in sent.items()])
+
+def live_event_message(row, sa_today):
+    """SSE message for a LiveEvent; ``ranges`` says which counters it moves (the pages' week and
+    month are the last 7 and 30 days)"""
+    ranges = ['all']
+    if row.day > sa_today - timedelta(days=30):
+        ranges.append('month')
+    if row.day > sa_today - timedelta(days=7):
+        ranges.append('week')
+    if row.day == sa_today:
+        ranges.append('day')
+    data = json.dumps({'kind': row.kind, 'day': row.day.isoformat(), 'count': row.count,
+                       'amount': round(row.amount, 2), 'ranges': ranges})
+    return f"id: {row.id}\nevent: delta\ndata: {data}\n\n"
+
+class LiveEventBroker:
+    """Polls one database's LiveEvent log on one thread and copies new messages to the queues
+    subscribed to each event's branch"""
+    # Ids skipped by the poll may belong to transactions that commit late (PostgreSQL
+    # sequences); they are looked for again for this many seconds
+    gap_seconds = 10
+    queue_size = 1000
+
+    def __init__(self, interval, branch_id=None):
+        self.interval = interval
+        self.branch_id = branch_id  # database the log is read from; None is DATABASE_URL
+        self.last_id = None
+        self.subscribers = {}
+        self._gaps = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pruned_at = 0.0
+
+    def subscribe(self, branch_id=DEFAULT_BRANCH_ID, subscriber=None):
+        """Subscribe a queue (new unless given; anything with a put_nowait that raises queue.Full)
+        to ``branch_id``; returns it and the last event id already covered by the live feed"""
+        if subscriber is None:
+            subscriber = queue.Queue(self.queue_size)
+        with self._lock:
+            if self._thread is None:
+                with app.app_context(), branch_scope(self.branch_id, filtered=False):
+                    self.last_id = db.session.execute(select(func.max(LiveEvent.id))).scalar() or 0
+                self._thread = threading.Thread(target=self._run, name='live-event-broker', daemon=True)
+                self._thread.start()
+            self.subscribers.setdefault(branch_id, set()).add(subscriber)
+            return subscriber, self.last_id
+
+    def subscribed(self, subscriber):
+        with self._lock:
+            return any(subscriber in subscribers for subscribers in self.subscribers.values())
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            for subscribers in self.subscribers.values():
+                subscribers.discard(subscriber)
+
+    def poll(self):
+        """Fetch events committed since the last poll and hand them to subscribers"""
+        now = clock.monotonic()
+        floor = min(self._gaps, default=self.last_id + 1) - 1
+        rows = db.session.execute(select(LiveEvent).where(LiveEvent.id > floor)
+                                  .order_by(LiveEvent.id).limit(self.queue_size)).scalars().all()
+        sa_today = sa_time.sa_today()
+        messages = {}
+        for row in rows:
+            if row.id <= self.last_id and row.id not in self._gaps:
+                continue
+            self._gaps.pop(row.id, None)
+            if row.id > self.last_id:
+                self._gaps.update(dict.fromkeys(range(self.last_id + 1, row.id), now))
+                self.last_id = row.id
+            messages.setdefault(row.branch_id, []).append(live_event_message(row, sa_today))
+        self._gaps = {event_id: seen for event_id, seen in self._gaps.items() if now - seen < self.gap_seconds}
+        if now - self._pruned_at > 60:
+            db.session.execute(LiveEvent.__table__.delete().where(
+                LiveEvent.created_at < datetime.utcnow() - timedelta(seconds=app.config['LIVE_EVENT_RETENTION'])))
+            self._pruned_at = now
+        db.session.commit()
+        with self._lock:
+            subscribers = {branch_id: list(self.subscribers.get(branch_id, ())) for branch_id in messages}
+        for branch_id, branch_messages in messages.items():
+            for subscriber in subscribers[branch_id]:
+                for message in branch_messages:
+                    try:
+                        subscriber.put_nowait(message)
+                    except queue.Full:
+                        # A stalled client is dropped; its browser reconnects and catches up by Last-Event-ID
+                        self.unsubscribe(subscriber)
+                        break
+        return sum(len(branch_messages) for branch_messages in messages.values())
+
+    def _run(self):
+        while True:
+            try:
+                # One log query per poll, however many branches share the database
+                with app.app_context(), branch_scope(self.branch_id, filtered=False):
+                    self.poll()
+            except Exception:
+                app.logger.exception("Live event poll failed")
+            clock.sleep(self.interval)
+
+live_event_brokers = BranchRegistry(lambda branch_id: LiveEventBroker(app.config['LIVE_POLL_INTERVAL'], branch_id))
+
+def live_event_broker():
+    """Broker for the database the current branch is stored in"""
+    if app.config['BRANCH_DATABASE_URL'] and default_branch_id() != DEFAULT_BRANCH_ID:
+        return live_event_brokers[default_branch_id()]
+    return live_event_brokers[None]
+
+def live_event_backlog_query(after_id, through_id):
+    """Events a reconnecting client missed, from its Last-Event-ID up to where the live feed starts"""
+    return (select(LiveEvent).where(LiveEvent.id > after_id, LiveEvent.id <= through_id)
+            .order_by(LiveEvent.id).limit(LiveEventBroker.queue_size))
+
+def live_event_backlog(after_id, through_id):
+    rows = db.session.execute(live_event_backlog_query(after_id, through_id)).scalars().all()
+    sa_today = sa_time.sa_today()
+    return [live_event_message(row, sa_today) for row in rows]
+
+def live_stream_head(backlog, live_from, last_seen):
+    """Opening of every /events stream: reconnect delay, missed messages, then the id the live feed
+    starts after, so a browser that receives nothing before the stream ends still resumes from there"""
+    return ["retry: 3000\n\n", *backlog, f"id: {max(live_from, last_seen or 0)}\n\n"]
+
+@app.route('/events')
+def live_event_stream():
+    """Server-sent events: one 'delta' message per counter change in the user's branch
+
+    Each open stream holds a worker thread, so it ends after LIVE_STREAM_LIFETIME seconds and the
+    browser reconnects; asgi.py serves /events without a thread per stream.
+    """
+    if 'user' not in session:
+        return Response(status=401)
+    broker = live_event_broker()
+    subscriber, live_from = broker.subscribe(default_branch_id())
+    last_seen = request.headers.get('Last-Event-ID', type=int)
+    backlog = live_event_backlog(last_seen, live_from) if last_seen is not None else []
+    # Streams stay open for minutes; do not hold a pooled connection while they idle
+    db.session.close()
+    heartbeat = app.config['LIVE_HEARTBEAT']
+    closes_at = clock.monotonic() + app.config['LIVE_STREAM_LIFETIME']
+
+    def stream():
+        try:
+            yield from live_stream_head(backlog, live_from, last_seen)
+            while broker.subscribed(subscriber) and (remaining := closes_at - clock.monotonic()) > 0:
+                try:
+                    yield subscriber.get(timeout=min(heartbeat, remaining))
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+        finally:
+            broker.unsubscribe(subscriber)
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# Orphan cleanup - rows left behind by members (or classes) deleted before
+# cascades existed, removed with one anti-join DELETE per batch; each batch is
+# its own short transaction so kiosks and staff can write in between
+ORPHAN_SOURCES = [
+    # (model, column reported per deleted row, [(foreign key, parent id)])
+    (Checkin, Checkin.checkin_date, [(Checkin.member_id, Member.id)]),
+    (PaymentReminder, PaymentReminder.id, [(PaymentReminder.member_id, Member.id)]),
+    (ClassBooking, ClassBooking.class_id, [(ClassBooking.member_id, Member.id), (ClassBooking.class_id, GymClass.id)]),
+]
+# Payments are kept for the revenue history: a member id left dangling is cleared instead
+DETACHED_SOURCES = [(Payment, Payment.member_id, Member.id)]
+
+def day_runs(days):
+    """Collapse a set of days into (first, last) runs of consecutive days"""
+    runs = []
+    for day in sorted(days):
+        if runs and day - runs[-1][1] == timedelta(days=1):
+            runs[-1][1] = day
+        else:
+            runs.append([day, day])
+    return [tuple(run) for run in runs]
+
+def cleanup_orphans(batch_size=None):
+    """Delete (or, for payments, detach) orphaned rows in batches and repair what they fed;
+    returns {table: (rows, seconds)}
+
+    Covers every branch in the current database: an orphan has no member left to give it a branch.
+    """
+    batch_size = batch_size or app.config['ORPHAN_BATCH_SIZE']
+    report, touched_days = {}, set()
+    with all_branches():
+        for model, foreign_key, parent_id in DETACHED_SOURCES:
+            dangling = and_(foreign_key.isnot(None), ~exists().where(parent_id == foreign_key))
+            started, detached = clock.perf_counter(), 0
+            while True:
+                batch = select(model.id).where(dangling).limit(batch_size).scalar_subquery()
+                count = db.session.execute(
+                    model.__table__.update().where(model.id.in_(batch)).values({foreign_key.key: None})
+                ).rowcount
+                db.session.commit()
+                if not count:
+                    break
+                detached += count
+            report[model.__tablename__] = (detached, clock.perf_counter() - started)
+        for model, returned, parents in ORPHAN_SOURCES:
+            table = model.__table__
+            orphaned = or_(*[~exists().where(parent_id == foreign_key) for foreign_key, parent_id in parents])
+            started, deleted = clock.perf_counter(), 0
+            while True:
+                batch = select(model.id).where(orphaned).limit(batch_size).scalar_subquery()
+                stmt = table.delete().where(model.id.in_(batch))
+                if db.engine.dialect.delete_returning:
+                    rows = db.session.execute(stmt.returning(returned)).scalars().all()
+                else:
+                    rows = db.session.execute(select(returned).where(orphaned).limit(batch_size)).scalars().all()
+                    db.session.execute(stmt)
+                if not rows:
+                    break
+                if model is Checkin:
+                    touched_days.update(day for day in rows if day)
+                if model is ClassBooking:
+                    db.session.execute(
+                        GymClass.__table__.update()
+                        .where(GymClass.id.in_(set(rows)))
+                        .values(booked=select(func.count(ClassBooking.id))
+                                .where(ClassBooking.class_id == GymClass.id).scalar_subquery())
+                    )
+                db.session.commit()
+                deleted += len(rows)
+            report[table.name] = (deleted, clock.perf_counter() - started)
+        # Orphaned check-ins were rolled up under a member type that no longer exists, so recount those days
+        for first, last in day_runs(touched_days):
+            rebuild_rollups(first, last)
+        return report
+
+def orphan_report_lines(report):
+    detached = {model.__tablename__ for model, _, _ in DETACHED_SOURCES}
+    return [f"{table}: {rows} orphaned rows {'detached' if table in detached else 'deleted'} in {seconds:.2f}s"
+            for table, (rows, seconds) in report.items()]
+
+@app.cli.command('cleanup-orphans')
+@click.option('--batch-size', type=int, help='Rows changed per transaction (default ORPHAN_BATCH_SIZE)')
+def cleanup_orphans_command(batch_size):
+    """Delete check-ins, reminders and bookings whose member or class is gone, and detach such payments"""
+    for _ in branch_databases():
+        for line in orphan_report_lines(cleanup_orphans(batch_size)):
+            click.echo(line)
+
+@app.route('/cleanup_checkins', methods=['POST'])
 def cleanup_checkins():
+    """Orphan cleanup for every branch stored in the current branch's database, so admins only"""
     if 'user' not in session:
         return redirect(url_for('login'))
-    all_checkins = Checkin.query.all()
-    orphaned_count = 0
-    for c in all_checkins:
-        if c.member is None:
-            db.session.delete(c); orphaned_count += 1
+    if session.get('role') != 'admin':
+        return "Only admins can clean up orphaned rows.", 403
+    return "Cleaned up " + "; ".join(orphan_report_lines(cleanup_orphans()))
+
+# Archive tier - check-ins and reminders older than ARCHIVE_AFTER_DAYS are
+# written to one gzipped CSV file per branch, table and SA-local month, then deleted
+# from the hot tables so their scans and indexes stop growing. A month's
+# check-in rollups are rebuilt from its rows before they go and never from raw
+# rows again, so dashboard and history totals do not change
+class ArchiveSegment(BranchScoped, db.Model):
+    """One archive file: rows of one table for one branch and SA-local month"""
+    id = db.Column(db.Integer, primary_key=True)
+    table_name = db.Column(db.String(50), nullable=False)
+    month = db.Column(db.Date, nullable=False)  # first day of the SA-local month
+    path = db.Column(db.String(255), nullable=False)  # relative to ARCHIVE_DIR
+    rows = db.Column(db.Integer, nullable=False)
+    # The month's rows with ids up to max_id are in the file, so an interrupted delete can be finished
+    max_id = db.Column(db.Integer, nullable=False)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_archive_segment_branch_table_month', 'branch_id', 'table_name', 'month'),
+    )
+
+# Archived models and the column giving each row's SA-local day
+ARCHIVED_MODELS = {Checkin: Checkin.checkin_date, PaymentReminder: PaymentReminder.sent_date}
+
+def archive_day_filter(model, first=None, last=None):
+    """WHERE clauses for rows of ``model`` on SA-local days first..last"""
+    column = ARCHIVED_MODELS[model]
+    if isinstance(column.type, db.DateTime):
+        first = first and sa_time.day_start(first)
+        return ([column >= first] if first else []) + \
+            ([column < sa_time.day_start(last + timedelta(days=1))] if last else [])
+    return ([column >= first] if first else []) + ([column <= last] if last else [])
+
+def archived_day(model, row):
+    value = row[ARCHIVED_MODELS[model].key]
+    return sa_time.sa_day(value) if isinstance(value, datetime) else value
+
+def archived_through(model):
+    """{branch id: last SA-local day of its latest archived month} of ``model``"""
+    months = db.session.execute(
+        select(ArchiveSegment.branch_id, func.max(ArchiveSegment.month))
+        .where(ArchiveSegment.table_name == model.__tablename__).group_by(ArchiveSegment.branch_id)
+    ).tuples()
+    return {branch_id: sa_time.add_months(month, 1) - timedelta(days=1) for branch_id, month in months}
+
+def _archive_value(column, text):
+    """A CSV field converted back to the column's Python type"""
+    if text == '':
+        return None
+    python_type = column.type.python_type
+    if python_type in (date, datetime):
+        return python_type.fromisoformat(text)
+    return python_type(text)
+
+def read_archive_segment(model, segment):
+    """Rows of an archive file as dicts keyed by column name"""
+    with gzip.open(os.path.join(app.config['ARCHIVE_DIR'], segment.path), 'rt', newline='') as f:
+        reader = csv.reader(f)
+        columns = [model.__table__.c[name] for name in next(reader)]
+        for values in reader:
+            yield {column.key: _archive_value(column, value) for column, value in zip(columns, values)}
+
+def archived_rows(model, first=None, last=None, member_id=None):
+    """Archived rows of ``model`` on SA-local days first..last, oldest month first"""
+    stmt = select(ArchiveSegment).where(ArchiveSegment.table_name == model.__tablename__) \
+        .order_by(ArchiveSegment.month, ArchiveSegment.id)
+    if first:
+        stmt = stmt.where(ArchiveSegment.month >= sa_time.month_start(first))
+    if last:
+        stmt = stmt.where(ArchiveSegment.month <= last)
+    for segment in db.session.scalars(stmt).all():
+        for row in read_archive_segment(model, segment):
+            day = archived_day(model, row)
+            if (member_id and row['member_id'] != member_id) or (first and day < first) or (last and day > last):
+                continue
+            yield row
+
+def history_rows(model, first=None, last=None, member_id=None):
+    """Rows of ``model`` on SA-local days first..last from the archive and the hot table, as dicts
+
+    For the rare report reaching past the archive horizon: archive files are
+    read one at a time and hot rows are streamed, so memory stays flat.
+    """
+    yield from archived_rows(model, first, last, member_id)
+    stmt = select(model.__table__).where(*archive_day_filter(model, first, last)) \
+        .order_by(ARCHIVED_MODELS[model], model.id)
+    if member_id:
+        stmt = stmt.where(model.member_id == member_id)
+    # A table select is not an ORM query, so the branch criteria are added here
+    if branch_filter_id() is not None:
+        stmt = stmt.where(model.branch_id == branch_filter_id())
+    for partition in db.session.execute(stmt.execution_options(yield_per=EXPORT_CHUNK_ROWS)).mappings().partitions():
+        yield from (dict(row) for row in partition)
+
+def archived_checkin_export(start, end, member_id):
+    """Archived check-ins as /export/checkins rows, EXPORT_CHUNK_ROWS at a time"""
+    rows = archived_rows(Checkin, start, end, member_id)
+    while chunk := list(islice(rows, EXPORT_CHUNK_ROWS)):
+        names = dict(db.session.execute(
+            select(Member.id, Member.name).where(Member.id.in_({row['member_id'] for row in chunk}))
+        ).all())
+        yield [(row['id'], row['member_id'], names.get(row['member_id']), row['checkin_date'], row['checkin_time'])
+               for row in chunk]
+
+def delete_archived_rows(model, in_month, max_id, batch_size):
+    """Delete rows already in an archive file, one short transaction per batch"""
+    while True:
+        batch = select(model.id).where(*in_month, model.id <= max_id).limit(batch_size).scalar_subquery()
+        if not db.session.execute(model.__table__.delete().where(model.id.in_(batch))).rowcount:
+            break
+        db.session.commit()
+
+def archive_month(model, month, batch_size, branch_id):
+    """Move the rows of ``model`` for ``branch_id`` in the SA-local month starting ``month`` to a new archive file"""
+    table = model.__table__
+    last = sa_time.add_months(month, 1) - timedelta(days=1)
+    in_month = [model.branch_id == branch_id] + archive_day_filter(model, month, last)
+    segments = db.session.scalars(
+        select(ArchiveSegment).where(ArchiveSegment.branch_id == branch_id, ArchiveSegment.table_name == table.name,
+                                     ArchiveSegment.month == month)
+    ).all()
+    # Finish what an interrupted run left behind, then archive whatever is still hot
+    for segment in segments:
+        delete_archived_rows(model, in_month, segment.max_id, batch_size)
+    if model is Checkin and not segments:
+        rebuild_rollups(month, last)
+
+    name = f"branch-{branch_id}/{table.name}/{month:%Y-%m}{f'-{len(segments) + 1}' if segments else ''}.csv.gz"
+    path = os.path.join(app.config['ARCHIVE_DIR'], name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    result = db.session.execute(select(table).where(*in_month).order_by(ARCHIVED_MODELS[model], model.id)
+                                .execution_options(yield_per=batch_size))
+    rows, max_id = 0, 0
+    with gzip.open(path + '.tmp', 'wt', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(result.keys())
+        for partition in result.partitions():
+            writer.writerows(partition)
+            rows += len(partition)
+            max_id = max(max_id, max(row.id for row in partition))
+    if not rows:
+        os.remove(path + '.tmp')
+        return 0
+    # The file is complete before any row is deleted
+    os.replace(path + '.tmp', path)
+    db.session.add(ArchiveSegment(branch_id=branch_id, table_name=table.name, month=month, path=name,
+                                  rows=rows, max_id=max_id))
     db.session.commit()
-    return f"Cleaned up {orphaned_count} orphaned check-ins"
+    delete_archived_rows(model, in_month, max_id, batch_size)
+    return rows
+
+def archive_old_rows(before=None, dry_run=False, batch_size=None):
+    """Archive every complete SA-local month before ``before`` (default ARCHIVE_AFTER_DAYS ago)
+
+    Covers the current branch, or every branch when none is set. Returns
+    [(branch, table, month, rows, seconds)]; with ``dry_run`` rows are only counted.
+    """
+    batch_size = batch_size or app.config['ARCHIVE_BATCH_SIZE']
+    before = before or sa_time.sa_today() - timedelta(days=app.config['ARCHIVE_AFTER_DAYS'])
+    horizon = sa_time.month_start(before)
+    branch_ids = [current_branch_id()] if current_branch_id() is not None else \
+        db.session.scalars(select(Branch.id).order_by(Branch.id)).all()
+    report = []
+    for branch_id in branch_ids:
+        with branch_scope(branch_id, filtered=False):
+            for model, column in ARCHIVED_MODELS.items():
+                oldest = db.session.execute(select(func.min(column)).where(model.branch_id == branch_id)).scalar()
+                if oldest is None:
+                    continue
+                oldest = sa_time.sa_day(oldest) if isinstance(oldest, datetime) else oldest
+                for month in period_starts(oldest, horizon - timedelta(days=1), 'month'):
+                    started = clock.perf_counter()
+                    if dry_run:
+                        last = sa_time.add_months(month, 1) - timedelta(days=1)
+                        rows = db.session.execute(
+                            select(func.count()).select_from(model)
+                            .where(model.branch_id == branch_id, *archive_day_filter(model, month, last))
+                        ).scalar()
+                    else:
+                        rows = archive_month(model, month, batch_size, branch_id)
+                    if rows:
+                        report.append((branch_id, model.__tablename__, month, rows, clock.perf_counter() - started))
+    return report
+
+@app.cli.command('archive')
+@click.option('--before', type=click.DateTime(formats=['%Y-%m-%d']),
+              help='Archive complete months before this day (default ARCHIVE_AFTER_DAYS ago)')
+@click.option('--dry-run', is_flag=True, help='Only count the rows that would be archived')
+def archive_command(before, dry_run):
+    """Move old check-ins and payment reminders to monthly archive files"""
+    report = []
+    for _ in branch_databases():
+        report += archive_old_rows(before.date() if before else None, dry_run)
+    for branch_id, table, month, rows, seconds in report:
+        click.echo(f"branch {branch_id} {table} {month:%Y-%m}: {rows} rows " +
+                   ("to archive" if dry_run else f"archived in {seconds:.2f}s"))
+    if not report:
+        click.echo("Nothing to archive")
 
 @app.route('/whoami')
 def whoami():
     return f"Logged in as: {session.get('user')}"
 
+# Columns added since the first release: (table, column, DDL type)
+ADDED_COLUMNS = [
+    ('checkin', 'checkin_date', 'DATE'),
+    ('gym_class', 'starts_at', 'TIMESTAMP'),
+    ('gym_class', 'booked', 'INTEGER NOT NULL DEFAULT 0'),
+    ('gym_class', 'series_id', 'INTEGER REFERENCES class_series (id)'),
+    ('gym_class', 'cancelled', 'BOOLEAN NOT NULL DEFAULT FALSE'),
+    ('user', 'branch_id', 'INTEGER'),
+    # Everything recorded before branches existed belongs to the first one. No REFERENCES:
+    # SQLite cannot add a foreign key column with a non-NULL default
+    *[(table, 'branch_id', 'INTEGER NOT NULL DEFAULT 1')
+      for table in ('member', 'trainer', 'gym_class', 'class_series', 'checkin', 'payment',
+                    'payment_reminder', 'live_event', 'archive_segment', 'reminder_job')],
+]
+
+# Rollups keyed by branch since branches were added; older ones are rebuilt around the new key
+BRANCH_KEYED_TABLES = [DailyCheckinRollup, DailyRevenueRollup, DailyClassRollup]
+
+def detach_payments_from_members(conn):
+    """Let payments outlive their member: member_id nullable with ON DELETE SET NULL"""
+    quote = conn.dialect.identifier_preparer.quote
+    inspector = inspect(conn)
+    nullable = next(c['nullable'] for c in inspector.get_columns('payment') if c['name'] == 'member_id')
+    member_keys = [fk for fk in inspector.get_foreign_keys('payment') if fk['referred_table'] == 'member']
+    if nullable and all((fk['options'].get('ondelete') or '').upper() == 'SET NULL' for fk in member_keys):
+        return
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text("ALTER TABLE payment ALTER COLUMN member_id DROP NOT NULL"))
+        for fk in member_keys:
+            conn.execute(text(f"ALTER TABLE payment DROP CONSTRAINT {quote(fk['name'])}"))
+        conn.execute(text("ALTER TABLE payment ADD FOREIGN KEY (member_id) REFERENCES member (id) ON DELETE SET NULL"))
+        return
+    # SQLite cannot alter a column or foreign key in place, so the table is rebuilt
+    for index in inspector.get_indexes('payment'):
+        conn.execute(text(f"DROP INDEX {quote(index['name'])}"))
+    conn.execute(text("ALTER TABLE payment RENAME TO payment_attached"))
+    Payment.__table__.create(conn)
+    columns = ', '.join(quote(c.name) for c in Payment.__table__.c)
+    conn.execute(text(f"INSERT INTO payment ({columns}) SELECT {columns} FROM payment_attached"))
+    conn.execute(text("DROP TABLE payment_attached"))
+
+def upgrade_schema(engine=None):
+    """Bring an existing database up to the current schema (safe to re-run)"""
+    main = engine is None
+    engine = engine or db.engine
+    with engine.begin() as conn:
+        quote = conn.dialect.identifier_preparer.quote
+        # The branch directory lives in the main database; a branch database only holds its own row
+        if main and conn.execute(select(Branch.id).where(Branch.id == DEFAULT_BRANCH_ID)).first() is None:
+            conn.execute(Branch.__table__.insert().values(id=DEFAULT_BRANCH_ID, name='Main'))
+        for table, column, ddl in ADDED_COLUMNS:
+            if column not in {c['name'] for c in inspect(conn).get_columns(table)}:
+                conn.execute(text(f"ALTER TABLE {quote(table)} ADD COLUMN {column} {ddl}"))
+        for model in BRANCH_KEYED_TABLES:
+            table = model.__table__
+            if 'branch_id' in {c['name'] for c in inspect(conn).get_columns(table.name)}:
+                continue
+            old = f"{table.name}_unbranched"
+            conn.execute(text(f"ALTER TABLE {quote(table.name)} RENAME TO {quote(old)}"))
+            if conn.dialect.name == 'postgresql':
+                conn.execute(text(f"ALTER INDEX {quote(table.name + '_pkey')} RENAME TO {quote(old + '_pkey')}"))
+            table.create(conn)
+            columns = ', '.join(quote(c.name) for c in table.c if c.name != 'branch_id')
+            conn.execute(text(f"INSERT INTO {quote(table.name)} (branch_id, {columns}) "
+                              f"SELECT {DEFAULT_BRANCH_ID}, {columns} FROM {quote(old)}"))
+            conn.execute(text(f"DROP TABLE {quote(old)}"))
+        detach_payments_from_members(conn)
+        # Free-text class times are parsed once here rather than on every dashboard load
+        unscheduled = conn.execute(
+            select(GymClass.id, GymClass.date, GymClass.time).where(GymClass.starts_at.is_(None))
+        ).all()
+        if unscheduled:
+            conn.execute(
+                GymClass.__table__.update().where(GymClass.id == bindparam('class_id'))
+                .values(starts_at=bindparam('start')),
+                [{'class_id': class_id, 'start': class_starts_at(day, time_text)}
+                 for class_id, day, time_text in unscheduled]
+            )
+        backfilled = conn.execute(
+            Checkin.__table__.update()
+            .where(Checkin.checkin_date.is_(None))
+            .values(checkin_date=sa_date_expr(Checkin.checkin_time))
+        ).rowcount
+        # Older databases allowed duplicate check-ins; keep the first one per day
+        first_ids = select(func.min(Checkin.id)).group_by(Checkin.member_id, Checkin.checkin_date)
+        duplicates = conn.execute(
+            Checkin.__table__.delete()
+            .where(Checkin.member_id.isnot(None), Checkin.id.not_in(first_ids))
+        ).rowcount
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+        app.config['SEARCH_BACKEND'] = setup_member_search(conn)
+    if duplicates:
+        rebuild_rollups()
+    return backfilled, duplicates, len(unscheduled)
+
+@app.cli.command('upgrade-db')
+def upgrade_db_command():
+    """Add new columns and indexes to an existing database"""
+    backfilled, duplicates, scheduled = upgrade_schema()
+    click.echo(f"Schema upgraded: {backfilled} check-in dates backfilled, "
+               f"{duplicates} duplicate check-ins removed, {scheduled} class start times set")
+
 with app.app_context():
     db.create_all()
+    upgrade_schema()
+    # Backfill the rollups the first time they are created on an existing database
+    if (not DailyCheckinRollup.query.first() and not DailyRevenueRollup.query.first()
+            and (Checkin.query.first() or Payment.query.first())):
+        rebuild_rollups()
     if not User.query.filter_by(username="admin").first():
         admin = User(username="admin", password="Mabutsi@12", role="admin")
         db.session.add(admin)
         db.session.commit()
         print("Default admin created! Username: admin | Password: Mabutsi@12")
 
+if app.config['REMINDER_SCHEDULER']:
+    start_reminder_scheduler()
+
 port = int(os.environ.get("PORT", 5000))
 if __name__ == '__main__':
     app.run(host="0.0.0.0", port=port, debug=False)
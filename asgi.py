@@ -0,0 +1,238 @@
+"""Optional async serving mode for the JSON endpoints polled by static/script.js.
+
+The member search, reminder lists and /send_reminder run as async handlers
+on async SQLAlchemy, so a request waiting on the database or the SMS
+gateway no longer holds a whole worker. /events streams live counters from
+the event loop, so open dashboards do not each hold a thread. Every other
+path is passed to the Flask app unchanged. Models, queries, login sessions, branch scoping and
+the SMS gateway are all shared with app.py.
+
+    pip install -r requirements-async.txt
+    gunicorn asgi:app -k uvicorn.workers.UvicornWorker    (or: uvicorn asgi:app)
+"""
+import asyncio
+import queue
+from contextlib import asynccontextmanager
+
+from a2wsgi import WSGIMiddleware
+from itsdangerous import BadSignature
+from sqlalchemy import event, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+
+import app as flask_module
+import sa_time
+from app import (DEFAULT_BRANCH_ID, FTS_MATCH, FTS_RANKED, LiveEventBroker, Member, PaymentReminder, _fts_fuzzy,
+                 _fts_phrase, _fuzzy_matches, _similarity, branch_filter_id, branch_scope, live_event_backlog_query,
+                 live_event_broker, live_event_message, live_stream_head, make_dispatcher,
+                 member_search_dict, member_search_query, members_needing_reminders_query,
+                 members_with_phones_query, reminder_item, reminder_outcome,
+                 reminder_sent_today_query, reminder_type_for)
+
+flask_app = flask_module.app
+# Async drivers for the same database the Flask app uses
+ASYNC_DRIVERS = {'sqlite': 'sqlite+aiosqlite', 'postgresql': 'postgresql+asyncpg'}
+
+def async_database_url(url):
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername))
+
+def make_engine(url):
+    """Async engine with the same pool sizes and SQLite busy timeout as the sync engine"""
+    engine = create_async_engine(async_database_url(url), **flask_app.config['SQLALCHEMY_ENGINE_OPTIONS'])
+
+    @event.listens_for(engine.sync_engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        if engine.dialect.name == 'sqlite':
+            flask_module.apply_sqlite_pragmas(dbapi_connection)
+
+    return engine
+
+def same_database(sync_engine, async_engine):
+    """Fail fast if the async engine would open a different database from the sync one"""
+    if (sync_engine.url.get_backend_name(), sync_engine.url.database) != \
+            (async_engine.url.get_backend_name(), async_engine.url.database):
+        raise RuntimeError(f"async engine {async_engine.url!r} does not match {sync_engine.url!r}")
+    return async_engine
+
+# Built from the sync engine's URL: Flask-SQLAlchemy resolves a relative SQLite path
+# (the default sqlite:///fitness.db) into the instance folder, not the working directory
+with flask_app.app_context():
+    engine = same_database(flask_module.db.engine, make_engine(flask_module.db.engine.url))
+Session = async_sessionmaker(engine, expire_on_commit=False)
+# With BRANCH_DATABASE_URL, every branch but the first has its own database and session factory
+branch_engines, branch_sessions = {}, {}
+
+def session_for(branch_id):
+    if not flask_app.config['BRANCH_DATABASE_URL'] or branch_id == DEFAULT_BRANCH_ID:
+        return Session()
+    if branch_id not in branch_sessions:
+        # The sync engine creates the branch's schema on first use
+        with flask_app.app_context():
+            sync_engine = flask_module.branch_engine(branch_id)
+        branch_engines[branch_id] = same_database(sync_engine, make_engine(sync_engine.url))
+        branch_sessions[branch_id] = async_sessionmaker(branch_engines[branch_id], expire_on_commit=False)
+    return branch_sessions[branch_id]()
+
+def logged_in(request):
+    """The Flask session of a logged-in user carried by the request's cookie, else None"""
+    cookie = request.cookies.get(flask_app.config['SESSION_COOKIE_NAME'])
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    if not cookie or serializer is None:
+        return None
+    try:
+        data = serializer.loads(cookie, max_age=int(flask_app.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return None
+    return data if 'user' in data else None
+
+async def search_members(session, query, limit=10):
+    """Async twin of app.search_members"""
+    if len(query) >= 3 and flask_app.config['SEARCH_BACKEND'] == 'fts5':
+        branch_id = branch_filter_id()
+        ids = (await session.execute(FTS_MATCH, {'q': _fts_phrase(query), 'branch': branch_id,
+                                                 'limit': limit})).scalars().all()
+        members = {m.id: m for m in (await session.scalars(select(Member).where(Member.id.in_(ids))))} if ids else {}
+        results = sorted((members[i] for i in ids if i in members), key=lambda m: -_similarity(query, m))
+        if len(results) < limit:
+            candidate_ids = [member_id for member_id in (await session.execute(
+                FTS_RANKED, {'q': _fts_fuzzy(query), 'branch': branch_id, 'limit': limit * 5})).scalars()
+                if member_id not in members]
+            if candidate_ids:
+                candidates = await session.scalars(select(Member).where(Member.id.in_(candidate_ids)))
+                results += _fuzzy_matches(query, candidates, limit - len(results))
+        return results
+    return (await session.scalars(member_search_query(query, limit))).all()
+
+async def api_search_members(request):
+    user = logged_in(request)
+    if not user:
+        return JSONResponse([])
+    query = request.query_params.get('q', '').strip().lower()
+    if not query:
+        return JSONResponse([])
+    branch_id = user.get('branch_id', DEFAULT_BRANCH_ID)
+    with branch_scope(branch_id):
+        async with session_for(branch_id) as session:
+            members = await search_members(session, query)
+    return JSONResponse([member_search_dict(member) for member in members])
+
+async def api_members_needing_reminders(request):
+    user = logged_in(request)
+    if not user:
+        return JSONResponse([])
+    today_sa = sa_time.sa_today()
+    branch_id = user.get('branch_id', DEFAULT_BRANCH_ID)
+    with branch_scope(branch_id):
+        async with session_for(branch_id) as session:
+            members = (await session.scalars(members_needing_reminders_query(today_sa))).all()
+    return JSONResponse([dict(member_search_dict(member), days_until_expiry=(member.expiry_date - today_sa).days)
+                         for member in members])
+
+async def api_members_with_phones(request):
+    user = logged_in(request)
+    if not user:
+        return JSONResponse([])
+    branch_id = user.get('branch_id', DEFAULT_BRANCH_ID)
+    with branch_scope(branch_id):
+        async with session_for(branch_id) as session:
+            members = (await session.scalars(members_with_phones_query())).all()
+    return JSONResponse([{'id': member.id, 'name': member.name, 'phone': member.phone} for member in members])
+
+async def send_reminder(request):
+    user = logged_in(request)
+    if not user:
+        return JSONResponse({'success': False, 'message': 'Not logged in'})
+    branch_id = user.get('branch_id', DEFAULT_BRANCH_ID)
+    with branch_scope(branch_id):
+        async with session_for(branch_id) as session:
+            member = await session.get(Member, request.path_params['member_id'])
+            if member is None:
+                return JSONResponse({'error': 'not found'}, status_code=404)
+            if not member.phone:
+                return JSONResponse({'success': False, 'message': 'Member has no phone number'})
+
+            today_sa = sa_time.sa_today()
+            days_until_expiry = (member.expiry_date - today_sa).days
+            reminder_type = reminder_type_for(days_until_expiry)
+            if (await session.execute(reminder_sent_today_query(member.id, reminder_type, today_sa))).scalar():
+                return JSONResponse({'success': False,
+                                     'message': f'{member.name} was already sent this reminder today'})
+
+            # Gateways are blocking clients; the event loop keeps serving while one waits
+            item = reminder_item(member, reminder_type, today_sa)
+            row, = await asyncio.to_thread(lambda: make_dispatcher().dispatch([item]))
+            session.add(PaymentReminder(**row))
+            await session.commit()
+    success, message = reminder_outcome(member, row)
+    return JSONResponse({'success': success, 'message': message,
+                         'member_name': member.name, 'days_until_expiry': days_until_expiry})
+
+class AsyncSubscriber:
+    """Live event subscriber for the broker thread that hands messages to the event loop"""
+
+    def __init__(self, loop, maxsize=LiveEventBroker.queue_size):
+        self.loop = loop
+        self.maxsize = maxsize
+        self.queue = asyncio.Queue()
+
+    def put_nowait(self, message):
+        # Called on the broker thread
+        if self.queue.qsize() >= self.maxsize:
+            raise queue.Full
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, message)
+
+async def live_event_stream(request):
+    """Async twin of app.live_event_stream: waiting streams hold no thread"""
+    user = logged_in(request)
+    if not user:
+        return Response(status_code=401)
+    branch_id = user.get('branch_id', DEFAULT_BRANCH_ID)
+    last_seen = request.headers.get('Last-Event-ID')
+    last_seen = int(last_seen) if last_seen and last_seen.isdigit() else None
+    with branch_scope(branch_id):
+        broker = live_event_broker()
+        # The first subscriber starts the broker thread, which reads the log once
+        subscriber, live_from = await asyncio.to_thread(
+            broker.subscribe, branch_id, AsyncSubscriber(asyncio.get_running_loop()))
+        backlog = []
+        if last_seen is not None:
+            async with session_for(branch_id) as session:
+                rows = (await session.scalars(live_event_backlog_query(last_seen, live_from))).all()
+            sa_today = sa_time.sa_today()
+            backlog = [live_event_message(row, sa_today) for row in rows]
+    heartbeat = flask_app.config['LIVE_HEARTBEAT']
+    closes_at = asyncio.get_running_loop().time() + flask_app.config['LIVE_STREAM_LIFETIME']
+
+    async def stream():
+        try:
+            for message in live_stream_head(backlog, live_from, last_seen):
+                yield message
+            while broker.subscribed(subscriber) and (remaining := closes_at - asyncio.get_running_loop().time()) > 0:
+                try:
+                    yield await asyncio.wait_for(subscriber.queue.get(), min(heartbeat, remaining))
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+        finally:
+            broker.unsubscribe(subscriber)
+
+    return StreamingResponse(stream(), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    for each in [engine, *branch_engines.values()]:
+        await each.dispose()
+
+app = Starlette(routes=[
+    Route('/api/search_members', api_search_members),
+    Route('/api/members_needing_reminders', api_members_needing_reminders),
+    Route('/api/members_with_phones', api_members_with_phones),
+    Route('/send_reminder/{member_id:int}', send_reminder),
+    Route('/events', live_event_stream),
+    Mount('/', app=WSGIMiddleware(flask_app)),
+], lifespan=lifespan)
@@ -0,0 +1,70 @@
+"""Archive tier: hot-table queries before and after moving old rows to monthly files.
+
+Seeds --years of history, times the check-in history page, the uncached
+dashboard and the orphan cleanup scan, archives everything older than
+ARCHIVE_AFTER_DAYS, then times them again. Also reports the archive run
+itself and a full history read spanning the archive and the hot table.
+
+Usage: python benchmarks/bench_archive.py [--members 20000] [--years 3]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from common import load_app, measure
+from datagen import generate
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--members', type=int, default=20000)
+    parser.add_argument('--checkins-per-member', type=int, default=60)
+    parser.add_argument('--years', type=int, default=3)
+    args = parser.parse_args()
+
+    m = load_app()
+    m.app.config['ARCHIVE_DIR'] = tempfile.mkdtemp(prefix='fitness-archive-')
+    with m.app.app_context():
+        generate(m, args.members, checkins_per_member=args.checkins_per_member, days=args.years * 365,
+                 log=lambda line: None)
+        client = m.app.test_client()
+        client.post('/login', data={'username': 'admin', 'password': 'Mabutsi@12'})
+
+        def dashboard():
+            m.metric_cache.invalidate_tables({'checkin', 'payment', 'gym_class', 'member', 'trainer'})
+            client.get('/dashboard')
+
+        timings = {
+            '/checkins': lambda: client.get('/checkins'),
+            '/dashboard (uncached)': dashboard,
+            'orphan cleanup scan': lambda: m.cleanup_orphans(),
+        }
+
+        def run_all():
+            return {name: measure(fn) for name, fn in timings.items()}
+
+        hot_before = m.Checkin.query.count()
+        before = run_all()
+        start = time.perf_counter()
+        report = m.archive_old_rows()
+        archive_seconds = time.perf_counter() - start
+        hot_after = m.Checkin.query.count()
+        after = run_all()
+
+        start = time.perf_counter()
+        history = sum(1 for _ in m.history_rows(m.Checkin))
+        history_seconds = time.perf_counter() - start
+        archive_bytes = sum(os.path.getsize(os.path.join(root, name))
+                            for root, _, names in os.walk(m.app.config['ARCHIVE_DIR']) for name in names)
+
+    archived = sum(rows for _, _, _, rows, _ in report)
+    print(f"{hot_before} check-ins over {args.years} years; archived {archived} rows (check-ins and reminders) "
+          f"into {len(report)} files, {archive_bytes / 2**20:.1f} MiB, in {archive_seconds:.1f}s; "
+          f"{hot_after} check-ins left hot")
+    print(f"{'':>22} {'before':>10} {'after':>10}")
+    for name in timings:
+        print(f"{name:>22} {before[name]:>8.1f}ms {after[name]:>8.1f}ms")
+    print(f"history_rows over both tiers: {history} check-ins in {history_seconds:.2f}s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""Concurrent throughput of the polled JSON endpoints: sync gunicorn workers vs asgi.py.
+
+Seeds a throwaway database, then starts each server in turn with the same
+number of worker processes and an SMS gateway that takes --sms-latency ms
+per call (like a real provider's HTTP API). --clients logged-in users each
+fire --requests requests: member searches, the reminder lists, and every
+--reminder-every'th request a /send_reminder to a member not yet texted.
+
+Needs requirements-async.txt installed.
+
+Usage: python benchmarks/bench_async.py [--workers 2] [--clients 32] [--sms-latency 300]
+"""
+import argparse
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+from common import ROOT, load_app
+from datagen import generate
+from loadtest import HttpUser, SEARCHES, summarize
+
+class SlowSmsGateway:
+    """Accepts every message after SMS_BENCH_LATENCY_MS, like a remote provider"""
+    max_batch = 50
+    sent_status = 'simulated'
+
+    def send_batch(self, messages):
+        time.sleep(int(os.environ.get('SMS_BENCH_LATENCY_MS', 300)) / 1000)
+        return [True] * len(messages)
+
+SERVERS = {
+    'sync': lambda port, workers: ['gunicorn', 'app:app', '--workers', str(workers),
+                                   '--bind', f'127.0.0.1:{port}', '--log-level', 'warning'],
+    'async': lambda port, workers: [sys.executable, '-m', 'uvicorn', 'asgi:app', '--workers', str(workers),
+                                    '--port', str(port), '--log-level', 'warning'],
+}
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def wait_for(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'server on port {port} did not start')
+
+def run_load(base_url, clients, requests, reminder_ids, reminder_every, seed):
+    reminders = iter(reminder_ids)
+    timings = {'search': [], 'lists': [], 'send_reminder': []}
+    errors = []
+
+    def client(index):
+        user = HttpUser(base_url, 'admin', 'Mabutsi@12')
+        rng = random.Random(seed + index)
+        for n in range(requests):
+            if n % reminder_every == reminder_every - 1:
+                kind, path = 'send_reminder', f'/send_reminder/{next(reminders)}'
+            elif n % 2:
+                kind, path = 'lists', rng.choice(['/api/members_needing_reminders', '/api/members_with_phones'])
+            else:
+                kind, path = 'search', f'/api/search_members?q={urllib.parse.quote(rng.choice(SEARCHES))}'
+            start = time.perf_counter()
+            status = user.get(path)
+            timings[kind].append((time.perf_counter() - start) * 1000)
+            if status >= 500:
+                errors.append(path)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        list(pool.map(client, range(clients)))
+    wall = time.perf_counter() - start
+    return wall, timings, len(errors)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--members', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=2, help='server processes in both modes')
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=40, help='requests per client')
+    parser.add_argument('--reminder-every', type=int, default=8)
+    parser.add_argument('--sms-latency', type=int, default=300, help='ms per SMS gateway call')
+    parser.add_argument('--modes', nargs='+', choices=SERVERS, default=list(SERVERS))
+    args = parser.parse_args()
+
+    m = load_app()
+    with m.app.app_context():
+        generate(m, args.members, checkins_per_member=2, log=lambda line: None)
+        phones = [row[0] for row in m.db.session.query(m.Member.id)
+                  .filter(m.Member.phone.isnot(None)).order_by(m.Member.id)]
+    # Every reminder goes to a different member, so none is skipped as already sent today
+    sends_per_mode = args.clients * (args.requests // args.reminder_every)
+    if len(phones) < sends_per_mode * len(args.modes):
+        parser.error('not enough members with phones; raise --members')
+
+    env = dict(os.environ, DATABASE_URL=m.app.config['SQLALCHEMY_DATABASE_URI'],
+               SMS_GATEWAY='bench_async:SlowSmsGateway', SMS_BENCH_LATENCY_MS=str(args.sms_latency),
+               SMS_RATE_PER_SECOND='100000', SMS_MAX_RETRIES='0',
+               PYTHONPATH=os.pathsep.join([ROOT, os.path.join(ROOT, 'benchmarks')]))
+    print(f"{args.members} members, {args.workers} workers per server, {args.clients} clients x "
+          f"{args.requests} requests, SMS gateway {args.sms_latency} ms")
+    print(f"{'mode':>6} {'req/s':>8} {'search p95':>11} {'lists p95':>10} {'reminder p95':>13} {'errors':>7}")
+    for index, mode in enumerate(args.modes):
+        port = free_port()
+        server = subprocess.Popen(SERVERS[mode](port, args.workers), cwd=ROOT, env=env)
+        try:
+            wait_for(port)
+            reminder_ids = phones[index * sends_per_mode:(index + 1) * sends_per_mode]
+            wall, timings, errors = run_load(f'http://127.0.0.1:{port}', args.clients, args.requests,
+                                             reminder_ids, args.reminder_every, seed=42)
+        finally:
+            server.terminate()
+            server.wait()
+        p95 = {kind: summarize(samples)['p95_ms'] or 0.0 for kind, samples in timings.items()}
+        total = sum(len(samples) for samples in timings.values())
+        print(f"{mode:>6} {total / wall:>8.1f} {p95['search']:>9.1f}ms {p95['lists']:>8.1f}ms "
+              f"{p95['send_reminder']:>11.1f}ms {errors:>7}")
+
+if __name__ == '__main__':
+    main()
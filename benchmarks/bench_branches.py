@@ -0,0 +1,75 @@
+"""Branch isolation: a small branch's pages next to a big branch, in one database and in its own.
+
+Seeds a --small branch and times its uncached dashboard, members page and
+check-in list on their own. A --big branch is then added twice: once in its
+own database (BRANCH_DATABASE_URL) and once sharing the main database. The
+small branch is timed again after each, and the big branch for comparison.
+With branch-led indexes the small branch's timings should not move.
+
+Usage: python benchmarks/bench_branches.py [--small 2000] [--big 50000]
+"""
+import argparse
+import os
+import tempfile
+
+from common import load_app, measure
+from datagen import generate
+
+PAGES = ['/dashboard', '/members', '/checkins']
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--small', type=int, default=2000, help='members in the small branch')
+    parser.add_argument('--big', type=int, default=50000, help='members in each big branch')
+    parser.add_argument('--checkins-per-member', type=int, default=20)
+    args = parser.parse_args()
+
+    m = load_app()
+    client = m.app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': 'Mabutsi@12'})
+
+    def add_branch(name, members, seed):
+        with m.app.app_context():
+            branch = m.Branch(name=name)
+            m.db.session.add(branch)
+            m.db.session.commit()
+            branch_id = branch.id
+            with m.branch_scope(branch_id):
+                generate(m, members, args.checkins_per_member, seed=seed, log=lambda line: None)
+        return branch_id
+
+    def timings(branch_id):
+        client.get(f'/switch_branch/{branch_id}')
+
+        def page(path):
+            # Every request recomputes its metrics, as after a write
+            m.metric_cache.clear()
+            client.get(path)
+
+        for path in PAGES:
+            page(path)  # warm the branch's membership index and the templates
+        return [measure(lambda: page(path), repeat=9) for path in PAGES]
+
+    with m.app.app_context():
+        generate(m, args.small, args.checkins_per_member, log=lambda line: None)
+    rows = [('small branch alone', timings(m.DEFAULT_BRANCH_ID))]
+
+    m.app.config['BRANCH_DATABASE_URL'] = f"sqlite:///{tempfile.mkdtemp(prefix='fitness-bench-')}{os.sep}branch-{{branch}}.db"
+    big = add_branch('Big (own database)', args.big, seed=7)
+    rows.append(('small, big in own db', timings(m.DEFAULT_BRANCH_ID)))
+    rows.append(('big branch, own db', timings(big)))
+
+    # Without BRANCH_DATABASE_URL every branch's rows share the main database's tables
+    m.app.config['BRANCH_DATABASE_URL'] = ''
+    shared = add_branch('Big (shared)', args.big, seed=11)
+    rows.append(('small, big shared', timings(m.DEFAULT_BRANCH_ID)))
+    rows.append(('big branch, shared', timings(shared)))
+
+    print(f"small branch {args.small} members, big branches {args.big} members, "
+          f"{args.checkins_per_member} check-ins per member; uncached, median of 9")
+    print(f"{'':>22}" + ''.join(f"{path:>12}" for path in PAGES))
+    for name, values in rows:
+        print(f"{name:>22}" + ''.join(f"{value:>10.1f}ms" for value in values))
+
+if __name__ == '__main__':
+    main()
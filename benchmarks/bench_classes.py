@@ -0,0 +1,104 @@
+"""Class schedule queries over years of recurring classes, plus a booking race.
+
+Seeds --years of a weekly timetable, then times "classes today" and
+"upcoming classes" the old way (load every class and strptime its time) and
+via the indexed starts_at range. Finally --bookers threads race to book one
+class with --capacity spots; exactly that many must succeed.
+
+Usage: python benchmarks/bench_classes.py [--years 5] [--per-day 30] [--bookers 50]
+"""
+import argparse
+import random
+import threading
+from datetime import datetime, timedelta
+
+from common import load_app, measure
+from datagen import CLASS_NAMES, CLASS_TIMES
+
+def legacy_counts(m, sa_now):
+    """The pre-starts_at dashboard computation, kept for comparison"""
+    sa_today = sa_now.date()
+    today = upcoming = 0
+    for class_obj in m.GymClass.query.all():
+        today += class_obj.date == sa_today
+        if class_obj.time:
+            class_time = datetime.strptime(class_obj.time, '%H:%M').time()
+            upcoming += datetime.combine(class_obj.date, class_time) > sa_now
+        else:
+            upcoming += class_obj.date > sa_today
+    m.db.session.expunge_all()
+    return today, upcoming
+
+def indexed_counts(m, sa_now):
+    queries = m.dashboard_metric_queries(sa_now)
+    return tuple(m.db.session.execute(queries[name]).scalar() for name in ('classes_today', 'upcoming_classes'))
+
+def seed(m, years, per_day):
+    rng = random.Random(42)
+    sa_today = m.sa_time.sa_today()
+    first = sa_today - timedelta(days=365 * years - 90)
+    rows = []
+    for offset in range(365 * years):
+        day = first + timedelta(days=offset)
+        for slot in range(per_day):
+            class_time = CLASS_TIMES[slot % len(CLASS_TIMES)]
+            rows.append({'name': CLASS_NAMES[slot % len(CLASS_NAMES)], 'trainer': f'Trainer {slot % 9}',
+                         'date': day, 'time': class_time, 'capacity': rng.choice([12, 20, 25]),
+                         'starts_at': m.class_starts_at(day, class_time), 'booked': 0})
+    for offset in range(0, len(rows), 20000):
+        m.db.session.execute(m.GymClass.__table__.insert(), rows[offset:offset + 20000])
+    m.db.session.commit()
+    return len(rows)
+
+def booking_race(m, bookers, capacity):
+    sa_today = m.sa_time.sa_today()
+    with m.app.app_context():
+        race = m.GymClass(name='Race', trainer='T', date=sa_today + timedelta(days=1), time='18:00', capacity=capacity)
+        m.db.session.add(race)
+        m.db.session.execute(m.Member.__table__.insert(), [
+            {'name': f'Booker {i}', 'membership_type': 'Monthly', 'expiry_date': sa_today + timedelta(days=30)}
+            for i in range(bookers)])
+        m.db.session.commit()
+        class_id = race.id
+        member_ids = [row[0] for row in m.db.session.query(m.Member.id).filter(m.Member.name.like('Booker %'))]
+    statuses = []
+    barrier = threading.Barrier(bookers)
+
+    def book(member_id):
+        with m.app.app_context():
+            barrier.wait()
+            statuses.append(m.book_class(class_id, member_id))
+
+    threads = [threading.Thread(target=book, args=(member_id,)) for member_id in member_ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    with m.app.app_context():
+        booked = m.db.session.get(m.GymClass, class_id).booked
+        rows = m.ClassBooking.query.filter_by(class_id=class_id).count()
+    return statuses.count('booked'), statuses.count('full'), booked, rows
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--years', type=int, default=5)
+    parser.add_argument('--per-day', type=int, default=30)
+    parser.add_argument('--bookers', type=int, default=50)
+    parser.add_argument('--capacity', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    m = load_app()
+    with m.app.app_context():
+        total = seed(m, args.years, args.per_day)
+        sa_now = m.sa_time.sa_now()
+        assert legacy_counts(m, sa_now) == indexed_counts(m, sa_now)
+        print(f"{total} classes over {args.years} years")
+        print(f"  strptime every class: {measure(lambda: legacy_counts(m, sa_now), args.repeat):8.2f} ms")
+        print(f"  starts_at range:      {measure(lambda: indexed_counts(m, sa_now), args.repeat):8.2f} ms")
+    booked, full, counter, rows = booking_race(m, args.bookers, args.capacity)
+    print(f"{args.bookers} members racing for {args.capacity} spots: {booked} booked, {full} turned away "
+          f"(class counter {counter}, booking rows {rows})")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""Orphaned check-in cleanup: the old per-row loop vs batched anti-join deletes.
+
+Seeds --checkins check-ins, --orphans of them belonging to members that no
+longer exist (written with foreign keys off, as older databases allowed),
+then removes the orphans both ways. While each runs, a writer thread keeps
+committing small updates and records its worst wait, i.e. how long the
+cleanup held the write lock.
+
+Usage: python benchmarks/bench_cleanup.py [--checkins 200000] [--orphans 50000] [--batch-size 5000]
+"""
+import argparse
+import sqlite3
+import threading
+import time
+from datetime import timedelta
+
+from common import load_app
+from datagen import generate
+
+def legacy_cleanup(m):
+    """The pre-cascade /cleanup_checkins loop, kept for comparison"""
+    orphaned_count = 0
+    for c in m.Checkin.query.all():
+        if c.member is None:
+            m.db.session.delete(c)
+            orphaned_count += 1
+    m.db.session.commit()
+    return orphaned_count
+
+def seed_orphans(m, count):
+    path = m.db.engine.url.database
+    sa_today = m.sa_time.sa_today()
+    missing = (m.db.session.query(m.db.func.max(m.Member.id)).scalar() or 0) + 1000
+    with sqlite3.connect(path) as conn:
+        conn.execute('PRAGMA foreign_keys=OFF')
+        conn.executemany(
+            'INSERT INTO checkin (member_id, checkin_time, checkin_date) VALUES (?, ?, ?)',
+            [(missing + i, m.sa_time.day_start(sa_today - timedelta(days=i % 365)) + timedelta(hours=8),
+              (sa_today - timedelta(days=i % 365)).isoformat()) for i in range(count)])
+    m.rebuild_rollups()
+
+def worst_write_wait(m, run):
+    """Run ``run`` while another thread commits small writes.
+
+    Returns (result, seconds, worst wait in ms, writes that gave up with 'database is locked').
+    """
+    done = threading.Event()
+    waits, failures = [], []
+
+    def writer():
+        with m.app.app_context():
+            while not done.is_set():
+                start = time.perf_counter()
+                try:
+                    m.db.session.execute(m.Trainer.__table__.update().where(m.Trainer.id == 1)
+                                         .values(contact=m.Trainer.contact))
+                    m.db.session.commit()
+                except m.OperationalError:
+                    m.db.session.rollback()
+                    failures.append(1)
+                waits.append((time.perf_counter() - start) * 1000)
+                time.sleep(0.01)
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    start = time.perf_counter()
+    try:
+        result = run()
+    finally:
+        elapsed = time.perf_counter() - start
+        done.set()
+        thread.join()
+    return result, elapsed, max(waits, default=0.0), len(failures)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--checkins', type=int, default=200000)
+    parser.add_argument('--orphans', type=int, default=50000)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--skip-legacy', action='store_true', help='only time the batched cleanup')
+    args = parser.parse_args()
+
+    m = load_app()
+    with m.app.app_context():
+        generate(m, members=max(100, args.checkins // 20), checkins_per_member=20, log=lambda line: None)
+        print(f"{m.Checkin.query.count()} check-ins, {args.orphans} of them orphaned")
+
+        if not args.skip_legacy:
+            seed_orphans(m, args.orphans)
+            m.db.session.remove()
+            deleted, seconds, wait, failed = worst_write_wait(m, lambda: legacy_cleanup(m))
+            print(f"{'per-row loop':>14}: {deleted} deleted in {seconds:.2f}s, "
+                  f"writers waited up to {wait:.0f} ms, {failed} writes failed")
+
+        seed_orphans(m, args.orphans)
+        m.db.session.remove()
+        report, seconds, wait, failed = worst_write_wait(m, lambda: m.cleanup_orphans(args.batch_size))
+        print(f"{'batched':>14}: {report['checkin'][0]} deleted in {seconds:.2f}s (including rollup repair), "
+              f"writers waited up to {wait:.0f} ms, {failed} writes failed")
+
+if __name__ == '__main__':
+    main()
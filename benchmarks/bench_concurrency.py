@@ -0,0 +1,91 @@
+"""Parallel check-ins from several gunicorn-style worker processes.
+
+Each worker process imports app.py against the same SQLite file and checks
+in its own slice of members through /checkin/<id>. Run once with the default
+engine settings (WAL, synchronous=NORMAL, busy timeout) and once with the old
+rollback journal and no busy timeout to see the 'database is locked' errors.
+
+Usage: python benchmarks/bench_concurrency.py [--workers 8] [--checkins 200] [--legacy]
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+
+LEGACY_ENV = {'SQLITE_JOURNAL_MODE': 'DELETE', 'SQLITE_SYNCHRONOUS': 'FULL', 'SQLITE_BUSY_TIMEOUT': '0'}
+
+def worker(database_url, member_ids, env, startup_lock, barrier, results):
+    os.environ.update(env)
+    from common import load_app
+    # Start workers one at a time so only the check-ins themselves contend
+    with startup_lock:
+        m = load_app(database_url)
+        client = m.app.test_client()
+        client.post('/login', data={'username': 'admin', 'password': 'Mabutsi@12'})
+    logging.getLogger(m.app.name).disabled = True
+    barrier.wait()
+    ok = locked = other = 0
+    start = time.perf_counter()
+    for member_id in member_ids:
+        try:
+            status = client.get(f'/checkin/{member_id}').status_code
+        except m.OperationalError:
+            status = 500
+        if status == 302:
+            ok += 1
+        elif status == 500:
+            locked += 1
+        else:
+            other += 1
+    results.put((ok, locked, other, time.perf_counter() - start))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--checkins', type=int, default=200, help='check-ins per worker')
+    parser.add_argument('--legacy', action='store_true', help='rollback journal without a busy timeout')
+    args = parser.parse_args()
+
+    env = dict(LEGACY_ENV) if args.legacy else {}
+    os.environ.update(env)
+    fd, path = tempfile.mkstemp(prefix='fitness-bench-', suffix='.db')
+    os.close(fd)
+    database_url = f'sqlite:///{path}'
+    from common import load_app
+    from datagen import generate
+    m = load_app(database_url)
+    with m.app.app_context():
+        generate(m, members=args.workers * args.checkins, checkins_per_member=0, log=lambda line: None)
+        m.db.session.execute(m.Member.__table__.update().values(
+            expiry_date=m.sa_time.sa_today() + m.timedelta(days=30)))
+        m.db.session.commit()
+        m.db.engine.dispose()
+
+    ctx = multiprocessing.get_context('spawn')
+    startup_lock = ctx.Lock()
+    barrier = ctx.Barrier(args.workers)
+    results = ctx.Queue()
+    processes = []
+    for index in range(args.workers):
+        first = index * args.checkins + 1
+        member_ids = list(range(first, first + args.checkins))
+        process = ctx.Process(target=worker, args=(database_url, member_ids, env, startup_lock, barrier, results))
+        process.start()
+        processes.append(process)
+    rows = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    ok = sum(row[0] for row in rows)
+    locked = sum(row[1] for row in rows)
+    wall = max(row[3] for row in rows)
+    mode = 'legacy rollback journal' if args.legacy else 'WAL + busy timeout'
+    print(f"{mode}: {args.workers} workers x {args.checkins} check-ins")
+    print(f"  succeeded {ok}, failed (database is locked) {locked}, other {sum(row[2] for row in rows)}")
+    print(f"  {ok / wall:.0f} check-ins/s")
+    os.remove(path)
+
+if __name__ == '__main__':
+    main()
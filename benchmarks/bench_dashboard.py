@@ -0,0 +1,89 @@
+"""Compare the old full-scan dashboard with the SQL aggregate metrics.
+
+Usage: python benchmarks/bench_dashboard.py [--sizes 10000 100000 1000000]
+"""
+import argparse
+import random
+from collections import Counter
+from datetime import datetime, time, timedelta
+
+from common import load_app, measure
+
+def legacy_dashboard(m, sa_now):
+    """The pre-aggregate dashboard computation, kept for comparison"""
+    sa_today = sa_now.date()
+    sum(1 for member in m.Member.query.all() if member.is_active())
+    upcoming = 0
+    for class_obj in m.GymClass.query.all():
+        if class_obj.time:
+            class_time = datetime.strptime(class_obj.time, '%H:%M').time()
+            if datetime.combine(class_obj.date, class_time) > sa_now:
+                upcoming += 1
+        elif class_obj.date > sa_today:
+            upcoming += 1
+    Counter(c[0] for c in m.GymClass.query.with_entities(m.GymClass.name).all())
+    Counter(t[0] for t in m.GymClass.query.with_entities(m.GymClass.trainer).all() if t[0])
+    sum(p.amount for p in m.Payment.query.all())
+    today = 0
+    for checkin in m.Checkin.query.all():
+        if (checkin.checkin_time + timedelta(hours=2)).date() == sa_today:
+            today += 1
+    m.db.session.expunge_all()
+
+def seed(m, checkins, members=2000):
+    """Bulk insert members, classes, payments and ``checkins`` check-ins"""
+    db = m.db
+    today = datetime.utcnow().date()
+    db.session.execute(m.Checkin.__table__.delete())
+    if not m.Member.query.count():
+        db.session.execute(m.Member.__table__.insert(), [
+            {'name': f'Member {i}', 'membership_type': 'Monthly', 'phone': f'0{i:09d}',
+             'expiry_date': today + timedelta(days=random.randint(-60, 60))}
+            for i in range(members)
+        ])
+        db.session.execute(m.GymClass.__table__.insert(), [
+            {'name': f'Class {i % 12}', 'trainer': f'Trainer {i % 7}',
+             'date': today + timedelta(days=random.randint(-365, 30)), 'time': '08:00'}
+            for i in range(members // 2)
+        ])
+        db.session.execute(m.Payment.__table__.insert(), [
+            {'member_id': random.randint(1, members), 'amount': 300.0, 'method': 'Card',
+             'date': today - timedelta(days=random.randint(0, 365))}
+            for _ in range(members * 5)
+        ])
+    # At most one check-in per member per day, as the unique index requires
+    days = 730
+    slots = random.sample(range(members * days), checkins)
+    sa_today = m.sa_time.sa_today()
+    batch = 50000
+    for offset in range(0, checkins, batch):
+        rows = []
+        for slot in slots[offset:offset + batch]:
+            day = sa_today - timedelta(days=slot % days)
+            opening = m.sa_time.to_utc(datetime.combine(day, time(6)))
+            rows.append({'member_id': slot // days + 1, 'checkin_date': day,
+                         'checkin_time': opening + timedelta(minutes=random.randint(0, 900))})
+        db.session.execute(m.Checkin.__table__.insert(), rows)
+    db.session.commit()
+    m.rebuild_rollups()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    m = load_app()
+    random.seed(42)
+    print(f"{'checkins':>10} {'legacy ms':>12} {'aggregate ms':>14}")
+    with m.app.app_context():
+        for size in args.sizes:
+            seed(m, size)
+            sa_now = m.sa_time.sa_now()
+            legacy = measure(lambda: legacy_dashboard(m, sa_now), args.repeat)
+            # Time cold computations, not metric cache hits
+            aggregate = measure(lambda: (m.metric_cache.clear(), m.dashboard_metrics(sa_now)), args.repeat)
+            print(f"{size:>10} {legacy:>12.1f} {aggregate:>14.1f}")
+
+if __name__ == '__main__':
+    main()
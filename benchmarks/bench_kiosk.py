@@ -0,0 +1,70 @@
+"""Check-in throughput: the members-page GET /checkin/<id> vs the kiosk JSON API.
+
+Each mode checks in a fresh set of active members from --threads parallel
+turnstiles and reports check-ins per second.
+
+Usage: python benchmarks/bench_kiosk.py [--checkins 2000] [--threads 8] [--batch 50]
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from common import load_app
+
+def turnstile(m):
+    client = m.app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': 'Mabutsi@12'})
+    return client
+
+def legacy(m, member_ids):
+    client = turnstile(m)
+    for member_id in member_ids:
+        client.get(f'/checkin/{member_id}')
+
+def kiosk_single(m, member_ids):
+    client = turnstile(m)
+    for member_id in member_ids:
+        client.post('/api/kiosk/checkin', json={'member_id': member_id})
+
+def kiosk_batch(m, member_ids, size):
+    client = turnstile(m)
+    for offset in range(0, len(member_ids), size):
+        client.post('/api/kiosk/checkins', json={'member_ids': member_ids[offset:offset + size]})
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--checkins', type=int, default=2000, help='check-ins per mode')
+    parser.add_argument('--threads', type=int, default=8, help='parallel turnstiles')
+    parser.add_argument('--batch', type=int, default=50, help='members per batch request')
+    args = parser.parse_args()
+
+    m = load_app()
+    modes = [('GET /checkin/<id>', legacy),
+             ('POST /api/kiosk/checkin', kiosk_single),
+             (f'POST /api/kiosk/checkins x{args.batch}', lambda m, ids: kiosk_batch(m, ids, args.batch))]
+    with m.app.app_context():
+        m.db.session.execute(m.Member.__table__.insert(), [
+            {'name': f'Member {i}', 'membership_type': 'Monthly', 'phone': None,
+             'expiry_date': m.sa_time.sa_today() + timedelta(days=30)}
+            for i in range(args.checkins * len(modes))
+        ])
+        m.db.session.commit()
+        first = m.db.session.query(m.db.func.min(m.Member.id)).scalar()
+
+    print(f"{'mode':>30} {'check-ins/s':>12} {'checked in':>11}")
+    for index, (label, run) in enumerate(modes):
+        ids = list(range(first + index * args.checkins, first + (index + 1) * args.checkins))
+        slices = [ids[i::args.threads] for i in range(args.threads)]
+        with m.app.app_context():
+            before = m.Checkin.query.count()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.threads) as pool:
+            list(pool.map(lambda member_ids: run(m, member_ids), slices))
+        elapsed = time.perf_counter() - start
+        with m.app.app_context():
+            done = m.Checkin.query.count() - before
+        print(f"{label:>30} {args.checkins / elapsed:>12.0f} {done:>11}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""Live dashboard counters: SSE fan-out vs every desk reloading the dashboard.
+
+Seeds a throwaway database and connects --desks subscribers to the live
+event broker. Check-ins are committed one at a time; for each, the time
+until every desk has received its delta is recorded, together with the
+queries the broker issued. For comparison, the same refresh done the old
+way - each desk reloading /dashboard - is timed too.
+
+Usage: python benchmarks/bench_live.py [--desks 50] [--checkins 200]
+"""
+import argparse
+import statistics
+import time
+
+from common import load_app, measure
+from datagen import generate
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--members', type=int, default=10000)
+    parser.add_argument('--desks', type=int, default=50)
+    parser.add_argument('--checkins', type=int, default=200)
+    args = parser.parse_args()
+
+    m = load_app()
+    with m.app.app_context():
+        generate(m, args.members, checkins_per_member=5, log=lambda line: None)
+        member_ids = [row[0] for row in m.db.session.query(m.Member.id)
+                      .filter(m.Member.expiry_date >= m.sa_time.sa_today()).limit(args.checkins)]
+        # Make sure everyone is free to check in again today
+        m.db.session.execute(m.Checkin.__table__.delete().where(m.Checkin.checkin_date == m.sa_time.sa_today()))
+        m.db.session.commit()
+
+        # Drive the broker by hand so each poll can be timed; its thread polls once on start
+        broker = m.live_event_brokers[None]
+        broker.interval = 3600
+        desks = [broker.subscribe(m.DEFAULT_BRANCH_ID)[0] for _ in range(args.desks)]
+        time.sleep(0.5)
+        latencies = []
+        for member_id in member_ids:
+            start = time.perf_counter()
+            m.db.session.add(m.Checkin(member_id=member_id))
+            m.db.session.commit()
+            broker.poll()
+            for desk in desks:
+                desk.get_nowait()
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        client = m.app.test_client()
+        client.post('/login', data={'username': 'admin', 'password': 'Mabutsi@12'})
+        client.get('/dashboard')
+
+        def reload():
+            # A check-in only invalidates the check-in metrics; the reload recomputes those
+            m.metric_cache.invalidate_tables({'checkin'})
+            client.get('/dashboard')
+
+        reload_ms = measure(reload, repeat=10)
+
+    print(f"{args.desks} desks, {len(latencies)} check-ins")
+    print(f"  SSE: commit + poll + fan-out to every desk  p50 {statistics.median(latencies):.2f} ms, "
+          f"max {max(latencies):.2f} ms (one log query per worker per poll, whatever the number of desks)")
+    print(f"  reload: /dashboard per desk {reload_ms:.1f} ms x {args.desks} desks = "
+          f"{reload_ms * args.desks:.0f} ms per refresh round")
+
+if __name__ == '__main__':
+    main()
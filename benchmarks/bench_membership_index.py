@@ -0,0 +1,69 @@
+"""Memory and lookup cost of the in-process membership index at 1M members.
+
+Builds the index straight from generated (id, expiry) pairs, so no database
+rows are needed, and compares it with a plain dict of id -> date.
+
+Usage: python benchmarks/bench_membership_index.py [--members 1000000]
+"""
+import argparse
+import random
+import time
+import tracemalloc
+from datetime import timedelta
+
+from common import load_app
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--members', type=int, default=1000000)
+    parser.add_argument('--lookups', type=int, default=100000)
+    args = parser.parse_args()
+
+    m = load_app()
+    rng = random.Random(42)
+    today = m.sa_time.sa_today()
+    rows = [(member_id, today + timedelta(days=rng.randint(-400, 400)))
+            for member_id in range(1, args.members + 1)]
+
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    index = m.MembershipIndex(ttl=float('inf'))
+    index.load(rows)
+    index_bytes = tracemalloc.get_traced_memory()[0] - baseline
+
+    baseline = tracemalloc.get_traced_memory()[0]
+    as_dict = dict(rows)
+    dict_bytes = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    del as_dict
+
+    start = time.perf_counter()
+    index.load(rows)
+    build = time.perf_counter() - start
+
+    ids = [rng.randint(1, args.members) for _ in range(args.lookups)]
+    start = time.perf_counter()
+    for member_id in ids:
+        index.is_active(member_id, today)
+    per_lookup = (time.perf_counter() - start) / args.lookups * 1e6
+
+    start = time.perf_counter()
+    for _ in range(1000):
+        index.count_active(today)
+        index.expiring_within(7, today)
+    per_count = (time.perf_counter() - start) / 2000 * 1e6
+
+    start = time.perf_counter()
+    for member_id in ids[:1000]:
+        index.set(member_id, today + timedelta(days=30))
+    per_update = (time.perf_counter() - start) / 1000 * 1e6
+
+    print(f"{args.members} members")
+    print(f"  index memory:   {index_bytes / 2**20:.1f} MiB (arrays hold {index.nbytes() / 2**20:.1f} MiB), built in {build:.2f}s")
+    print(f"  dict id->date:  {dict_bytes / 2**20:.1f} MiB (dict only; the date objects are shared)")
+    print(f"  is_active:      {per_lookup:.2f} us")
+    print(f"  count queries:  {per_count:.2f} us")
+    print(f"  update:         {per_update:.2f} us")
+
+if __name__ == '__main__':
+    main()
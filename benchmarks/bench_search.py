@@ -0,0 +1,60 @@
+"""Member search latency: leading-wildcard ILIKE vs the trigram search index.
+
+Usage: python benchmarks/bench_search.py [--members 100000]
+"""
+import argparse
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from common import load_app
+
+FIRST = ['Thabo', 'Lerato', 'Sipho', 'Naledi', 'John', 'Mary', 'Pieter', 'Anele', 'Kagiso', 'Zanele',
+         'Johan', 'Ayanda', 'Bongani', 'Karabo', 'Lindiwe', 'Mpho', 'Nomsa', 'Tshepo', 'Sarah', 'David']
+LAST = ['Mokoena', 'Dlamini', 'Nkosi', 'van der Merwe', 'Smith', 'Botha', 'Naidoo', 'Khumalo',
+        'Pillay', 'Mabutsi', 'Mahlangu', 'Ndlovu', 'Coetzee', 'Zulu', 'Sithole', 'Jacobs']
+QUERIES = ['thabo', 'mokoena', 'van der', 'khumal', 'mokeona', 'dlamni', '0821', '08212345', 'zz']
+
+def seed(m, count):
+    today = m.sa_time.sa_today()
+    rows = [{'name': f'{random.choice(FIRST)} {random.choice(LAST)} {i}',
+             'membership_type': 'Monthly',
+             'phone': f'08{random.randint(0, 99999999):08d}',
+             'expiry_date': today + timedelta(days=random.randint(-90, 365))}
+            for i in range(count)]
+    for offset in range(0, count, 20000):
+        m.db.session.execute(m.Member.__table__.insert(), rows[offset:offset + 20000])
+    m.db.session.commit()
+
+def timings(fn, queries, repeat):
+    samples = []
+    for _ in range(repeat):
+        for query in queries:
+            start = time.perf_counter()
+            fn(query)
+            samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--members', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    m = load_app()
+    random.seed(42)
+    with m.app.app_context():
+        seed(m, args.members)
+        ilike = lambda q: m.Member.query.filter(m.Member.name.ilike(f'%{q}%')).limit(10).all()
+        print(f"{args.members} members, search backend: {m.app.config['SEARCH_BACKEND']}")
+        print(f"{'query':>10} {'ilike hits':>11} {'index hits':>11}")
+        for query in QUERIES:
+            print(f"{query:>10} {len(ilike(query)):>11} {len(m.search_members(query)):>11}")
+        for label, fn in [('ilike', ilike), ('index', m.search_members)]:
+            median, p95 = timings(fn, QUERIES, args.repeat)
+            print(f"{label:>6}: median {median:.2f} ms, p95 {p95:.2f} ms")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+"""Shared helpers for the benchmark scripts.
+
+Benchmarks run against a throwaway SQLite database so they never touch
+fitness.db. Import ``load_app`` before anything else from app.py.
+"""
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def load_app(database_url=None):
+    """Import app.py against a fresh database and return the module"""
+    if database_url is None:
+        fd, path = tempfile.mkstemp(prefix='fitness-bench-', suffix='.db')
+        os.close(fd)
+        database_url = f'sqlite:///{path}'
+    os.environ['DATABASE_URL'] = database_url
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    import app as app_module
+    return app_module
+
+def measure(fn, repeat=5):
+    """Run fn ``repeat`` times and return the median wall time in ms"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
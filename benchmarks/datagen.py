@@ -0,0 +1,143 @@
+"""Synthetic gym data generator for load tests and benchmarks.
+
+Bulk-creates members, trainers, classes, payments and check-ins through the
+existing models' tables, then rebuilds the daily rollups. The same --seed
+always produces the same data.
+
+Usage: python benchmarks/datagen.py --members 100000 [--database-url sqlite:///big.db]
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+from datetime import time as dtime
+
+from common import load_app
+
+FIRST = ['Thabo', 'Lerato', 'Sipho', 'Naledi', 'John', 'Mary', 'Pieter', 'Anele', 'Kagiso', 'Zanele',
+         'Johan', 'Ayanda', 'Bongani', 'Karabo', 'Lindiwe', 'Mpho', 'Nomsa', 'Tshepo', 'Sarah', 'David']
+LAST = ['Mokoena', 'Dlamini', 'Nkosi', 'van der Merwe', 'Smith', 'Botha', 'Naidoo', 'Khumalo',
+        'Pillay', 'Mabutsi', 'Mahlangu', 'Ndlovu', 'Coetzee', 'Zulu', 'Sithole', 'Jacobs']
+# Weighted like a real gym: mostly monthly debit orders, a few annual and custom deals
+MEMBERSHIP_TYPES = [('Monthly', 70), ('Quarterly', 18), ('Yearly', 10), ('Custom', 2)]
+MEMBERSHIP_DAYS = {'Monthly': 30, 'Quarterly': 90, 'Yearly': 365, 'Custom': 60}
+PRICES = {'Monthly': 300, 'Quarterly': 800, 'Yearly': 3000, 'Custom': 500}
+METHODS = [('Card', 55), ('EFT', 30), ('Cash', 15)]
+SPECIALTIES = ['Personal Training', 'Yoga', 'Pilates', 'CrossFit', 'Weightlifting', 'Cardio',
+               'Boxing', 'Martial Arts', 'Dance', 'Nutrition', 'Rehabilitation', 'Senior Fitness']
+CLASS_NAMES = ['Spin', 'Yoga Flow', 'Pilates Core', 'HIIT', 'Boxfit', 'Zumba', 'Bootcamp',
+               'Power Lift', 'Stretch & Mobility', 'Aqua Aerobics', 'Kickboxing', 'Circuit']
+CLASS_TIMES = ['06:00', '07:00', '09:00', '12:30', '17:00', '17:30', '18:00', '19:00']
+
+def weighted(rng, choices):
+    values, weights = zip(*choices)
+    return rng.choices(values, weights)[0]
+
+def batched(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def member_rows(rng, count, sa_today):
+    for i in range(count):
+        membership_type = weighted(rng, MEMBERSHIP_TYPES)
+        # About three quarters of the members are still active
+        days_left = rng.randint(-MEMBERSHIP_DAYS[membership_type], MEMBERSHIP_DAYS[membership_type] * 3)
+        yield {'name': f'{rng.choice(FIRST)} {rng.choice(LAST)} {i + 1}',
+               'membership_type': membership_type,
+               'phone': f'0{rng.choice("678")}{rng.randint(0, 99999999):08d}' if rng.random() < 0.9 else None,
+               'expiry_date': sa_today + timedelta(days=days_left)}
+
+def trainer_rows(rng, count):
+    for _ in range(count):
+        yield {'name': f'{rng.choice(FIRST)} {rng.choice(LAST)}',
+               'specialty': rng.choice(SPECIALTIES),
+               'contact': f'0{rng.choice("678")}{rng.randint(0, 99999999):08d}'}
+
+def class_rows(rng, count, trainers, sa_today, days):
+    for _ in range(count):
+        yield {'name': rng.choice(CLASS_NAMES),
+               'trainer': rng.choice(trainers),
+               'date': sa_today + timedelta(days=rng.randint(-days, 30)),
+               'time': rng.choice(CLASS_TIMES),
+               'capacity': rng.choice([10, 12, 15, 20, 25])}
+
+def payment_rows(rng, members, sa_today, days):
+    for member_id, membership_type, expiry_date in members:
+        # One payment per membership period, walking back from the expiry date
+        period = MEMBERSHIP_DAYS[membership_type]
+        day = expiry_date - timedelta(days=period)
+        while day > sa_today - timedelta(days=days) and day <= sa_today:
+            yield {'member_id': member_id, 'amount': float(PRICES[membership_type]),
+                   'method': weighted(rng, METHODS), 'date': day}
+            day -= timedelta(days=period)
+
+def checkin_rows(rng, member_ids, per_member, sa_today, days, to_utc):
+    for member_id in member_ids:
+        visits = min(days, max(0, int(rng.gauss(per_member, per_member / 3))))
+        # At most one check-in per member per SA day, as the unique index requires
+        for back in rng.sample(range(days), visits):
+            day = sa_today - timedelta(days=back)
+            opening = to_utc(datetime.combine(day, dtime(5, 30)))
+            yield {'member_id': member_id, 'checkin_date': day,
+                   'checkin_time': opening + timedelta(minutes=rng.randint(0, 16 * 60))}
+
+def generate(m, members=1000, checkins_per_member=10, days=365, seed=42, batch_size=20000, log=print):
+    """Fill the app's database (the current branch) with a reproducible gym of ``members`` members"""
+    rng = random.Random(seed)
+    db = m.db
+    sa_today = m.sa_time.sa_today()
+
+    def insert(model, rows):
+        total = 0
+        for batch in batched(rows, batch_size):
+            db.session.execute(model.__table__.insert(), batch)
+            total += len(batch)
+        return total
+
+    started = time.perf_counter()
+    # Rows go to the current branch; ids are shared with every other branch in the database
+    with m.all_branches():
+        first_id = (db.session.query(db.func.max(m.Member.id)).scalar() or 0) + 1
+    counts = {'members': insert(m.Member, member_rows(rng, members, sa_today))}
+    trainers = list(trainer_rows(rng, max(5, members // 200)))
+    counts['trainers'] = insert(m.Trainer, trainers)
+    trainer_names = [trainer['name'] for trainer in trainers]
+    counts['classes'] = insert(m.GymClass, class_rows(rng, max(50, members // 10), trainer_names, sa_today, days))
+    db.session.commit()
+
+    new_members = db.session.query(m.Member.id, m.Member.membership_type, m.Member.expiry_date) \
+        .filter(m.Member.id >= first_id).order_by(m.Member.id).yield_per(batch_size)
+    counts['payments'] = insert(m.Payment, payment_rows(rng, new_members, sa_today, days))
+    member_ids = range(first_id, first_id + members)
+    counts['checkins'] = insert(m.Checkin, checkin_rows(rng, member_ids, checkins_per_member,
+                                                        sa_today, days, m.sa_time.to_utc))
+    db.session.commit()
+    # Core inserts bypass the flush hooks, so rebuild the rollups in one pass
+    m.rebuild_rollups()
+    m.metric_cache.clear()
+    log(', '.join(f'{count} {name}' for name, count in counts.items())
+        + f' in {time.perf_counter() - started:.1f}s')
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--members', type=int, default=1000)
+    parser.add_argument('--checkins-per-member', type=int, default=10)
+    parser.add_argument('--days', type=int, default=365, help='history to spread payments and check-ins over')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--database-url', help='target database (default: a throwaway SQLite file)')
+    args = parser.parse_args()
+
+    m = load_app(args.database_url)
+    with m.app.app_context():
+        print(f"Generating into {m.db.engine.url.render_as_string(hide_password=True)}")
+        generate(m, args.members, args.checkins_per_member, args.days, args.seed)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+"""Latency percentiles for the busiest pages, saved as JSON for comparing commits.
+
+Seeds a throwaway database with datagen.py, then drives /dashboard, /members,
+/checkins, /api/search_members and /checkin/<id> through the Flask test client.
+With --concurrency N, N simulated front-desk users hit randomly chosen
+endpoints at the same time (locust-style). With --base-url the same load is
+sent over HTTP to a running server (e.g. gunicorn) instead.
+
+Usage: python benchmarks/loadtest.py [--members 10000] [--requests 200]
+                                     [--concurrency 8] [--output results.json]
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import platform
+import random
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from common import ROOT, load_app
+from datagen import FIRST, LAST, generate
+
+ENDPOINTS = ['dashboard', 'members', 'checkins', 'search', 'checkin']
+SEARCHES = [name.lower() for name in FIRST + LAST] + ['0821', '0723', 'mokeona', 'dlamni']
+
+class TestClientUser:
+    """A logged-in staff session on the Flask test client"""
+    def __init__(self, app, username, password):
+        self.client = app.test_client()
+        self.client.post('/login', data={'username': username, 'password': password})
+
+    def get(self, path):
+        return self.client.get(path).status_code
+
+class HttpUser:
+    """A logged-in staff session against a running server"""
+    def __init__(self, base_url, username, password):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        data = urllib.parse.urlencode({'username': username, 'password': password}).encode()
+        self.opener.open(f'{self.base_url}/login', data).read()
+
+    def get(self, path):
+        try:
+            with self.opener.open(f'{self.base_url}{path}') as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as error:
+            return error.code
+
+def endpoint_path(name, rng, member_ids):
+    if name == 'search':
+        return f'/api/search_members?q={urllib.parse.quote(rng.choice(SEARCHES))}'
+    if name == 'checkin':
+        return f'/checkin/{rng.choice(member_ids)}'
+    return f'/{name}'
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not samples:
+        return None
+    rank = max(1, int(round(pct / 100 * len(samples))))
+    return samples[min(rank, len(samples)) - 1]
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {'count': len(samples),
+            'p50_ms': percentile(samples, 50),
+            'p95_ms': percentile(samples, 95),
+            'p99_ms': percentile(samples, 99),
+            'max_ms': samples[-1] if samples else None}
+
+def timed(user, path):
+    start = time.perf_counter()
+    status = user.get(path)
+    return (time.perf_counter() - start) * 1000, status
+
+def run_sequential(make_user, endpoints, requests, member_ids, seed):
+    """Each endpoint on its own, one request at a time"""
+    user = make_user()
+    rng = random.Random(seed)
+    results = {}
+    for name in endpoints:
+        user.get(endpoint_path(name, rng, member_ids))  # warm-up
+        samples, errors = [], 0
+        for _ in range(requests):
+            elapsed, status = timed(user, endpoint_path(name, rng, member_ids))
+            samples.append(elapsed)
+            errors += status >= 500
+        results[name] = dict(summarize(samples), errors=errors)
+    return results
+
+def run_concurrent(make_user, endpoints, requests, member_ids, seed, concurrency):
+    """``concurrency`` users each firing ``requests`` randomly chosen requests"""
+    samples = {name: [] for name in endpoints}
+    errors = dict.fromkeys(endpoints, 0)
+    lock = threading.Lock()
+
+    def user_session(index):
+        user = make_user()
+        rng = random.Random(seed + index)
+        for _ in range(requests):
+            name = rng.choice(endpoints)
+            elapsed, status = timed(user, endpoint_path(name, rng, member_ids))
+            with lock:
+                samples[name].append(elapsed)
+                errors[name] += status >= 500
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(user_session, range(concurrency)))
+    wall = time.perf_counter() - start
+    results = {name: dict(summarize(samples[name]), errors=errors[name]) for name in endpoints}
+    results['_throughput_rps'] = round(concurrency * requests / wall, 1)
+    return results
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_table(results, baseline=None):
+    print(f"{'endpoint':>10} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}"
+          + (f" {'p95 vs base':>12}" if baseline else ''))
+    for name, row in results.items():
+        if name.startswith('_'):
+            continue
+        line = (f"{name:>10} {row['count']:>6} {row['p50_ms']:>9.2f} {row['p95_ms']:>9.2f} "
+                f"{row['p99_ms']:>9.2f} {row['errors']:>7}")
+        base = (baseline or {}).get(name)
+        if base and base.get('p95_ms'):
+            line += f" {(row['p95_ms'] / base['p95_ms'] - 1) * 100:>+11.1f}%"
+        print(line)
+    if '_throughput_rps' in results:
+        print(f"throughput: {results['_throughput_rps']} requests/s")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--members', type=int, default=10000)
+    parser.add_argument('--checkins-per-member', type=int, default=10)
+    parser.add_argument('--requests', type=int, default=200, help='requests per endpoint (per user when concurrent)')
+    parser.add_argument('--concurrency', type=int, default=0, help='simulated users firing at once (0: sequential)')
+    parser.add_argument('--endpoints', nargs='+', choices=ENDPOINTS, default=ENDPOINTS)
+    parser.add_argument('--base-url', help='load-test a running server instead of the test client')
+    parser.add_argument('--database-url', help='reuse an existing database instead of generating one')
+    parser.add_argument('--username', default='admin')
+    parser.add_argument('--password', default='Mabutsi@12')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='JSON results file (default: benchmarks/results/loadtest-<commit>.json)')
+    parser.add_argument('--compare', help='earlier results file to show p95 changes against')
+    args = parser.parse_args()
+
+    m = load_app(args.database_url)
+    with m.app.app_context():
+        if not args.database_url:
+            generate(m, args.members, args.checkins_per_member, seed=args.seed)
+        member_ids = [row[0] for row in m.db.session.query(m.Member.id)
+                      .filter(m.Member.expiry_date >= m.sa_time.sa_today()).all()]
+        counts = {'members': m.Member.query.count(), 'checkins': m.Checkin.query.count(),
+                  'payments': m.Payment.query.count()}
+        backend = m.db.engine.url.get_backend_name()
+
+    if args.base_url:
+        make_user = lambda: HttpUser(args.base_url, args.username, args.password)
+    else:
+        make_user = lambda: TestClientUser(m.app, args.username, args.password)
+    if args.concurrency:
+        results = run_concurrent(make_user, args.endpoints, args.requests, member_ids,
+                                 args.seed, args.concurrency)
+    else:
+        results = run_sequential(make_user, args.endpoints, args.requests, member_ids, args.seed)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+    print_table(results, baseline)
+
+    commit = git_commit()
+    output = args.output or os.path.join(ROOT, 'benchmarks', 'results', f'loadtest-{commit or "local"}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    report = {'commit': commit, 'timestamp': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+              'python': platform.python_version(), 'target': args.base_url or 'test-client',
+              'database': backend, 'data': counts,
+              'requests': args.requests, 'concurrency': args.concurrency, 'seed': args.seed,
+              'results': results}
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {output}")
+
+if __name__ == '__main__':
+    main()
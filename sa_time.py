@@ -0,0 +1,72 @@
+"""South African local time for Fitness Club.
+
+The database stores naive UTC datetimes (``datetime.utcnow``) and naive
+calendar dates. Everything the staff see - "today", "this week", "this
+month" - is Africa/Johannesburg local time. These helpers convert between
+the two, and turn local days, weeks and months into half-open UTC ranges
+``[start, end)`` that can be compared directly against indexed datetime
+columns instead of shifting every row.
+"""
+from datetime import date, datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+SA_TZ = ZoneInfo('Africa/Johannesburg')
+
+def utc_now():
+    """Current time as naive UTC, the way DateTime columns store it"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def to_sa(utc_naive):
+    """Naive UTC datetime -> naive SA-local datetime"""
+    return utc_naive.replace(tzinfo=timezone.utc).astimezone(SA_TZ).replace(tzinfo=None)
+
+def to_utc(sa_naive):
+    """Naive SA-local datetime -> naive UTC datetime"""
+    return sa_naive.replace(tzinfo=SA_TZ).astimezone(timezone.utc).replace(tzinfo=None)
+
+def sa_now():
+    return to_sa(utc_now())
+
+def sa_today():
+    return sa_now().date()
+
+def sa_day(utc_naive):
+    """SA-local calendar day a UTC timestamp falls on"""
+    return to_sa(utc_naive).date()
+
+def utc_offset_hours():
+    """SA's offset from UTC; fixed at +2 (no daylight saving), used for SQL date shifts"""
+    return int(SA_TZ.utcoffset(datetime(2000, 1, 1)).total_seconds() // 3600)
+
+def day_start(day):
+    """UTC instant at which SA-local ``day`` begins"""
+    return to_utc(datetime.combine(day, time.min))
+
+def days_range(first_day, last_day):
+    """UTC [start, end) covering SA-local days first_day..last_day inclusive"""
+    return day_start(first_day), day_start(last_day + timedelta(days=1))
+
+def day_range(day):
+    return days_range(day, day)
+
+def week_start(day):
+    """Monday of the week containing ``day``"""
+    return day - timedelta(days=day.weekday())
+
+def month_start(day):
+    return day.replace(day=1)
+
+def add_months(day, months):
+    """First of the month ``months`` calendar months after ``day``'s month"""
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+def week_range(day):
+    """UTC [start, end) of the Monday-to-Sunday SA week containing ``day``"""
+    first = week_start(day)
+    return days_range(first, first + timedelta(days=6))
+
+def month_range(day):
+    """UTC [start, end) of the SA calendar month containing ``day``"""
+    first = month_start(day)
+    return day_start(first), day_start(add_months(first, 1))
@@ -77,10 +77,19 @@ document.addEventListener('DOMContentLoaded', function() {
 });
 
 // Quick Member Search Function
+let searchController = null;
+let searchTimer = null;
+
 function quickSearchMember() {
     const searchTerm = document.getElementById('quickSearch').value.trim();
     const resultsDiv = document.getElementById('quickSearchResults');
     
+    // Cancel any search still in flight so stale results never overwrite new ones
+    clearTimeout(searchTimer);
+    if (searchController) {
+        searchController.abort();
+    }
+    
     if (!searchTerm) {
         resultsDiv.innerHTML = '<p style="color: #666;">Please enter a member name to search</p>';
         return;
@@ -89,8 +98,8 @@ function quickSearchMember() {
     // Show loading
     resultsDiv.innerHTML = '<p>Searching...</p>';
     
-    // Simple AJAX search
-    fetch(`/api/search_members?q=${encodeURIComponent(searchTerm)}`)
+    searchController = new AbortController();
+    fetch(`/api/search_members?q=${encodeURIComponent(searchTerm)}`, { signal: searchController.signal })
         .then(response => {
             if (!response.ok) {
                 throw new Error('Network response was not ok');
@@ -101,11 +110,20 @@ function quickSearchMember() {
             displaySearchResults(data);
         })
         .catch(error => {
+            if (error.name === 'AbortError') {
+                return;
+            }
             console.error('Search error:', error);
             resultsDiv.innerHTML = '<p style="color: red;">Search error. Please try again.</p>';
         });
 }
 
+// Search as the user types, once they pause for a moment
+function debouncedSearchMember() {
+    clearTimeout(searchTimer);
+    searchTimer = setTimeout(quickSearchMember, 250);
+}
+
 // Handle Enter key in search input
 document.addEventListener('DOMContentLoaded', function() {
     const searchInput = document.getElementById('quickSearch');
@@ -115,6 +133,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 quickSearchMember();
             }
         });
+        searchInput.addEventListener('input', debouncedSearchMember);
     }
 });
 
@@ -258,6 +277,46 @@ function sendSingleReminder(memberId) {
         });
 }
 
+// Send every pending reminder as one background job and poll until it finishes
+function sendAllReminders() {
+    showNotification('Queueing SMS reminders...', 'info');
+    
+    fetch('/send_reminders', { method: 'POST' })
+        .then(response => response.json())
+        .then(result => {
+            if (!result.success) {
+                showNotification(result.message, 'info');
+                return;
+            }
+            pollReminderJob(result.job.id);
+        })
+        .catch(error => {
+            console.error('Error queueing reminders:', error);
+            showNotification('Error queueing SMS reminders', 'error');
+        });
+}
+
+function pollReminderJob(jobId) {
+    fetch(`/reminder_jobs/${jobId}`)
+        .then(response => response.json())
+        .then(result => {
+            const job = result.job;
+            if (job.state === 'queued' || job.state === 'running') {
+                setTimeout(() => pollReminderJob(jobId), 1000);
+            } else if (job.state === 'done') {
+                const failed = job.failed ? `, ${job.failed} failed` : '';
+                showNotification(`📱 ${job.sent} SMS reminders sent${failed}`, job.failed ? 'error' : 'success');
+                loadMembersNeedingReminders();
+            } else {
+                showNotification('Sending SMS reminders failed', 'error');
+            }
+        })
+        .catch(error => {
+            console.error('Error checking reminder job:', error);
+            showNotification('Error checking SMS reminder job', 'error');
+        });
+}
+
 function sendTestReminder() {
     // Find first member with phone number for testing
     fetch('/api/members_with_phones')
@@ -389,6 +448,85 @@ function initializeTableSearch() {
     });
 }
 
+// Infinite scroll for paginated tables: fetch the next page of rows when the
+// "Load more" sentinel under a table scrolls into view
+function loadMoreRows(sentinel) {
+    if (sentinel.dataset.loading) {
+        return;
+    }
+    sentinel.dataset.loading = '1';
+
+    const url = new URL(sentinel.dataset.endpoint, window.location.origin);
+    url.searchParams.set('after', sentinel.dataset.cursor);
+
+    fetch(url)
+        .then(response => {
+            if (!response.ok) {
+                throw new Error('Network response was not ok');
+            }
+            return response.json();
+        })
+        .then(page => {
+            document.getElementById(sentinel.dataset.target).insertAdjacentHTML('beforeend', page.html);
+            if (page.next_cursor) {
+                sentinel.dataset.cursor = page.next_cursor;
+                delete sentinel.dataset.loading;
+                // Re-observe so a sentinel that is still visible loads the next page too
+                if (sentinel.observer) {
+                    sentinel.observer.unobserve(sentinel);
+                    sentinel.observer.observe(sentinel);
+                }
+            } else {
+                if (sentinel.observer) {
+                    sentinel.observer.disconnect();
+                }
+                sentinel.remove();
+            }
+        })
+        .catch(error => {
+            console.error('Error loading rows:', error);
+            delete sentinel.dataset.loading;
+            showNotification('Error loading more rows', 'error');
+        });
+}
+
+function initializeInfiniteScroll() {
+    document.querySelectorAll('.load-more').forEach(sentinel => {
+        sentinel.querySelector('button').addEventListener('click', () => loadMoreRows(sentinel));
+        if ('IntersectionObserver' in window) {
+            sentinel.observer = new IntersectionObserver(entries => {
+                if (entries.some(entry => entry.isIntersecting)) {
+                    loadMoreRows(sentinel);
+                }
+            }, { rootMargin: '200px' });
+            sentinel.observer.observe(sentinel);
+        }
+    });
+}
+
+// Live counters: elements marked data-live="<kind>" add the deltas pushed over
+// /events for that kind, when the change falls in their data-live-range
+// (day, week, month or all). The browser reconnects and catches up by itself
+function initializeLiveCounters() {
+    const counters = document.querySelectorAll('[data-live]');
+    if (!counters.length || !window.EventSource) {
+        return;
+    }
+    const source = new EventSource('/events');
+    source.addEventListener('delta', event => {
+        const delta = JSON.parse(event.data);
+        counters.forEach(counter => {
+            if (counter.dataset.live !== delta.kind || !delta.ranges.includes(counter.dataset.liveRange || 'all')) {
+                return;
+            }
+            const money = counter.dataset.liveField === 'amount';
+            const value = parseFloat(counter.dataset.value || '0') + (money ? delta.amount : delta.count);
+            counter.dataset.value = value;
+            counter.textContent = money ? 'R' + value.toFixed(2) : value;
+        });
+    });
+}
+
 // Auto-expire memberships check
 function checkExpiredMemberships() {
     const today = new Date().toISOString().split('T')[0];
@@ -437,6 +575,12 @@ function animateQuickSearch() {
 document.addEventListener('DOMContentLoaded', function() {
     // Initialize search functionality
     initializeTableSearch();
+
+    // Lazy-load further pages of long tables
+    initializeInfiniteScroll();
+
+    // Keep dashboard and check-in counters current without reloading
+    initializeLiveCounters();
     
     // Check for expired memberships
     checkExpiredMemberships();
@@ -461,16 +605,6 @@ document.addEventListener('DOMContentLoaded', function() {
             showNotification('Welcome to Fitness Club Dashboard!', 'info');
         }
     }, 1000);
-    
-    // Add enter key support for quick search
-    const quickSearchInput = document.getElementById('quickSearch');
-    if (quickSearchInput) {
-        quickSearchInput.addEventListener('keypress', function(e) {
-            if (e.key === 'Enter') {
-                quickSearchMember();
-            }
-        });
-    }
 });
 
 // Make functions globally available
@@ -483,3 +617,4 @@ window.takePayment = takePayment;
 window.loadMembersNeedingReminders = loadMembersNeedingReminders;
 window.sendSingleReminder = sendSingleReminder;
 window.sendTestReminder = sendTestReminder;
+window.sendAllReminders = sendAllReminders;
@@ -0,0 +1,27 @@
+"""Shared fixtures: app.py imported once against a throwaway SQLite database."""
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture(scope='session')
+def m():
+    """The app module, imported against a fresh database with app.testing on"""
+    fd, path = tempfile.mkstemp(prefix='fitness-test-', suffix='.db')
+    os.close(fd)
+    os.environ['DATABASE_URL'] = f'sqlite:///{path}'
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    import app as app_module
+    app_module.app.testing = True
+    yield app_module
+    os.remove(path)
+
+@pytest.fixture
+def client(m):
+    client = m.app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': 'Mabutsi@12'})
+    return client
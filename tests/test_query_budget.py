@@ -0,0 +1,45 @@
+"""The busiest pages stay within QUERY_COUNT_LIMIT, which app.testing enforces."""
+from datetime import timedelta
+
+import pytest
+
+MEMBERS = 80  # more than one page, so a per-row query would blow the budget
+
+@pytest.fixture(scope='module')
+def seeded(m):
+    with m.app.app_context():
+        today = m.sa_time.sa_today()
+        now = m.sa_time.utc_now()
+        members = [m.Member(name=f'Member {i}', membership_type=('Monthly', 'Yearly', 'Quarterly')[i % 3],
+                            phone=f'082{i:07d}', expiry_date=today + timedelta(days=(i % 40) - 10))
+                   for i in range(MEMBERS)]
+        m.db.session.add_all(members)
+        m.db.session.add_all([m.Trainer(name=f'Trainer {i}', specialty='Strength', contact='-') for i in range(3)])
+        m.db.session.flush()
+        for i, member in enumerate(members):
+            m.db.session.add(m.Payment(member=member, amount=300, date=today - timedelta(days=i % 20),
+                                       method=('Cash', 'Card')[i % 2]))
+            for days_ago in range(3):
+                m.db.session.add(m.Checkin(member=member, checkin_time=now - timedelta(days=days_ago)))
+        for day in range(5):
+            m.db.session.add(m.GymClass(name=f'Class {day}', trainer=f'Trainer {day % 3}',
+                                        date=today + timedelta(days=day), time='18:00', capacity=20,
+                                        starts_at=m.sa_time.day_start(today + timedelta(days=day)) + timedelta(hours=16)))
+        m.db.session.commit()
+
+@pytest.mark.parametrize('path', ['/members', '/payments', '/checkins', '/dashboard'])
+def test_page_stays_within_query_budget(m, client, seeded, path):
+    # Worst case: nothing cached from an earlier request
+    m.metric_cache.clear()
+    response = client.get(path)
+    assert response.status_code == 200
+    assert int(response.headers['X-Query-Count']) <= m.app.config['QUERY_COUNT_LIMIT']
+
+def test_n_plus_one_raises(m, seeded):
+    with m.app.test_request_context('/checkins'):
+        m.app.preprocess_request()
+        # Lazy-loading each check-in's member fires one SELECT per member
+        names = [checkin.member.name for checkin in m.Checkin.query.limit(MEMBERS)]
+        assert len(names) == MEMBERS
+        with pytest.raises(m.TooManyQueriesError):
+            m.app.process_response(m.Response())
@@ -0,0 +1,101 @@
+"""Parallel check-ins from several worker processes against one SQLite file.
+
+Each process imports app.py on its own, as a gunicorn worker does, and checks
+members in through /checkin/<id>. Under WAL with the busy timeout no writer
+may fail with 'database is locked', and every check-in must land exactly once.
+"""
+import multiprocessing
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKERS = 6
+CHECKINS_PER_WORKER = 40
+
+def load_app(database_url):
+    os.environ['DATABASE_URL'] = database_url
+    os.environ.pop('SQLITE_JOURNAL_MODE', None)
+    os.environ.pop('SQLITE_BUSY_TIMEOUT', None)
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    import app as app_module
+    return app_module
+
+def seed(database_url, members):
+    m = load_app(database_url)
+    with m.app.app_context():
+        expiry = m.sa_time.sa_today() + m.timedelta(days=30)
+        m.db.session.add_all([m.Member(name=f'Member {i}', membership_type='Monthly', expiry_date=expiry)
+                              for i in range(members)])
+        m.db.session.commit()
+        journal_mode = m.db.session.execute(m.text('PRAGMA journal_mode')).scalar()
+        m.db.engine.dispose()
+    return journal_mode
+
+def check_in(database_url, member_ids, startup_lock, barrier, results):
+    # Start workers one at a time so only the check-ins themselves contend
+    with startup_lock:
+        m = load_app(database_url)
+        client = m.app.test_client()
+        client.post('/login', data={'username': 'admin', 'password': 'Mabutsi@12'})
+    barrier.wait()
+    errors = []
+    for member_id in member_ids:
+        try:
+            status = client.get(f'/checkin/{member_id}').status_code
+            if status != 302:
+                errors.append(f'member {member_id}: HTTP {status}')
+        except m.OperationalError as e:
+            errors.append(f'member {member_id}: {e.orig}')
+    results.put(errors)
+
+def run_workers(ctx, database_url, slices):
+    startup_lock, barrier, results = ctx.Lock(), ctx.Barrier(len(slices)), ctx.Queue()
+    processes = [ctx.Process(target=check_in, args=(database_url, member_ids, startup_lock, barrier, results))
+                 for member_ids in slices]
+    for process in processes:
+        process.start()
+    errors = [error for _ in processes for error in results.get(timeout=120)]
+    for process in processes:
+        process.join(timeout=30)
+        assert process.exitcode == 0
+    return errors
+
+def checkin_count(ctx, database_url):
+    with ctx.Pool(1) as pool:
+        return pool.apply(count_checkins, (database_url,))
+
+def count_checkins(database_url):
+    m = load_app(database_url)
+    with m.app.app_context():
+        return m.db.session.execute(m.text('SELECT COUNT(*), COUNT(DISTINCT member_id) FROM checkin')).one()
+
+@pytest.fixture
+def database_url(tmp_path):
+    return f"sqlite:///{tmp_path / 'concurrency.db'}"
+
+def test_parallel_checkins_never_lock(database_url):
+    ctx = multiprocessing.get_context('spawn')
+    members = WORKERS * CHECKINS_PER_WORKER
+    with ctx.Pool(1) as pool:
+        assert pool.apply(seed, (database_url, members)) == 'wal'
+
+    slices = [list(range(index * CHECKINS_PER_WORKER + 1, (index + 1) * CHECKINS_PER_WORKER + 1))
+              for index in range(WORKERS)]
+    assert run_workers(ctx, database_url, slices) == []
+    assert tuple(checkin_count(ctx, database_url)) == (members, members)
+
+def test_parallel_duplicate_checkins_land_once(database_url):
+    ctx = multiprocessing.get_context('spawn')
+    members = CHECKINS_PER_WORKER
+    with ctx.Pool(1) as pool:
+        pool.apply(seed, (database_url, members))
+
+    # Every worker checks in the same members, in a different order, so the unique
+    # daily index is what keeps each one to a single row
+    member_ids = list(range(1, members + 1))
+    slices = [member_ids[index:] + member_ids[:index] for index in range(WORKERS)]
+    assert run_workers(ctx, database_url, slices) == []
+    assert tuple(checkin_count(ctx, database_url)) == (members, members)